@@ -0,0 +1,3 @@
+from subreddit_recommender.src.cli import main
+
+main()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""One command for every stage of the pipeline.
+
+    python -m subreddit_recommender list
+    python -m subreddit_recommender crawl --resume
+    python -m subreddit_recommender features tfidf --incremental
+    python -m subreddit_recommender --profile-imports serve --port 8000
+
+Only argparse and the standard library are loaded up front. The module of a stage, and with it praw,
+numpy, scipy or gensim, is imported when that stage runs, so a list refresh or a health check does not
+pay for the models. Everything after the command (and stage) is handed to the main() of the module.
+"""
+import argparse
+import builtins
+import importlib
+import sys
+from collections import OrderedDict, defaultdict
+from timeit import default_timer
+
+PROG = 'subreddit_recommender'
+PACKAGE = 'subreddit_recommender.src'
+PROFILE_TOP = 10
+
+# command -> stage -> (module, description), the stage None runs when no stage is given
+COMMANDS = OrderedDict([
+    ('list', OrderedDict([
+        (None, ('data.make_subreddit_list', 'refresh the subreddit list')),
+    ])),
+    ('crawl', OrderedDict([
+        (None, ('data.download_reddit_data', 'download submissions and comments')),
+        ('wiki', ('data.wiki_harvest', 'harvest subreddit wikis')),
+        ('merge', ('data.sharding', 'merge the partitions of a sharded crawl')),
+        ('pack', ('data.corpus_store', 'convert reddit_raw into a packed store')),
+    ])),
+    ('features', OrderedDict([
+        ('normalize', ('data.normalize_text', 'normalize the raw text')),
+        ('dedup', ('data.dedup', 'remove near-duplicate comments')),
+        ('tokens', ('features.token_corpus', 'encode the corpus as token IDs')),
+        ('tfidf', ('features.tfidf', 'build hashed TF-IDF features')),
+    ])),
+    ('train', OrderedDict([
+        ('embeddings', ('models.train_embeddings', 'train Doc2Vec or Word2Vec')),
+        ('index', ('models.ann_index', 'build the LSH index')),
+        ('update', ('models.update_index', 'patch re-crawled subreddits into the index')),
+    ])),
+    ('serve', OrderedDict([
+        (None, ('models.serve', 'serve recommendations over HTTP')),
+        ('batch', ('models.recommend', 'recommend for a file of users')),
+    ])),
+    ('bench', OrderedDict([
+        ('download', ('data.benchmark_download', 'benchmark the download engines')),
+        ('evaluate', ('models.evaluate', 'evaluate recall and latency of models and indexes')),
+    ])),
+])
+
+
+class ImportProfiler(object):
+    """Time the imports made while active, by top level package.
+
+    The time of an import is its own time, without the imports it makes of other packages, so the
+    times add up to the total.
+
+    Attributes:
+        times (dict): Seconds per top level package.
+        total (float): Seconds spent inside the block.
+    """
+
+    def __init__(self):
+        self.times = defaultdict(float)
+        self.total = 0.
+        self._children = []
+
+    def __enter__(self):
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+        self._start = default_timer()
+        return self
+
+    def __exit__(self, *exc):
+        self.total = default_timer() - self._start
+        builtins.__import__ = self._import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._import(name, globals, locals, fromlist, level)
+        self._children.append(0.)
+        start = default_timer()
+        try:
+            return self._import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = default_timer() - start
+            self.times[name.partition('.')[0]] += elapsed - self._children.pop()
+            if self._children:
+                self._children[-1] += elapsed
+
+    def report(self, top=PROFILE_TOP):
+        lines = ['Imports took {t:.3f}s.'.format(t=self.total)]
+        ranked = sorted(self.times.items(), key=lambda item: -item[1])
+        for package, seconds in ranked[:top]:
+            lines.append('{ms:9.1f} ms  {package}'.format(ms=seconds * 1000, package=package))
+        return '\n'.join(lines)
+
+
+def _commands_help():
+    lines = ['commands:']
+    for command, stages in COMMANDS.items():
+        for stage, (_, description) in stages.items():
+            name = command if stage is None else '{command} {stage}'.format(command=command, stage=stage)
+            lines.append('  {name:<20}{description}'.format(name=name, description=description))
+    lines.append('')
+    lines.append('Run "{prog} <command> [stage] -h" for the options of a stage.'.format(prog=PROG))
+    return '\n'.join(lines)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(prog=PROG, description='Subreddit recommender pipeline.',
+                                     epilog=_commands_help(), formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profile-imports', action='store_true',
+                        help='Print the time spent importing the stage, by package.')
+    parser.add_argument('command', choices=list(COMMANDS))
+    parser.add_argument('args', nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def resolve(command, args):
+    """Return the module path, program name and remaining arguments of a command line.
+
+    Raises:
+        SystemExit: If the command needs a stage and none is given.
+    """
+    stages = COMMANDS[command]
+    if args and args[0] in stages:
+        stage, args = args[0], args[1:]
+    elif None in stages:
+        stage = None
+    else:
+        sys.exit('{prog} {command}: choose one of {stages}.'.format(
+            prog=PROG, command=command, stages=', '.join(stages)))
+    module, _ = stages[stage]
+    prog = ' '.join(name for name in (PROG, command, stage) if name)
+    return '{package}.{module}'.format(package=PACKAGE, module=module), prog, args
+
+
+def main(args=None):
+    args = parse_args(args)
+    module_name, prog, stage_args = resolve(args.command, args.args)
+
+    if args.profile_imports:
+        profiler = ImportProfiler()
+        with profiler:
+            module = importlib.import_module(module_name)
+        print(profiler.report(), file=sys.stderr)
+    else:
+        module = importlib.import_module(module_name)
+
+    # the stages parse sys.argv themselves
+    sys.argv = [prog] + stage_args
+    return module.main()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""Asyncio download engine.
+
+praw is a blocking library, so every API call is dispatched to a thread executor. The event loop
+keeps many of those calls in flight at once, bounded per credential by a semaphore (concurrency)
+and a token bucket (request rate). This decouples the number of in-flight requests from the
+number of API keys available.
+
+A single praw call can make many HTTP requests, e.g. expanding "more comments", so the token bucket
+is charged by the instance's requestor for every request rather than once per call.
+"""
+import asyncio
+import os.path as op
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+from subreddit_recommender.src.data.crawl_metrics import CrawlMetrics
+from subreddit_recommender.src.data.download_reddit_data import (_decode_utf, save_subreddit,
+                                                                 submission_text,
+                                                                 subreddit_request_budget_for)
+from subreddit_recommender.src.data.manifest import COMPLETE, FAILED
+from subreddit_recommender.src.data.scheduler import CredentialPool, WorkStealingQueue
+from subreddit_recommender.src.util import valid_subreddit_dirname
+
+# per credential defaults. reddit allows 60 requests per minute per OAuth client.
+CONCURRENCY = 8
+REQUESTS_PER_SECOND = 1.0
+BURST = 10
+
+
+class TokenBucket(object):
+    """Asyncio token bucket rate limiter.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        capacity (int): Maximum number of tokens the bucket holds, i.e. the allowed burst.
+    """
+
+    def __init__(self, rate, capacity):
+        if rate <= 0 or capacity < 1:
+            raise ValueError('rate must be positive and capacity at least 1.')
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated_at is None:
+            self._updated_at = now
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, tokens=1):
+        """Wait until `tokens` tokens are available, then consume them. Returns the time waited."""
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        async with self._lock:
+            while True:
+                self._refill(loop.time())
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return loop.time() - t0
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class RedditSession(object):
+    """A praw.Reddit instance with its own concurrency limit and rate limiter.
+
+    Attributes:
+        reddit (praw.Reddit): Authenticated reddit instance.
+        concurrency (int): Maximum number of blocking calls in flight for this credential.
+        rate (float): Maximum HTTP requests started per second.
+        burst (int): Token bucket capacity.
+        metrics (CrawlMetrics): Records token bucket waits as rate limit waits of this credential.
+
+    Instances without a praw requestor to hook into are charged one token per call instead.
+    """
+
+    def __init__(self, reddit, concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST, session_id=0,
+                 metrics=None):
+        self.reddit = reddit
+        self.concurrency = concurrency
+        self.session_id = session_id
+        self.metrics = metrics if metrics is not None else CrawlMetrics()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate, burst)
+        self._loop = None
+        self._loop_thread = None
+        self._limits_requests = self._limit_requests()
+
+    def _limit_requests(self):
+        """Wrap the requestor so every HTTP request takes a token. Returns False if there is none."""
+        try:
+            requestor = self.reddit._core._authorizer._authenticator._requestor
+        except AttributeError:
+            return False
+        request = requestor.request
+
+        def limited_request(*args, **kwargs):
+            loop = self._loop
+            # requests made on the loop's own thread cannot block on it
+            if loop is not None and loop.is_running() and threading.get_ident() != self._loop_thread:
+                waited = asyncio.run_coroutine_threadsafe(self._bucket.acquire(), loop).result()
+                self.metrics.observe_wait(self.session_id, waited)
+            return request(*args, **kwargs)
+
+        requestor.request = limited_request
+        return True
+
+    async def call(self, executor, fn, *args, worker_id=None):
+        """Run a blocking function in the executor once rate and concurrency limits allow it.
+
+        The requests it makes are recorded under worker_id.
+        """
+        self._loop = asyncio.get_event_loop()
+        self._loop_thread = threading.get_ident()
+        if not self._limits_requests:
+            waited = await self._bucket.acquire()
+            self.metrics.observe_wait(self.session_id, waited, worker_id=worker_id)
+        async with self._semaphore:
+            return await self._loop.run_in_executor(executor, self.metrics.bind(fn, worker_id), *args)
+
+
+def _fetch_description(praw_subreddit):
+    try:
+        return _decode_utf(praw_subreddit.description)
+    except Exception:
+        return ''
+
+
+def _fetch_top_submissions(praw_subreddit, top_n_submissions):
+    return list(praw_subreddit.top(limit=top_n_submissions))
+
+
+async def fetch_subreddit(session, executor, subreddit, top_n_submissions, comment_depth,
+                          submission_request_budget=None, subreddit_request_budget=None, worker_id=None):
+    """Fetch the description and top submissions of a subreddit, with submissions fetched concurrently.
+
+    Request budgets for "more comments" expansions work as in get_subreddit_submissions.
+
+    Returns:
+        (description, submission_ids, submissions): (str, list(str), list(str))
+    """
+    praw_subreddit = session.reddit.subreddit(subreddit)
+    description_task = asyncio.ensure_future(session.call(executor, _fetch_description, praw_subreddit,
+                                                          worker_id=worker_id))
+    top_submissions = await session.call(executor, _fetch_top_submissions, praw_subreddit, top_n_submissions,
+                                         worker_id=worker_id)
+
+    subreddit_budget = subreddit_request_budget_for(submission_request_budget, subreddit_request_budget)
+    submission_tasks = [session.call(executor, submission_text, submission, comment_depth,
+                                     subreddit_budget.child(submission_request_budget) if subreddit_budget else None,
+                                     worker_id=worker_id)
+                        for submission in top_submissions]
+    submissions = await asyncio.gather(*submission_tasks)
+    description = await description_task
+    return description, [submission.id for submission in top_submissions], list(submissions)
+
+
+async def _consumer(worker_id, work_queue, session_pool, executor, fetch_kwargs, manifest, corpus_writer, metrics,
+                    verbose):
+    while True:
+        subreddit_tuple = work_queue.get(worker_id)
+        if subreddit_tuple is None:
+            return
+
+        t0 = default_timer()
+        cat, subcat, subreddit = subreddit_tuple
+        subreddit = valid_subreddit_dirname(subreddit)
+
+        index, session = session_pool.acquire()
+        try:
+            description, submission_ids, submissions = await fetch_subreddit(session, executor, subreddit,
+                                                                             worker_id=worker_id, **fetch_kwargs)
+        except Exception as e:
+            msg = 'Session #{id_}: failed to download {sub}: {e!r}'
+            print(msg.format(id_=session.session_id, sub=subreddit, e=e))
+            if manifest is not None:
+                manifest.record(subreddit_tuple, FAILED)
+            continue
+        finally:
+            session_pool.release(index)
+
+        loop = asyncio.get_event_loop()
+        path = await loop.run_in_executor(executor, metrics.bind(save_subreddit, worker_id), (cat, subcat, subreddit),
+                                          description, submissions, corpus_writer, metrics)
+        if manifest is not None:
+            manifest.record(subreddit_tuple, COMPLETE, submission_ids=submission_ids)
+
+        if verbose > 0:
+            msg = 'Session #{id_}: {sub}, {remaining} remaining. Time elapsed: {time}s\n'
+            msg += 'Wrote to: {path}\n'
+            print(msg.format(id_=session.session_id,
+                             sub=subreddit,
+                             remaining=len(work_queue),
+                             time=round(default_timer() - t0, 2),
+                             path=op.relpath(path)))
+
+
+async def _crawl(subreddit_tuples, sessions, executor, fetch_kwargs, subreddits_per_session, manifest, corpus_writer,
+                 metrics, verbose):
+    n_consumers = subreddits_per_session * len(sessions)
+    work_queue = WorkStealingQueue(subreddit_tuples, n_consumers)
+    session_pool = CredentialPool(sessions, get_reddit=lambda session: session.reddit)
+
+    consumers = [_consumer(worker_id, work_queue, session_pool, executor, fetch_kwargs, manifest, corpus_writer,
+                           metrics, verbose)
+                 for worker_id in range(n_consumers)]
+    await asyncio.gather(*consumers)
+
+
+def download_reddit_data_async(subreddit_tuples, reddit_instances, top_n_submissions, comment_depth,
+                               concurrency=CONCURRENCY, rate=REQUESTS_PER_SECOND, burst=BURST,
+                               subreddits_per_session=2, manifest=None, corpus_writer=None, verbose=1,
+                               submission_request_budget=None, subreddit_request_budget=None, metrics=None):
+    """Download subreddits with an asyncio event loop.
+
+    Args:
+        subreddit_tuples (list(tuple)): List of (category, subcategory, subreddit).
+        reddit_instances (list(praw.Reddit)): One authenticated instance per credential.
+        top_n_submissions (int): Number of posts to scrape comments from.
+        comment_depth (int): Number of replies kept per top level comment.
+        concurrency (int): Blocking calls in flight per credential.
+        rate (float): HTTP requests started per second, per credential.
+        burst (int): Token bucket capacity, per credential.
+        subreddits_per_session (int): Subreddits processed at once per credential. Each subreddit goes to
+            the session with the most rate limit budget left, so this sets total concurrency rather than
+            pinning work to a credential.
+        manifest (Manifest): If given, records the outcome of every subreddit.
+        corpus_writer (CorpusWriter): If given, subreddits are appended to the packed corpus store
+            instead of written to their directories.
+        submission_request_budget (int): Maximum "more comments" requests per submission.
+        subreddit_request_budget (int): Maximum "more comments" requests per subreddit.
+        metrics (CrawlMetrics): If given, records token bucket waits and write times per consumer.
+    """
+    if not reddit_instances:
+        raise ValueError('Need at least one reddit instance.')
+
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    executor = ThreadPoolExecutor(max_workers=concurrency * len(reddit_instances))
+    try:
+        sessions = [RedditSession(reddit, concurrency=concurrency, rate=rate, burst=burst, session_id=i,
+                                  metrics=metrics)
+                    for i, reddit in enumerate(reddit_instances)]
+        fetch_kwargs = {'top_n_submissions': top_n_submissions,
+                        'comment_depth': comment_depth,
+                        'submission_request_budget': submission_request_budget,
+                        'subreddit_request_budget': subreddit_request_budget}
+        loop.run_until_complete(_crawl(subreddit_tuples, sessions, executor, fetch_kwargs, subreddits_per_session,
+                                       manifest, corpus_writer, metrics, verbose))
+    finally:
+        executor.shutdown(wait=True)
+        loop.close()
+        asyncio.set_event_loop(None)
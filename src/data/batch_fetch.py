@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Batched submission fetching.
+
+Instead of walking subreddits one at a time (listing, then each submission's comments in turn),
+the batch engine works on many subreddits at once:
+
+1. The top submissions of every subreddit in a batch are listed, which also returns their metadata.
+2. Comment trees and descriptions of the whole batch are fetched in a thread pool with several
+   requests in flight.
+
+A refresh lists every subreddit again, so it picks up newly popular submissions just like the
+thread and async engines. fetch_submissions_by_fullname looks up known submission ids in bulk.
+"""
+import itertools
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+
+from subreddit_recommender.src.data.crawl_metrics import CrawlMetrics
+from subreddit_recommender.src.data.download_reddit_data import (_decode_utf, save_subreddit,
+                                                                 submission_text,
+                                                                 subreddit_request_budget_for)
+from subreddit_recommender.src.data.manifest import COMPLETE, FAILED
+from subreddit_recommender.src.util import valid_subreddit_dirname
+
+INFO_BATCH_SIZE = 100
+MAX_IN_FLIGHT = 8
+SUBREDDITS_PER_BATCH = 50
+
+
+def chunks(iterable, n):
+    """Yield successive lists of n items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, n))
+        if not chunk:
+            return
+        yield chunk
+
+
+def fetch_submissions_by_fullname(reddit, fullnames):
+    """Fetch submission metadata in bulk, 100 fullnames per request.
+
+    Returns:
+        submissions: dict
+            Maps fullname to praw.models.Submission. Deleted submissions are missing.
+    """
+    submissions = {}
+    for chunk in chunks(fullnames, INFO_BATCH_SIZE):
+        for submission in reddit.info(fullnames=chunk):
+            submissions[submission.fullname] = submission
+    return submissions
+
+
+def collect_fullnames(reddit, subreddit_tuples, top_n_submissions, failed=None):
+    """Return an OrderedDict mapping each subreddit tuple to the fullnames of its top submissions.
+
+    The listed submissions are returned as well, so their metadata needn't be fetched again.
+
+    Args:
+        failed (dict): If given, a subreddit whose listing fails (private, banned or missing) is left
+            out and added here with its exception, instead of the exception being raised.
+
+    Returns:
+        (fullnames, listed): (OrderedDict, dict)
+    """
+    fullnames, listed = OrderedDict(), {}
+    for subreddit_tuple in subreddit_tuples:
+        subreddit = reddit.subreddit(valid_subreddit_dirname(subreddit_tuple[2]))
+        try:
+            submissions = list(subreddit.top(limit=top_n_submissions))
+        except Exception as e:
+            if failed is None:
+                raise
+            failed[subreddit_tuple] = e
+            continue
+        fullnames[subreddit_tuple] = [s.fullname for s in submissions]
+        listed.update((s.fullname, s) for s in submissions)
+    return fullnames, listed
+
+
+def _record_failure(subreddit_tuple, error, manifest):
+    print('Failed to download {sub}: {e!r}'.format(sub=subreddit_tuple[2], e=error))
+    if manifest is not None:
+        manifest.record(subreddit_tuple, FAILED)
+
+
+def _description(reddit, subreddit_tuple):
+    try:
+        return _decode_utf(reddit.subreddit(valid_subreddit_dirname(subreddit_tuple[2])).description)
+    except Exception:
+        return ''
+
+
+def download_batch(reddit, subreddit_tuples, top_n_submissions, comment_depth, executor, manifest=None,
+                   corpus_writer=None, submission_request_budget=None, subreddit_request_budget=None, metrics=None):
+    """Download a batch of subreddits with bulk metadata lookups and pipelined comment fetches.
+
+    Comment fetches are recorded in metrics under the worker label of the calling thread. A subreddit
+    whose listing or comments fail is recorded as FAILED, the rest of the batch carries on.
+
+    Returns:
+        n_complete: int
+    """
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    worker_id = metrics.current_worker()
+    failed = OrderedDict()
+    fullnames, submissions = collect_fullnames(reddit, subreddit_tuples, top_n_submissions, failed=failed)
+    for subreddit_tuple, error in failed.items():
+        _record_failure(subreddit_tuple, error, manifest)
+
+    # queue every comment tree and description at once, the executor bounds how many are in flight
+    futures = OrderedDict()
+    for subreddit_tuple, names in fullnames.items():
+        subreddit_budget = subreddit_request_budget_for(submission_request_budget, subreddit_request_budget)
+        texts = []
+        for fullname in names:
+            budget = subreddit_budget.child(submission_request_budget) if subreddit_budget else None
+            texts.append((fullname, executor.submit(metrics.bind(submission_text, worker_id),
+                                                    submissions[fullname], comment_depth, budget)))
+        description = executor.submit(metrics.bind(_description, worker_id), reddit, subreddit_tuple)
+        futures[subreddit_tuple] = description, texts
+
+    n_complete = 0
+    for subreddit_tuple, (description, texts) in futures.items():
+        cat, subcat, subreddit = subreddit_tuple
+        try:
+            results = [(fullname[3:], future.result()) for fullname, future in texts]
+        except Exception as e:
+            _record_failure(subreddit_tuple, e, manifest)
+            continue
+
+        save_subreddit((cat, subcat, valid_subreddit_dirname(subreddit)), description.result(),
+                       [text for _, text in results], corpus_writer=corpus_writer, metrics=metrics)
+        if manifest is not None:
+            manifest.record(subreddit_tuple, COMPLETE, submission_ids=[id_ for id_, _ in results])
+        n_complete += 1
+    return n_complete
+
+
+def download_reddit_data_batched(subreddit_tuples, reddit_instances, top_n_submissions, comment_depth,
+                                 max_in_flight=MAX_IN_FLIGHT, subreddits_per_batch=SUBREDDITS_PER_BATCH,
+                                 manifest=None, corpus_writer=None, verbose=1,
+                                 submission_request_budget=None, subreddit_request_budget=None, metrics=None):
+    """Download subreddits in batches, rotating batches over the available credentials.
+
+    Args:
+        subreddit_tuples (list(tuple)): List of (category, subcategory, subreddit).
+        reddit_instances (list(praw.Reddit)): One authenticated instance per credential.
+        max_in_flight (int): Comment trees fetched concurrently per credential.
+        subreddits_per_batch (int): Subreddits listed and fetched together.
+        manifest (Manifest): If given, records the outcome of every subreddit.
+        corpus_writer (CorpusWriter): If given, subreddits are appended to the packed corpus store.
+        metrics (CrawlMetrics): If given, requests and write times are recorded per batch.
+    """
+    if not reddit_instances:
+        raise ValueError('Need at least one reddit instance.')
+
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    batches = list(chunks(subreddit_tuples, subreddits_per_batch))
+    kwargs = dict(manifest=manifest, corpus_writer=corpus_writer,
+                  submission_request_budget=submission_request_budget,
+                  subreddit_request_budget=subreddit_request_budget, metrics=metrics)
+
+    with ThreadPoolExecutor(max_workers=len(reddit_instances)) as batch_executor, \
+            ThreadPoolExecutor(max_workers=max_in_flight * len(reddit_instances)) as executor:
+        t0 = default_timer()
+        futures = [batch_executor.submit(metrics.bind(download_batch, 'batch-{i}'.format(i=i)),
+                                         reddit_instances[i % len(reddit_instances)], batch,
+                                         top_n_submissions, comment_depth, executor, **kwargs)
+                   for i, batch in enumerate(batches)]
+        n_complete = 0
+        for i, future in enumerate(futures):
+            n_complete += future.result()
+            if verbose > 0:
+                msg = 'Batch {i} / {total} complete, {n} subreddits so far. Time elapsed: {time}s'
+                print(msg.format(i=i + 1, total=len(batches), n=n_complete, time=round(default_timer() - t0, 2)))
+    return n_complete
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Offline throughput benchmark for the download pipeline.
+
+Runs each engine configuration against a local FakeRedditServer and reports subreddits per
+minute, requests per subreddit and p50/p99 request latency as seen by praw.
+
+    python src/data/benchmark_download.py --subreddits 50 --latency 0.05 --output bench.json
+"""
+import argparse
+import json
+import os.path as op
+import shutil
+import tempfile
+import threading
+from timeit import default_timer
+
+import numpy as np
+import prawcore
+
+from subreddit_recommender.src.data.async_download import download_reddit_data_async
+from subreddit_recommender.src.data.batch_fetch import download_reddit_data_batched
+from subreddit_recommender.src.data.corpus_store import CorpusWriter
+from subreddit_recommender.src.data.crawl_metrics import CrawlMetrics, instrument_reddit
+from subreddit_recommender.src.data.download_reddit_data import (download_reddit_data_threaded,
+                                                                 open_reddit_instance)
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+from subreddit_recommender.src.data.manifest import Manifest
+
+# name, engine, options
+DEFAULT_CONFIGS = [
+    ('thread-10', 'thread', {'n_threads': 10}),
+    ('async-c4', 'async', {'concurrency': 4, 'subreddits_per_session': 2}),
+    ('async-c16', 'async', {'concurrency': 16, 'subreddits_per_session': 4}),
+    ('async-c16-budget', 'async', {'concurrency': 16, 'subreddits_per_session': 4,
+                                   'submission_request_budget': 2, 'subreddit_request_budget': 20}),
+    ('batch-8', 'batch', {'max_in_flight': 8}),
+]
+
+
+class TimingRequestor(prawcore.Requestor):
+    """prawcore Requestor that records the latency of every request."""
+
+    def __init__(self, *args, **kwargs):
+        self.latencies = kwargs.pop('latencies')
+        self._latency_lock = kwargs.pop('latency_lock')
+        super(TimingRequestor, self).__init__(*args, **kwargs)
+
+    def request(self, *args, **kwargs):
+        t0 = default_timer()
+        try:
+            return super(TimingRequestor, self).request(*args, **kwargs)
+        finally:
+            with self._latency_lock:
+                self.latencies.append(default_timer() - t0)
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def run_config(server, subreddit_tuples, engine, options, n_credentials=1, top_n_submissions=5, comment_depth=4):
+    """Download every subreddit from the fake server with one engine configuration.
+
+    Returns:
+        results: dict
+    """
+    latencies, latency_lock = [], threading.Lock()
+    metrics = CrawlMetrics()
+    reddit_instances = []
+    for i in range(n_credentials):
+        config = server.praw_config(client_id='client{i}'.format(i=i))
+        credentials = config.pop('client_id'), config.pop('client_secret')
+        config.pop('user_agent')
+        reddit_instances.append(open_reddit_instance(credentials, requestor_class=TimingRequestor,
+                                                     requestor_kwargs={'latencies': latencies,
+                                                                       'latency_lock': latency_lock},
+                                                     **config))
+        instrument_reddit(reddit_instances[-1], metrics, credential=i)
+
+    workdir = tempfile.mkdtemp(prefix='subreddit_recommender_bench_')
+    manifest = Manifest.in_directory(workdir)
+    server.reset_stats()
+    t0 = default_timer()
+    try:
+        with CorpusWriter(op.join(workdir, 'packed')) as corpus_writer:
+            kwargs = dict(top_n_submissions=top_n_submissions, comment_depth=comment_depth, manifest=manifest,
+                          corpus_writer=corpus_writer, metrics=metrics, verbose=0)
+            kwargs.update(options)
+            if engine == 'async':
+                kwargs.setdefault('rate', 1000.0)
+                kwargs.setdefault('burst', 1000)
+                download_reddit_data_async(subreddit_tuples, reddit_instances, **kwargs)
+            elif engine == 'batch':
+                download_reddit_data_batched(subreddit_tuples, reddit_instances, **kwargs)
+            else:
+                download_reddit_data_threaded(subreddit_tuples, reddit_instances, **kwargs)
+        elapsed = default_timer() - t0
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    n_complete = sum(manifest.is_complete(t) for t in subreddit_tuples)
+    totals = metrics.snapshot()
+    return {
+        'engine': engine,
+        'options': options,
+        'n_credentials': n_credentials,
+        'n_subreddits': len(subreddit_tuples),
+        'n_complete': n_complete,
+        'elapsed_s': elapsed,
+        'subreddits_per_min': 60.0 * n_complete / elapsed if elapsed > 0 else None,
+        'requests_per_subreddit': server.n_requests / float(len(subreddit_tuples)),
+        'n_requests': server.n_requests,
+        'n_throttled': server.status_codes.get(429, 0),
+        'latency_p50_s': percentile(latencies, 50),
+        'latency_p99_s': percentile(latencies, 99),
+        'rate_limit_wait_s': totals['rate_limit_wait_s'],
+        'replace_more_expansions': totals['replace_more_expansions'],
+        'write_s': totals['write_s'],
+    }
+
+
+def run_benchmark(configs=DEFAULT_CONFIGS, n_subreddits=20, n_credentials=1, top_n_submissions=5, comment_depth=4,
+                  verbose=1, **server_kwargs):
+    """Run every configuration against the same fake reddit.
+
+    Returns:
+        results: dict
+            Maps configuration names to their results.
+    """
+    names = ['bench{i}'.format(i=i) for i in range(n_subreddits)]
+    subreddit_tuples = [('Benchmark', 'Synthetic', '/r/' + name) for name in names]
+    server_kwargs.setdefault('n_submissions', top_n_submissions)
+
+    results = {}
+    with FakeRedditServer(names, **server_kwargs) as server:
+        for name, engine, options in configs:
+            results[name] = run_config(server, subreddit_tuples, engine, options, n_credentials=n_credentials,
+                                       top_n_submissions=top_n_submissions, comment_depth=comment_depth)
+            if verbose > 0:
+                print(format_result(name, results[name]))
+    return results
+
+
+def format_result(name, result):
+    msg = ('{name:<18} {rate:>8.1f} subreddits/min  {rps:>6.1f} requests/subreddit  '
+           'p50 {p50:>7.1f}ms  p99 {p99:>7.1f}ms  {complete}/{total} complete, {throttled} throttled')
+    return msg.format(name=name,
+                      rate=result['subreddits_per_min'] or 0,
+                      rps=result['requests_per_subreddit'],
+                      p50=1000 * (result['latency_p50_s'] or 0),
+                      p99=1000 * (result['latency_p99_s'] or 0),
+                      complete=result['n_complete'],
+                      total=result['n_subreddits'],
+                      throttled=result['n_throttled'])
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark the download engines against a local fake reddit.')
+    parser.add_argument('--subreddits', type=int, default=20, help='Number of synthetic subreddits.')
+    parser.add_argument('--credentials', type=int, default=1, help='Number of fake API credentials.')
+    parser.add_argument('--top-n', type=int, default=5, help='Submissions downloaded per subreddit.')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds of latency added to every response.')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Extra uniformly distributed latency.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 429.')
+    parser.add_argument('--top-level-comments', type=int, default=20)
+    parser.add_argument('--replies-per-comment', type=int, default=3)
+    parser.add_argument('--reply-depth', type=int, default=2)
+    parser.add_argument('--output', default=None, help='Write results to this JSON file.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    results = run_benchmark(n_subreddits=args.subreddits,
+                            n_credentials=args.credentials,
+                            top_n_submissions=args.top_n,
+                            latency=args.latency,
+                            latency_jitter=args.jitter,
+                            error_rate=args.error_rate,
+                            top_level_comments=args.top_level_comments,
+                            replies_per_comment=args.replies_per_comment,
+                            reply_depth=args.reply_depth)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Request-budgeted comment traversal.
+
+The crawler keeps each top level comment and its first few direct replies. CommentForest.replace_more
+expands "more" objects anywhere in the tree, largest first, so most of its requests load branches
+that are thrown away. iter_comment_chains only expands a "more" object when it can add a comment
+that will be kept:
+
+- a top level "more", while fewer than max_comments chains have been produced
+- a "more" among a top level comment's replies, while it has fewer than depth replies
+
+Every expansion costs one request and is charged against a RequestBudget.
+"""
+import threading
+from collections import defaultdict
+
+from praw.models import MoreComments
+
+
+class RequestBudget(object):
+    """A thread-safe request allowance, optionally nested in a parent budget.
+
+    A per-submission budget nested in a per-subreddit budget spends from both, so a submission can
+    neither exceed its own limit nor exhaust what its subreddit has left.
+
+    Attributes:
+        limit (int): Number of requests allowed. None for unlimited.
+        parent (RequestBudget): Budget that is charged as well.
+    """
+
+    def __init__(self, limit=None, parent=None):
+        if limit is not None and limit < 0:
+            raise ValueError('limit must not be negative.')
+        self.limit = limit
+        self.parent = parent
+        self.spent = 0
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self):
+        own = None if self.limit is None else self.limit - self.spent
+        inherited = None if self.parent is None else self.parent.remaining
+        if own is None:
+            return inherited
+        return own if inherited is None else min(own, inherited)
+
+    def child(self, limit=None):
+        """Return a budget nested in this one."""
+        return RequestBudget(limit, parent=self)
+
+    def spend(self, n=1):
+        """Charge n requests. Returns False, without charging anything, if the budget can't cover them."""
+        with self._lock:
+            if self.limit is not None and self.spent + n > self.limit:
+                return False
+            if self.parent is not None and not self.parent.spend(n):
+                return False
+            self.spent += n
+            return True
+
+
+def _expand(more, budget):
+    """Fetch the comments behind a "more" object, or return None if the budget is exhausted."""
+    if not budget.spend():
+        return None
+    return list(more.comments(update=True))
+
+
+def _file_orphans(comments, orphans):
+    """Index comments returned by a "more" expansion by the fullname of their parent."""
+    for comment in comments:
+        orphans[comment.parent_id].append(comment)
+
+
+def _direct_replies(comment, depth, budget, orphans):
+    """Return up to depth direct replies of a comment, expanding "more" replies only while short."""
+    replies, mores = [], []
+    for reply in list(comment.replies) + orphans.pop(comment.fullname, []):
+        (mores if isinstance(reply, MoreComments) else replies).append(reply)
+
+    while len(replies) < depth and mores:
+        expanded = _expand(mores.pop(0), budget)
+        if expanded is None:
+            break
+        _file_orphans(expanded, orphans)
+        for reply in orphans.pop(comment.fullname, []):
+            (mores if isinstance(reply, MoreComments) else replies).append(reply)
+    return replies[:depth]
+
+
+def iter_comment_chains(comment_forest, depth=3, max_comments=100, budget=None):
+    """Lazily yield each top level comment joined with its first depth replies.
+
+    Attributes:
+        comment_forest: praw.models.comment_forest.CommentForest
+            Loaded comments of a submission. Loading them is not charged to the budget.
+        depth: int
+            Number of direct replies kept per top level comment.
+        max_comments: int
+            Number of top level comments to yield at most.
+        budget: RequestBudget
+            Charged one request per "more" expansion. Unlimited if None.
+    """
+    budget = budget if budget is not None else RequestBudget()
+    orphans = defaultdict(list)
+    pending = list(comment_forest)
+    n_yielded = 0
+
+    while pending and n_yielded < max_comments:
+        item = pending.pop(0)
+        if isinstance(item, MoreComments):
+            expanded = _expand(item, budget)
+            if expanded is None:
+                continue
+            # top level comments go to the front of the queue, their descendants wait for _direct_replies
+            top_level = [c for c in expanded if c.parent_id == item.parent_id]
+            _file_orphans([c for c in expanded if c.parent_id != item.parent_id], orphans)
+            pending = top_level + pending
+            continue
+
+        replies = _direct_replies(item, depth, budget, orphans)
+        yield '\n'.join([item.body] + [reply.body for reply in replies])
+        n_yielded += 1
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""Packed corpus store.
+
+Documents are appended to a small number of large shard files, and an append-only index of JSON
+lines maps (subreddit, document) to (shard, offset, length). Readers memory-map the shards and hand
+out memoryviews, so reading a document costs neither a file open nor a copy.
+
+Layout of a store directory:
+
+    index.jsonl
+    shard_00000.bin
+    shard_00001.bin
+    ...
+"""
+import json
+import mmap
+import os
+import os.path as op
+import threading
+
+from subreddit_recommender.src.data.manifest import repair_journal, subreddit_key
+from subreddit_recommender.src.util import data_dir
+
+INDEX_FILENAME = 'index.jsonl'
+SHARD_FILENAME = 'shard_{i:05d}.bin'
+SHARD_SIZE = 256 * 1024 * 1024
+
+
+def corpus_store_dir(store_dirname='reddit_packed'):
+    """Return the default location of the packed corpus store."""
+    return op.join(data_dir('raw'), store_dirname)
+
+
+class CorpusWriter(object):
+    """Appends documents to shard files and records their offsets in the index.
+
+    Re-adding a subreddit with add_subreddit replaces its documents for readers. The old bytes stay
+    in their shard, since shards are never rewritten.
+
+    Attributes:
+        store_dir (str): Directory of the store. Created if it does not exist.
+        shard_size (int): A new shard is started once the current one exceeds this many bytes.
+    """
+
+    def __init__(self, store_dir, shard_size=SHARD_SIZE):
+        self.store_dir = store_dir
+        self.shard_size = shard_size
+        if not op.exists(store_dir):
+            os.makedirs(store_dir)
+
+        self._lock = threading.Lock()
+        self._shard_id = self._last_shard_id()
+        self._shard = open(op.join(store_dir, SHARD_FILENAME.format(i=self._shard_id)), 'ab')
+        repair_journal(op.join(store_dir, INDEX_FILENAME))
+        self._index = open(op.join(store_dir, INDEX_FILENAME), 'a')
+
+    def _last_shard_id(self):
+        shard_ids = [int(name[6:11]) for name in os.listdir(self.store_dir)
+                     if name.startswith('shard_') and name.endswith('.bin')]
+        return max(shard_ids) if shard_ids else 0
+
+    def _roll_shard(self):
+        self._shard.close()
+        self._shard_id += 1
+        self._shard = open(op.join(self.store_dir, SHARD_FILENAME.format(i=self._shard_id)), 'ab')
+
+    def _write_index(self, record):
+        self._index.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def add(self, subreddit_tuple, doc_name, text):
+        """Append a single document of a subreddit."""
+        data = text.encode('utf-8') if isinstance(text, str) else bytes(text)
+        with self._lock:
+            if self._shard.tell() > self.shard_size:
+                self._roll_shard()
+            offset = self._shard.tell()
+            self._shard.write(data)
+            self._write_index({'key': subreddit_key(subreddit_tuple), 'doc': doc_name,
+                               'shard': self._shard_id, 'offset': offset, 'length': len(data)})
+
+    def reset(self, subreddit_tuple):
+        """Drop all previously added documents of a subreddit, as seen by readers."""
+        with self._lock:
+            self._write_index({'key': subreddit_key(subreddit_tuple), 'reset': True})
+
+    def add_subreddit(self, subreddit_tuple, description, submissions):
+        """Replace all documents of a subreddit with its description and submissions."""
+        self.reset(subreddit_tuple)
+        self.add(subreddit_tuple, 'description', description)
+        for i, submission in enumerate(submissions):
+            self.add(subreddit_tuple, 'sub_{i}'.format(i=i), submission)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._shard.flush()
+            self._index.flush()
+
+    def close(self):
+        self.flush()
+        self._shard.close()
+        self._index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CorpusReader(object):
+    """Reads documents from a packed corpus store through memory-mapped shards.
+
+    Documents are returned as memoryviews into the mapped shards. Release them before calling
+    close(), since a mapping cannot be closed while views of it are alive.
+
+    Attributes:
+        store_dir (str): Directory of the store.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self._index = {}
+        self._files = {}
+        self._mmaps = {}
+        self._load_index()
+
+    def _load_index(self):
+        path = op.join(self.store_dir, INDEX_FILENAME)
+        if not op.exists(path):
+            return
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # partially written last line
+                    continue
+                if record.get('reset'):
+                    self._index[record['key']] = {}
+                else:
+                    docs = self._index.setdefault(record['key'], {})
+                    docs[record['doc']] = (record['shard'], record['offset'], record['length'])
+
+    def _shard(self, shard_id):
+        if shard_id not in self._mmaps:
+            file = open(op.join(self.store_dir, SHARD_FILENAME.format(i=shard_id)), 'rb')
+            self._files[shard_id] = file
+            self._mmaps[shard_id] = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        return self._mmaps[shard_id]
+
+    def __len__(self):
+        return sum(1 for docs in self._index.values() if docs)
+
+    def __contains__(self, subreddit_tuple):
+        return bool(self._index.get(subreddit_key(subreddit_tuple)))
+
+    def subreddits(self):
+        """Return the keys of all subreddits in the store, e.g. 'Category/Subcategory/subreddit'.
+
+        Subreddits whose documents were all dropped by a reset are left out.
+        """
+        return sorted(key for key, docs in self._index.items() if docs)
+
+    def documents(self, subreddit):
+        """Return the document names of a subreddit, given its tuple or key."""
+        key = subreddit if isinstance(subreddit, str) else subreddit_key(subreddit)
+        return sorted(self._index.get(key, {}), key=_doc_sort_key)
+
+    def locations(self, subreddit):
+        """Return {doc_name: (shard, offset, length)} of a subreddit. Changes whenever a document is re-added."""
+        key = subreddit if isinstance(subreddit, str) else subreddit_key(subreddit)
+        return dict(self._index.get(key, {}))
+
+    def get(self, subreddit, doc_name):
+        """Return a document as a memoryview into its shard, without copying."""
+        key = subreddit if isinstance(subreddit, str) else subreddit_key(subreddit)
+        try:
+            shard_id, offset, length = self._index[key][doc_name]
+        except KeyError:
+            raise KeyError('{doc} of {key} is not in the store.'.format(doc=doc_name, key=key))
+        if length == 0:
+            return memoryview(b'')
+        return self._shard(shard_id)[offset:offset + length]
+
+    def text(self, subreddit, doc_name):
+        """Return a document decoded as a string."""
+        return str(self.get(subreddit, doc_name), 'utf-8')
+
+    def iter_documents(self):
+        """Yield (subreddit_key, doc_name, memoryview) for every document, in shard order."""
+        entries = [(location, key, doc)
+                   for key, docs in self._index.items()
+                   for doc, location in docs.items()]
+        for (shard_id, offset, length), key, doc in sorted(entries):
+            yield key, doc, self.get(key, doc)
+
+    def close(self):
+        for view in self._mmaps.values():
+            mapped = view.obj
+            view.release()
+            mapped.close()
+        for file in self._files.values():
+            file.close()
+        self._mmaps, self._files = {}, {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _doc_sort_key(doc_name):
+    # description first, then sub_0, sub_1, ..., sub_10 in numeric order
+    if doc_name.startswith('sub_') and doc_name[4:].isdigit():
+        return 1, int(doc_name[4:]), doc_name
+    return 0, 0, doc_name
+
+
+def convert_raw_tree(reddit_raw_dir, store_dir, shard_size=SHARD_SIZE, verbose=1):
+    """Pack an existing reddit_raw directory tree (category/subcategory/subreddit/files) into a store.
+
+    Returns:
+        n_subreddits: int
+            Number of subreddits converted.
+    """
+    n_subreddits = 0
+    with CorpusWriter(store_dir, shard_size=shard_size) as writer:
+        for cat in sorted(os.listdir(reddit_raw_dir)):
+            cat_dir = op.join(reddit_raw_dir, cat)
+            if not op.isdir(cat_dir):
+                continue
+            for subcat in sorted(os.listdir(cat_dir)):
+                subcat_dir = op.join(cat_dir, subcat)
+                if not op.isdir(subcat_dir):
+                    continue
+                for subreddit in sorted(os.listdir(subcat_dir)):
+                    subreddit_dir = op.join(subcat_dir, subreddit)
+                    doc_names = sorted(os.listdir(subreddit_dir), key=_doc_sort_key)
+                    if not doc_names:
+                        continue
+
+                    subreddit_tuple = (cat, subcat, subreddit)
+                    writer.reset(subreddit_tuple)
+                    for doc_name in doc_names:
+                        with open(op.join(subreddit_dir, doc_name), 'rb') as file:
+                            writer.add(subreddit_tuple, doc_name, file.read())
+                    n_subreddits += 1
+
+    if verbose > 0:
+        print('{n} subreddits packed into {dir}.'.format(n=n_subreddits, dir=store_dir))
+    return n_subreddits
+
+
+def main():
+    reddit_raw_dir = op.join(data_dir('raw'), 'reddit_raw')
+    convert_raw_tree(reddit_raw_dir, corpus_store_dir())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""Near-duplicate comment removal with MinHash and LSH banding.
+
+Popular comments, bot messages and cross-posted titles repeat across submissions and subreddits.
+This stage reads a corpus (by default the normalized store) line by line and writes a packed store
+of normalized text without the near-duplicates.
+
+Submission files join comment chains and their replies with the same line break, so chains
+can't be told apart once written. The unit of deduplication is therefore a line: a title or a
+single comment.
+
+- Every line is shingled into word n-grams and summarized by a MinHash signature.
+- Signatures are cut into bands. Lines sharing a band bucket are candidates, and a candidate is a
+  duplicate if the signatures agree on at least `threshold` of their positions, which estimates
+  the Jaccard similarity of the shingle sets.
+- Lines too short for n-grams are deduplicated exactly.
+
+Modes:
+
+    drop        keep only the first occurrence in the whole corpus
+    downweight  keep the first occurrence per subreddit, so boilerplate counts once per subreddit
+                instead of once per submission
+
+Descriptions are never deduplicated. A JSON report of what was removed is written next to the store.
+
+    python src/data/dedup.py --mode drop --threshold 0.8
+"""
+import argparse
+import json
+import os.path as op
+import zlib
+from collections import Counter
+from timeit import default_timer
+
+import numpy as np
+
+from subreddit_recommender.src.data.corpus_store import CorpusWriter
+from subreddit_recommender.src.data.normalize_text import (iter_raw_documents,
+                                                           normalize_text,
+                                                           normalized_store_dir)
+from subreddit_recommender.src.util import data_dir
+
+DROP = 'drop'
+DOWNWEIGHT = 'downweight'
+MODES = [DROP, DOWNWEIGHT]
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_SIZE = 3
+THRESHOLD = 0.8
+REPORT_FILENAME = 'dedup_report.json'
+
+_PRIME = (1 << 31) - 1
+
+
+def deduped_store_dir(store_dirname='reddit_deduped'):
+    """Return the default location of the deduplicated corpus store."""
+    return op.join(data_dir('interim'), store_dirname)
+
+
+def shingles(words, size=SHINGLE_SIZE):
+    """Return the distinct word n-grams of a line, hashed to 32 bit integers."""
+    grams = {' '.join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.array([zlib.crc32(g.encode('utf-8')) for g in grams], dtype=np.uint64)
+
+
+class MinHasher(object):
+    """MinHash signatures from num_perm universal hash functions (a * x + b) mod p."""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        self._a = rng.randint(1, _PRIME, size=num_perm).astype(np.uint64)[:, np.newaxis]
+        self._b = rng.randint(0, _PRIME, size=num_perm).astype(np.uint64)[:, np.newaxis]
+
+    def signature(self, hashes):
+        # hashes are reduced mod p first, so a * x stays below 2 ** 62
+        return ((self._a * (hashes % _PRIME) + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class NearDuplicateIndex(object):
+    """Remembers the lines seen so far and finds near-duplicates among them.
+
+    Attributes:
+        num_perm (int): Length of the MinHash signatures.
+        bands (int): Number of LSH bands. num_perm must be divisible by it.
+        threshold (float): Minimum estimated Jaccard similarity of a near-duplicate.
+        shingle_size (int): Words per shingle.
+    """
+
+    def __init__(self, num_perm=NUM_PERM, bands=BANDS, threshold=THRESHOLD, shingle_size=SHINGLE_SIZE, seed=1):
+        if num_perm % bands:
+            raise ValueError('num_perm must be divisible by bands.')
+        self.hasher = MinHasher(num_perm, seed=seed)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+        self._exact = set()
+
+    def _band_keys(self, signature):
+        return [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+
+    def add(self, line, scope=None):
+        """Add a line, unless it nearly duplicates one added before with the same scope.
+
+        Returns:
+            is_duplicate: bool
+        """
+        words = line.split()
+        if len(words) < self.shingle_size:
+            key = (scope, ' '.join(words))
+            if key in self._exact:
+                return True
+            self._exact.add(key)
+            return False
+
+        signature = self.hasher.signature(shingles(words, self.shingle_size))
+        band_keys = self._band_keys(signature)
+        candidates = {self._buckets[band].get((scope, key)) for band, key in enumerate(band_keys)}
+        candidates.discard(None)
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return True
+
+        line_id = len(self._signatures)
+        self._signatures.append(signature)
+        for band, key in enumerate(band_keys):
+            self._buckets[band].setdefault((scope, key), line_id)
+        return False
+
+
+def deduplicate_text(text, index, scope=None):
+    """Return (kept text, number of lines dropped, bytes dropped) of one normalized document."""
+    kept, n_dropped, bytes_dropped = [], 0, 0
+    for line in text.split('\n'):
+        if line and index.add(line, scope=scope):
+            n_dropped += 1
+            bytes_dropped += len(line.encode('utf-8')) + 1
+        else:
+            kept.append(line)
+    return '\n'.join(kept), n_dropped, bytes_dropped
+
+
+def deduplicate_corpus(source_dir=None, out_dir=None, mode=DROP, threshold=THRESHOLD, num_perm=NUM_PERM,
+                       bands=BANDS, shingle_size=SHINGLE_SIZE, normalize=None, verbose=1):
+    """Copy a corpus into a packed store without near-duplicate lines.
+
+    Args:
+        source_dir (str): Packed store or reddit_raw tree. Defaults to the normalized store.
+        out_dir (str): Defaults to data/interim/reddit_deduped.
+        mode (str): 'drop' or 'downweight', see the module docstring.
+        normalize (bool): Normalize documents first, so the store always holds normalized text.
+                          Defaults to True unless reading the normalized store.
+
+    Returns:
+        report: dict
+            Lines and bytes read and dropped, and the subreddits that lost the most lines.
+    """
+    if mode not in MODES:
+        raise ValueError('mode must be one of the following: {modes}'.format(modes=MODES))
+    t0 = default_timer()
+    source_dir = source_dir or normalized_store_dir()
+    out_dir = out_dir or deduped_store_dir()
+    normalize = normalize if normalize is not None else source_dir != normalized_store_dir()
+    index = NearDuplicateIndex(num_perm=num_perm, bands=bands, threshold=threshold, shingle_size=shingle_size)
+
+    n_lines = n_dropped = n_bytes = bytes_dropped = 0
+    dropped_by_subreddit = Counter()
+    with CorpusWriter(out_dir) as writer:
+        seen = set()
+        for key, doc_name, raw in iter_raw_documents(source_dir):
+            subreddit_tuple = tuple(key.split('/'))
+            if key not in seen:  # replace what a previous run wrote, once, since shards can interleave subreddits
+                writer.reset(subreddit_tuple)
+                seen.add(key)
+            text = str(raw, 'utf-8', 'replace')
+            text = normalize_text(text) if normalize else text
+            n_lines += text.count('\n') + 1
+            n_bytes += len(text.encode('utf-8'))
+            if doc_name != 'description':
+                scope = key if mode == DOWNWEIGHT else None
+                text, dropped, dropped_bytes = deduplicate_text(text, index, scope=scope)
+                n_dropped += dropped
+                bytes_dropped += dropped_bytes
+                dropped_by_subreddit[key] += dropped
+            writer.add(subreddit_tuple, doc_name, text)
+
+    report = {
+        'mode': mode,
+        'threshold': threshold,
+        'n_lines': n_lines,
+        'n_lines_dropped': n_dropped,
+        'n_bytes': n_bytes,
+        'n_bytes_dropped': bytes_dropped,
+        'fraction_lines_dropped': n_dropped / float(n_lines) if n_lines else 0.0,
+        'most_dropped': [[key, n] for key, n in dropped_by_subreddit.most_common(20) if n],
+        'elapsed_s': default_timer() - t0,
+    }
+    with open(op.join(out_dir, REPORT_FILENAME), 'w') as file:
+        json.dump(report, file, indent=4, sort_keys=True)
+    if verbose > 0:
+        msg = 'Dropped {n} of {total} lines ({pct:.1f}%), {mb:.1f} MB. Time elapsed: {time}s'
+        print(msg.format(n=n_dropped, total=n_lines, pct=100 * report['fraction_lines_dropped'],
+                         mb=bytes_dropped / 1e6, time=round(report['elapsed_s'], 2)))
+    return report
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Remove near-duplicate comments from the corpus.')
+    parser.add_argument('--source', default=None, help='Defaults to data/interim/reddit_normalized.')
+    parser.add_argument('--output', default=None, help='Defaults to data/interim/reddit_deduped.')
+    parser.add_argument('--mode', choices=MODES, default=DROP,
+                        help='drop: keep the first occurrence in the corpus. '
+                             'downweight: keep the first occurrence per subreddit.')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='Minimum estimated Jaccard similarity of near-duplicates.')
+    parser.add_argument('--num-perm', type=int, default=NUM_PERM)
+    parser.add_argument('--bands', type=int, default=BANDS)
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    deduplicate_corpus(args.source, args.output, mode=args.mode, threshold=args.threshold, num_perm=args.num_perm,
+                       bands=args.bands)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,76 @@
 # -*- coding: utf-8 -*-
+import argparse
 import os
 import os.path as op
 import shutil
-import time
 from multiprocessing.dummy import Pool as ThreadPool
 from timeit import default_timer
 
 import praw
-
-from subreddit_recommender.src.util import (data_dir, data_dir_subreddit,
-                                            load_json, parse_client_ids,
+import prawcore
+
+from subreddit_recommender.src.data.comment_traversal import (RequestBudget,
+                                                              iter_comment_chains)
+from subreddit_recommender.src.data.corpus_store import (CorpusWriter,
+                                                         corpus_store_dir)
+from subreddit_recommender.src.data.crawl_metrics import (EXPORT_INTERVAL,
+                                                          CrawlMetrics,
+                                                          instrument_reddit,
+                                                          metrics_dir)
+from subreddit_recommender.src.data.http_cache import MODES as HTTP_CACHE_MODES
+from subreddit_recommender.src.data.http_cache import CachingRequestor
+from subreddit_recommender.src.data.make_subreddit_list import added_subreddits
+from subreddit_recommender.src.data.manifest import (COMPLETE, FAILED,
+                                                     Manifest, parse_duration)
+from subreddit_recommender.src.data.scheduler import (CredentialPool,
+                                                      WorkStealingQueue)
+from subreddit_recommender.src.data.sharding import (PACKED_DIRNAME,
+                                                     TREE_DIRNAME, parse_shard,
+                                                     select_shard,
+                                                     shard_partition_dir,
+                                                     write_shard_info)
+from subreddit_recommender.src.data.wiki_harvest import MAX_BYTES as WIKI_MAX_BYTES
+from subreddit_recommender.src.data.wiki_harvest import MAX_PAGES as WIKI_MAX_PAGES
+from subreddit_recommender.src.data.wiki_harvest import (WIKI_DIRNAME,
+                                                         harvest_wikis,
+                                                         page_order,
+                                                         truncate_utf8)
+from subreddit_recommender.src.util import (create_directories, data_dir,
+                                            data_dir_subreddit, load_json,
+                                            parse_client_ids,
                                             valid_subreddit_dirname)
 
 TOP_N_SUBMISSIONS = 20
 COMMENT_DEPTH = 4
 VERBOSE = 1
+N_THREADS = 10
+ENGINES = ['async', 'batch', 'thread']
+STORES = ['files', 'packed']
 
 
-def open_reddit_instance(credentials):
+def open_reddit_instance(credentials, http_cache=None, http_cache_dir=None, **config_settings):
     """Returns an authenticated praw.Reddit instance.
 
     Attributes:
         credentials: tuple of string
             (client_id, client_secret)
+        http_cache: str
+            If given, one of 'record', 'replay' or 'read-through'. Responses are cached on disk.
+        http_cache_dir: str
+            Directory of the HTTP cache. Defaults to data/interim/http_cache.
+        config_settings:
+            Passed on to praw.Reddit, e.g. oauth_url and reddit_url to use another server.
     """
     client_id, client_secret = credentials
     user_agent = 'mac:subreddit_recommender_{h}:v1'.format(h=hash(client_id))
+    if http_cache is not None:
+        config_settings['requestor_class'] = CachingRequestor
+        config_settings['requestor_kwargs'] = {'mode': http_cache, 'cache_dir': http_cache_dir}
     reddit = praw.Reddit(
         client_id=client_id,
         client_secret=client_secret,
-        user_agent=user_agent
+        user_agent=user_agent,
+        **config_settings
     )
     return reddit
 
@@ -56,38 +97,45 @@ def create_directory_structure(subreddit_dict, raw_data_dirname='reddit_raw', ov
     if overwrite:
         shutil.rmtree(reddit_data_dir)
 
-    flattened_subreddits = flatten_subreddit_dict(subreddit_dict)
-    for cat, subcat, subreddit in flattened_subreddits:
-        path = data_dir_subreddit(cat, subcat, subreddit)
-        try:
-            os.makedirs(path)
-        except OSError:
-            continue
-
-    print('{n} directories for subreddits created.'.format(n=len(flattened_subreddits)))
+    paths = [data_dir_subreddit(t, raw_data_dirname=raw_data_dirname) for t in flatten_subreddit_dict(subreddit_dict)]
+    n_created = create_directories(paths)
+    print('{n} directories for {m} subreddits created.'.format(n=n_created, m=len(paths)))
 
 
 def _decode_utf(s):
-    """Coverts utf-8 to ascii, removing non ascii chars"""
-    return s.encode('utf-8').decode('ascii', 'ignore')
+    """Return s as text, decoding bytes as utf-8. Non ascii characters are kept, normalization
+    happens later in normalize_text.py."""
+    if isinstance(s, bytes):
+        return s.decode('utf-8', 'replace')
+    return s if s is not None else ''
 
 
-def wikipage_text(subreddit, verbose=0):
-    """Extracts text from a subreddit's wiki"""
-    content = "".encode('utf-8')
-    for page in subreddit.wiki:
+def wikipage_text(subreddit, verbose=0, max_pages=WIKI_MAX_PAGES, max_bytes=WIKI_MAX_BYTES):
+    """Extracts text from a subreddit's wiki, at most max_pages pages and max_bytes bytes of it.
+
+    The crawl harvests wikis incrementally with harvest_wikis instead, see wiki_harvest.py.
+    """
+    pages, n_bytes = [], 0
+    for name in page_order(page.name for page in subreddit.wiki)[:max_pages]:
         try:
-            content += subreddit.wiki[page].content_md.encode('utf-8')
-        except AttributeError:
+            text = truncate_utf8(subreddit.wiki[name].content_md, max_bytes - n_bytes)
+        except (AttributeError, prawcore.Forbidden, prawcore.NotFound):
             if verbose:
-                print('Skipping wiki page {page}'.format(page=page))
+                print('Skipping wiki page {page}'.format(page=name))
             continue
-    return content
+        pages.append(text)
+        n_bytes += len(text.encode('utf-8'))
+        if n_bytes >= max_bytes:
+            break
+    return '\n'.join(pages)
 
 
-def traverse_comment_forest(comment_forest, depth=3, max_comments=100, verbose=VERBOSE):
+def traverse_comment_forest(comment_forest, depth=3, max_comments=100, verbose=VERBOSE, budget=None):
     """Traverses a comment chain, saving each top level comment and a specified number of replies.
 
+    If a RequestBudget is given, only "more" objects that can add retained comments are expanded,
+    and each expansion is charged to the budget. Otherwise up to 3 are expanded with replace_more.
+
     Returns:
         comment_and_replies: list(str)
             List of [flattened_comment_chain, flattened_comment_chain, ...],
@@ -96,6 +144,9 @@ def traverse_comment_forest(comment_forest, depth=3, max_comments=100, verbose=V
     is_comment_forest = isinstance(comment_forest, praw.models.comment_forest.CommentForest)
     assert is_comment_forest, 'Input should be a CommentForest object.'
 
+    if budget is not None:
+        return list(iter_comment_chains(comment_forest, depth=depth, max_comments=max_comments, budget=budget))
+
     comments_and_replies = []
     comment_forest.replace_more(limit=3, threshold=1)  # TODO: Find a logical # of replaces and a logical threshold
     for comment in comment_forest:
@@ -104,13 +155,36 @@ def traverse_comment_forest(comment_forest, depth=3, max_comments=100, verbose=V
     return comments_and_replies
 
 
-def get_subreddit_submissions(subreddit, top_n_submissions, comment_depth, verbose=VERBOSE, worker_id=None):
+def submission_text(submission, comment_depth, budget=None):
+    """Returns a submission's title and comment chains as a single string."""
+    submission.comment_sort = 'top'
+    comment_forest = submission.comments
+    content = [submission.title] + traverse_comment_forest(comment_forest, comment_depth, budget=budget)
+    return '\n'.join(content)
+
+
+def subreddit_request_budget_for(submission_request_budget=None, subreddit_request_budget=None):
+    """Return the RequestBudget for one subreddit, or None if traversal is not budgeted."""
+    if submission_request_budget is None and subreddit_request_budget is None:
+        return None
+    return RequestBudget(subreddit_request_budget)
+
+
+def get_subreddit_submissions(subreddit, top_n_submissions, comment_depth, verbose=VERBOSE, worker_id=None,
+                              with_ids=False, submission_request_budget=None, subreddit_request_budget=None):
     """Given a subreddit object, returns a list of submissions.
 
     Attributes:
         subreddit: praw.models.Subreddit
         top_n_submissions: int
         comment_depth: int
+        with_ids: bool
+            If True, returns a list of (submission_id, text) tuples instead.
+        submission_request_budget: int
+            Maximum "more comments" requests per submission.
+        subreddit_request_budget: int
+            Maximum "more comments" requests for all submissions of the subreddit together.
+            If either budget is given, comments are traversed with iter_comment_chains.
 
     Return is a list of length top_n_submissions, with each string being the submission's
     title and comment chain.
@@ -118,12 +192,12 @@ def get_subreddit_submissions(subreddit, top_n_submissions, comment_depth, verbo
     assert isinstance(subreddit, praw.models.Subreddit), 'Input should be a Subreddit object.'
     top_submissions = subreddit.top(limit=top_n_submissions)
     submission_comment_chains = []
+    subreddit_budget = subreddit_request_budget_for(submission_request_budget, subreddit_request_budget)
 
     for i, submission in enumerate(top_submissions):
-        submission.comment_sort = 'top'
-        comment_forest = submission.comments
-        content = [submission.title] + traverse_comment_forest(comment_forest, comment_depth)
-        submission_comment_chains.append('\n'.join(content))
+        budget = subreddit_budget.child(submission_request_budget) if subreddit_budget is not None else None
+        text = submission_text(submission, comment_depth, budget=budget)
+        submission_comment_chains.append((submission.id, text) if with_ids else text)
 
         if verbose > 0:
             msg = '{i} of {n} submissions extracted for {title}'
@@ -135,92 +209,292 @@ def get_subreddit_submissions(subreddit, top_n_submissions, comment_depth, verbo
     return submission_comment_chains
 
 
+def write_subreddit_data(path, description, submissions):
+    """Write a subreddit's description and submissions to its data directory."""
+    with open(op.join(path, 'description'), 'w', encoding='utf-8') as file:
+        file.write(_decode_utf(description))
+    for i, sub in enumerate(submissions):
+        with open(op.join(path, 'sub_{i}'.format(i=i)), 'w', encoding='utf-8') as file:
+            file.write(_decode_utf(sub))
+
+    # remove submissions left over from a previous download that returned more of them
+    i = len(submissions)
+    while op.exists(op.join(path, 'sub_{i}'.format(i=i))):
+        os.remove(op.join(path, 'sub_{i}'.format(i=i)))
+        i += 1
+
+
+def save_subreddit(subreddit_tuple, description, submissions, corpus_writer=None, metrics=None):
+    """Save a subreddit to its data directory, or to a packed corpus store if a writer is given.
+
+    If a CrawlMetrics is given, the write is timed.
+
+    Returns:
+        path: str
+            Where the subreddit was written.
+    """
+    if metrics is not None:
+        with metrics.writing():
+            return save_subreddit(subreddit_tuple, description, submissions, corpus_writer=corpus_writer)
+
+    if corpus_writer is not None:
+        corpus_writer.add_subreddit(subreddit_tuple, description, submissions)
+        return corpus_writer.store_dir
+
+    path = data_dir_subreddit(subreddit_tuple)
+    write_subreddit_data(path, description, submissions)
+    return path
+
+
+class TreeWriter(object):
+    """Writes subreddits to a category/subcategory/subreddit directory tree under store_dir.
+
+    Has the add_subreddit/close interface of a CorpusWriter, so the engines can write a reddit_raw
+    tree somewhere other than data/raw, e.g. to a shard partition.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def add_subreddit(self, subreddit_tuple, description, submissions):
+        path = op.join(self.store_dir, *[valid_subreddit_dirname(e) for e in subreddit_tuple])
+        os.makedirs(path, exist_ok=True)
+        write_subreddit_data(path, description, submissions)
+
+    def close(self):
+        pass
+
+
+def download_subreddit(reddit, subreddit, top_n_submissions, comment_depth, worker_id=None,
+                       submission_request_budget=None, subreddit_request_budget=None):
+    """Download a subreddit's description and top submissions.
+
+    Returns:
+        (description, submissions): (str, list(tuple))
+            submissions is a list of (submission_id, text).
+    """
+    praw_subreddit = reddit.subreddit(subreddit)
+
+    try:
+        description = _decode_utf(praw_subreddit.description)
+    except Exception:
+        description = ''
+
+    submissions = get_subreddit_submissions(praw_subreddit,
+                                            top_n_submissions=top_n_submissions,
+                                            comment_depth=comment_depth,
+                                            worker_id=worker_id,
+                                            verbose=0,
+                                            with_ids=True,
+                                            submission_request_budget=submission_request_budget,
+                                            subreddit_request_budget=subreddit_request_budget)
+    return description, submissions
+
+
 def worker(payload):
     """Performs data downloading"""
 
     # unzip payload
-    subreddit_tuples, worker_id, reddit = payload
-    print('Worker #{id_} has entered the game.'.format(id_=worker_id))
-    time.sleep(1)
-
-    for sub_id, (cat, subcat, subreddit) in enumerate(subreddit_tuples):
-        # download and write description
-        t0 = default_timer()
-        if cat == 'Defunct':
-            continue
-        subreddit = valid_subreddit_dirname(subreddit)
-        praw_subreddit = reddit.subreddit(subreddit)
+    work_queue, worker_id, credential_pool, manifest, corpus_writer, fetch_kwargs, metrics, verbose = payload
+    if verbose > 0:
+        print('Worker #{id_} has entered the game.'.format(id_=worker_id))
+
+    with metrics.worker(worker_id):
+        n_complete = 0
+        while True:
+            subreddit_tuple = work_queue.get(worker_id)
+            if subreddit_tuple is None:
+                break
+
+            # download and write description
+            t0 = default_timer()
+            cat, subcat, subreddit = subreddit_tuple
+            subreddit = valid_subreddit_dirname(subreddit)
+
+            try:
+                with credential_pool.lease() as reddit:
+                    description, submissions = download_subreddit(reddit, subreddit, worker_id=worker_id,
+                                                                  **fetch_kwargs)
+            except Exception as e:
+                print('Worker #{id_}: failed to download {sub}: {e!r}'.format(id_=worker_id, sub=subreddit, e=e))
+                if manifest is not None:
+                    manifest.record(subreddit_tuple, FAILED)
+                continue
+
+            # write to file
+            path = save_subreddit((cat, subcat, subreddit), description, [text for _, text in submissions],
+                                  corpus_writer=corpus_writer, metrics=metrics)
+            if manifest is not None:
+                manifest.record(subreddit_tuple, COMPLETE, submission_ids=[id_ for id_, _ in submissions])
+            n_complete += 1
+
+            if verbose <= 0:
+                continue
+            msg = 'Worker #{id_}: {n} complete, {remaining} remaining. Time elapsed: {time}s\n'
+            msg += 'Wrote to: {path}\n'
+            print(msg.format(id_=worker_id,
+                             n=n_complete,
+                             remaining=len(work_queue),
+                             time=round(default_timer() - t0, 2),
+                             path=path))
+
+
+def remove_defunct(subreddit_tuples):
+    """Drop subreddits in the 'Defunct' category, before any work is scheduled."""
+    return [t for t in subreddit_tuples if t[0] != 'Defunct']
+
+
+def download_reddit_data_threaded(subreddit_tuples, reddit_instances, top_n_submissions, comment_depth,
+                                  n_threads=N_THREADS, manifest=None, corpus_writer=None, verbose=VERBOSE,
+                                  submission_request_budget=None, subreddit_request_budget=None, metrics=None):
+    """Download subreddits with a pool of blocking threads.
+
+    Threads pull subreddits from a shared queue and lease whichever credential has the most budget.
 
-        try:
-            description = _decode_utf(praw_subreddit.description)
-        except Exception:
-            description = ''
-
-        # download and write top_n_submissions
-        submissions = get_subreddit_submissions(praw_subreddit,
-                                                top_n_submissions=TOP_N_SUBMISSIONS,
-                                                comment_depth=COMMENT_DEPTH,
-                                                worker_id=worker_id,
-                                                verbose=0)
-
-        # write to file
-        path = data_dir_subreddit(cat, subcat, subreddit)
-        with open(op.join(path, 'description'), 'w') as file:
-            file.write(description)
-        for i, sub in enumerate(submissions):
-            with open(op.join(path, 'sub_{i}'.format(i=i)), 'w') as file:
-                file.write(_decode_utf(sub))
-
-        msg = 'Worker #{id_}: {sub_id} / {total} complete. Time elapsed: {time}s\n'
-        msg += 'Wrote to: {path}\n'
-        print(msg.format(id_=worker_id,
-                         sub_id=sub_id,
-                         total=len(subreddit_tuples),
-                         time=round(default_timer() - t0, 2),
-                         path=path))
-
-
-def split_list(arr, n):
-    """Split a list into n chunks."""
-    return [arr[i::n] for i in range(n)]
+    Args:
+        subreddit_tuples (list(tuple)): List of (category, subcategory, subreddit).
+        reddit_instances (list(praw.Reddit)): One authenticated instance per credential.
+        n_threads (int): Number of threads, independent of the number of credentials.
+        manifest (Manifest): If given, records the outcome of every subreddit.
+        corpus_writer (CorpusWriter): If given, subreddits are appended to the packed corpus store.
+        submission_request_budget (int): Maximum "more comments" requests per submission.
+        subreddit_request_budget (int): Maximum "more comments" requests per subreddit.
+        metrics (CrawlMetrics): If given, write times are recorded per worker.
+    """
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    work_queue = WorkStealingQueue(subreddit_tuples, n_threads)
+    credential_pool = CredentialPool(reddit_instances)
+    fetch_kwargs = {'top_n_submissions': top_n_submissions,
+                    'comment_depth': comment_depth,
+                    'submission_request_budget': submission_request_budget,
+                    'subreddit_request_budget': subreddit_request_budget}
+    payloads = [(work_queue, worker_id, credential_pool, manifest, corpus_writer, fetch_kwargs, metrics, verbose)
+                for worker_id in range(n_threads)]
+
+    pool = ThreadPool(n_threads)
+    try:
+        pool.map(worker, payloads)
+    finally:
+        pool.close()
 
 
 def download_reddit_data(subreddit_dict, reddit_data_dir,
-                         top_n_submissions=TOP_N_SUBMISSIONS, comment_depth=COMMENT_DEPTH):
+                         top_n_submissions=TOP_N_SUBMISSIONS, comment_depth=COMMENT_DEPTH, engine='async',
+                         resume=False, refresh_older_than=None, store='files', http_cache=None,
+                         submission_request_budget=None, subreddit_request_budget=None, only_new=False,
+                         metrics_out_dir=None, metrics_interval=EXPORT_INTERVAL, shard=None, wiki=False,
+                         wiki_max_pages=WIKI_MAX_PAGES, wiki_max_bytes=WIKI_MAX_BYTES):
     """Downloads all relevant data from subreddits specified in the subreddit dict.
 
     Downloads to raw data folder. Currently downloads the following data
     - subreddit description
-    - subreddit wiki text
     - all comments from top_n_submissions posts
+    - subreddit wiki text, if wiki is True
 
     Args:
         subreddit_dict (dict): Dictionary of subreddits, organized by the hierarchy:
                                Category | Subcategory | List of subreddits
         reddit_data_dir (str): Subdirectory of data/raw to store data.
         top_n_submissions (n): Number of posts to scrape comments from.
+        engine (str): 'async' to keep many requests in flight per credential, 'batch' to list many
+                      subreddits at once and pipeline their comment fetches, or 'thread' for the
+                      blocking thread pool.
+        resume (bool): If True, skips subreddits the manifest records as complete.
+        refresh_older_than (float): If given, skips only subreddits completed less than this many
+                                    seconds ago. Implies resume.
+        store (str): 'files' to write a directory per subreddit, or 'packed' to append to the
+                     packed corpus store.
+        http_cache (str): If given, one of 'record', 'replay' or 'read-through'.
+        submission_request_budget (int): Maximum "more comments" requests per submission.
+        subreddit_request_budget (int): Maximum "more comments" requests per subreddit. If either
+                                        budget is given, only comments that are kept get expanded.
+        only_new (bool): If True, only downloads subreddits added by the last subreddit list refresh.
+        metrics_out_dir (str): Where crawl metrics are exported. Defaults to data/interim/crawl_metrics.
+        metrics_interval (float): Seconds between metrics exports. 0 to only export when finished.
+        shard (tuple): If given, (i, N) to download only the subreddits of shard i of N, to the shard's
+                       own partition in data/raw/reddit_shards. See sharding.py.
+        wiki (bool): If True, harvests the wikis afterwards to data/raw/reddit_wiki (or the shard's
+                     partition), only fetching pages edited since the last harvest. See wiki_harvest.py.
+        wiki_max_pages (int): Wiki pages kept per subreddit.
+        wiki_max_bytes (int): Bytes of wiki text kept per subreddit.
     """
-    N_THREADS = 10
-    flattened_subreddits = flatten_subreddit_dict(subreddit_dict)
-
-    # split subreddit tuples
-    split_subreddits = split_list(flattened_subreddits, N_THREADS)
+    if engine not in ENGINES:
+        raise ValueError('engine must be one of the following: {engines}'.format(engines=ENGINES))
+    if store not in STORES:
+        raise ValueError('store must be one of the following: {stores}'.format(stores=STORES))
+
+    subreddit_tuples = remove_defunct(flatten_subreddit_dict(subreddit_dict))
+    if shard is not None:
+        subreddit_tuples = select_shard(subreddit_tuples, *shard)
+        write_shard_info(shard_partition_dir(*shard), shard[0], shard[1], subreddit_tuples)
+    if only_new:
+        added = added_subreddits()
+        subreddit_tuples = [t for t in subreddit_tuples if t in added]
+    manifest, corpus_writer = _open_output(reddit_data_dir, store, shard)
+    wiki_tuples = subreddit_tuples
+    if resume or refresh_older_than is not None:
+        n_total = len(subreddit_tuples)
+        subreddit_tuples = manifest.pending(subreddit_tuples, max_age=refresh_older_than)
+        print('{n} of {total} subreddits need to be downloaded.'.format(n=len(subreddit_tuples), total=n_total))
 
-    # make reddit instances
     credentials = parse_client_ids()
-    assert len(credentials) >= N_THREADS, 'Need as many credential sets as threads.'
-    credentials = credentials[0:N_THREADS]
-    reddit_instances = [open_reddit_instance(cred) for cred in credentials]
-
-    # worker ids
-    worker_ids = [i for i in range(N_THREADS)]
-
-    # zip payloads
-    payloads = [payload for payload in zip(split_subreddits, worker_ids, reddit_instances)]
-
-    pool = ThreadPool(N_THREADS)
-    pool.map(worker, payloads)
-    print('COMPLETE ' * 100)
+    reddit_instances = [open_reddit_instance(cred, http_cache=http_cache) for cred in credentials]
+
+    # credentials are labelled by their position in .env, never by client id
+    metrics = CrawlMetrics()
+    for i, reddit in enumerate(reddit_instances):
+        instrument_reddit(reddit, metrics, credential=i)
+    metrics_out_dir = metrics_out_dir or metrics_dir()
+    if metrics_interval:
+        metrics.start_exporter(metrics_out_dir, interval=metrics_interval)
+
+    kwargs = dict(top_n_submissions=top_n_submissions, comment_depth=comment_depth, manifest=manifest,
+                  corpus_writer=corpus_writer, submission_request_budget=submission_request_budget,
+                  subreddit_request_budget=subreddit_request_budget, metrics=metrics)
+    _run_engine(engine, subreddit_tuples, reddit_instances, kwargs)
+    if wiki:
+        wiki_out_dir = op.join(shard_partition_dir(*shard), WIKI_DIRNAME) if shard is not None else None
+        harvest_wikis(wiki_tuples, reddit_instances, out_dir=wiki_out_dir, max_pages=wiki_max_pages,
+                      max_bytes=wiki_max_bytes, resume=resume, refresh_older_than=refresh_older_than,
+                      metrics=metrics)
+    _finish(manifest, corpus_writer, metrics, metrics_out_dir)
+
+
+def _run_engine(engine, subreddit_tuples, reddit_instances, kwargs):
+    if engine == 'async':
+        from subreddit_recommender.src.data.async_download import download_reddit_data_async
+
+        download_reddit_data_async(subreddit_tuples, reddit_instances, **kwargs)
+    elif engine == 'batch':
+        from subreddit_recommender.src.data.batch_fetch import download_reddit_data_batched
+
+        download_reddit_data_batched(subreddit_tuples, reddit_instances, **kwargs)
+    else:
+        download_reddit_data_threaded(subreddit_tuples, reddit_instances, **kwargs)
+
+
+def _open_output(reddit_data_dir, store, shard=None):
+    """Return the (manifest, corpus_writer) of a download. A shard writes to its own partition."""
+    if shard is None:
+        corpus_writer = CorpusWriter(corpus_store_dir()) if store == 'packed' else None
+        return Manifest.in_directory(op.join(data_dir('raw'), reddit_data_dir)), corpus_writer
+
+    partition_dir = shard_partition_dir(*shard)
+    if store == 'packed':
+        corpus_writer = CorpusWriter(op.join(partition_dir, PACKED_DIRNAME))
+    else:
+        corpus_writer = TreeWriter(op.join(partition_dir, TREE_DIRNAME))
+    return Manifest.in_directory(partition_dir), corpus_writer
+
+
+def _finish(manifest, corpus_writer, metrics, metrics_out_dir):
+    manifest.compact()
+    if corpus_writer is not None:
+        corpus_writer.close()
+    metrics.stop_exporter(metrics_out_dir)
+    print('Download complete.')
+    print(metrics.summary())
+    print('Metrics written to {dir}'.format(dir=metrics_out_dir))
 
 
 def submission_example():
@@ -248,17 +522,69 @@ def submission_example():
         print(chain)
 
 
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Download reddit data for every subreddit in subreddit_list.json.')
+    parser.add_argument('--engine', choices=ENGINES, default='async',
+                        help='async: many requests in flight per credential. '
+                             'batch: subreddits listed in batches, pipelined comment fetches across them. '
+                             'thread: blocking thread pool sharing the credentials.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip subreddits the manifest records as complete.')
+    parser.add_argument('--refresh-older-than', type=parse_duration, default=None, metavar='DURATION',
+                        help='Only re-download subreddits completed longer ago than DURATION, e.g. 12h or 7d.')
+    parser.add_argument('--store', choices=STORES, default='files',
+                        help='files: a directory per subreddit. packed: append to the packed corpus store.')
+    parser.add_argument('--http-cache', choices=HTTP_CACHE_MODES, default=None,
+                        help='Cache reddit API responses in data/interim/http_cache. '
+                             'replay runs entirely offline from a previous recording.')
+    parser.add_argument('--submission-request-budget', type=int, default=None, metavar='N',
+                        help='Expand at most N "more comments" objects per submission, and only those '
+                             'that add comments which are kept.')
+    parser.add_argument('--subreddit-request-budget', type=int, default=None, metavar='N',
+                        help='Expand at most N "more comments" objects per subreddit.')
+    parser.add_argument('--only-new', action='store_true',
+                        help='Only download subreddits added by the last make_subreddit_list.py refresh.')
+    parser.add_argument('--shard', type=parse_shard, default=None, metavar='I/N',
+                        help='Only download shard I of N (numbered from 0), to data/raw/reddit_shards. '
+                             'Merge the shards with sharding.py.')
+    parser.add_argument('--wiki', action='store_true',
+                        help='Also harvest subreddit wikis to data/raw/reddit_wiki, skipping unchanged pages.')
+    parser.add_argument('--wiki-max-pages', type=int, default=WIKI_MAX_PAGES, metavar='N',
+                        help='Wiki pages kept per subreddit.')
+    parser.add_argument('--wiki-max-bytes', type=int, default=WIKI_MAX_BYTES, metavar='N',
+                        help='Bytes of wiki text kept per subreddit.')
+    parser.add_argument('--metrics-dir', default=None,
+                        help='Export crawl metrics as JSON and Prometheus text here. '
+                             'Defaults to data/interim/crawl_metrics.')
+    parser.add_argument('--metrics-interval', type=float, default=EXPORT_INTERVAL, metavar='SECONDS',
+                        help='Seconds between metrics exports. 0 to only export at the end.')
+    return parser.parse_args(args)
+
+
 def main():
+    args = parse_args()
     reddit_data_dir = op.join(data_dir('raw'), 'reddit_raw')
     subreddit_dict_path = op.join(data_dir('raw'), 'subreddit_list.json')
     subreddit_dict = load_json(subreddit_dict_path)
 
-    create_directory_structure(subreddit_dict, reddit_data_dir, overwrite=False)
-    download_reddit_data(subreddit_dict, reddit_data_dir)
+    if args.shard is None:
+        create_directory_structure(subreddit_dict, reddit_data_dir, overwrite=False)
+    download_reddit_data(subreddit_dict, reddit_data_dir, engine=args.engine,
+                         resume=args.resume, refresh_older_than=args.refresh_older_than, store=args.store,
+                         http_cache=args.http_cache,
+                         submission_request_budget=args.submission_request_budget,
+                         subreddit_request_budget=args.subreddit_request_budget,
+                         only_new=args.only_new,
+                         metrics_out_dir=args.metrics_dir,
+                         metrics_interval=args.metrics_interval,
+                         shard=args.shard,
+                         wiki=args.wiki,
+                         wiki_max_pages=args.wiki_max_pages,
+                         wiki_max_bytes=args.wiki_max_bytes)
 
 
 if __name__ == '__main__':
     try:
         main()
     except KeyboardInterrupt:
-        pass
+        print('Interrupted. Finished subreddits are recorded in the manifest, rerun with --resume to continue.')
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""A local stand-in for the reddit API.
+
+Serves deterministic synthetic subreddits, submissions and comment trees over HTTP, so the
+downloaders can be run and benchmarked without credentials or network access. Supports the
+endpoints praw uses for the crawl: access_token, about, top, comments, morechildren and info, and
+the wiki page listing, pages and revisions.
+
+    with FakeRedditServer(['cats', 'dogs'], latency=0.05) as server:
+        reddit = praw.Reddit(**server.praw_config())
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+WORDS = ('cat dog reddit post comment thread vote karma meme news game music movie book science '
+         'history space code python data model train recommend subreddit community moderator '
+         'question answer link image video weekly discussion favorite best worst new old').split()
+
+
+def _words(seed, n):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(n))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeRedditServer(object):
+    """Threaded HTTP server imitating the parts of the reddit API used by the crawler.
+
+    Every submission has top_level_comments comments, and every comment has replies_per_comment
+    replies down to reply_depth levels. Like reddit, the comments endpoint returns only the first
+    initial_top_level top level comments and initial_replies replies per comment. The rest hide
+    behind "more" objects that cost a morechildren request each.
+
+    Attributes:
+        subreddits (list(str)): Names of the subreddits to serve.
+        n_submissions (int): Submissions per subreddit.
+        latency (float): Seconds added to every response.
+        latency_jitter (float): Uniformly distributed extra seconds added to every response.
+        error_rate (float): Probability of answering a request with 429 Too Many Requests.
+        rate_limit (int): If given, sends X-Ratelimit headers allowing this many requests per
+            rate_limit_window seconds per client.
+        seed (int): Seed for latency jitter and errors. Content is always deterministic.
+        wiki_pages (int): Wiki pages per subreddit: 'index', then 'page1', 'page2', ... Edit them with edit_wiki_page.
+        wiki_page_words (int): Words per wiki page.
+    """
+
+    def __init__(self, subreddits, n_submissions=25, top_level_comments=20, replies_per_comment=3,
+                 reply_depth=2, initial_top_level=10, initial_replies=2, latency=0.0, latency_jitter=0.0,
+                 error_rate=0.0, rate_limit=None, rate_limit_window=600, seed=0, host='127.0.0.1', port=0,
+                 wiki_pages=0, wiki_page_words=100):
+        self.subreddits = [s.replace('/r/', '').replace('/', '') for s in subreddits]
+        self.n_submissions = n_submissions
+        self.top_level_comments = top_level_comments
+        self.replies_per_comment = replies_per_comment
+        self.reply_depth = reply_depth
+        self.initial_top_level = initial_top_level
+        self.initial_replies = initial_replies
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.wiki_page_words = wiki_page_words
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._subreddit_ids = {name.lower(): i for i, name in enumerate(self.subreddits)}
+        self._client_windows = {}
+        self._top_order = {}
+        self.requests = Counter()
+        self.status_codes = Counter()
+        # (subreddit, page) -> revision timestamps, oldest first
+        self._wiki_history = {(name.lower(), page): [1500000000.0]
+                              for name in self.subreddits
+                              for page in ['index'] + ['page{i}'.format(i=i) for i in range(1, wiki_pages)]}
+
+        self._server = _ThreadingHTTPServer((host, port), _make_handler(self))
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{host}:{port}'.format(host=host, port=port)
+
+    def praw_config(self, client_id='fake_client', client_secret='fake_secret'):
+        """Return keyword arguments for praw.Reddit that point it at this server."""
+        return {'client_id': client_id, 'client_secret': client_secret,
+                'user_agent': 'subreddit_recommender fake reddit client',
+                'oauth_url': self.url, 'reddit_url': self.url}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def n_requests(self):
+        return sum(self.requests.values())
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests.clear()
+            self.status_codes.clear()
+
+    # synthetic data
+
+    def submission_id(self, subreddit, i):
+        return str(1000 + self._subreddit_ids[subreddit.lower()] * self.n_submissions + i)
+
+    def _parse_submission_id(self, submission_id):
+        try:
+            index = int(submission_id) - 1000
+        except ValueError:
+            return None
+        subreddit_index, i = divmod(index, self.n_submissions)
+        if index < 0 or subreddit_index >= len(self.subreddits):
+            return None
+        return self.subreddits[subreddit_index], i
+
+    def _subreddit(self, name):
+        name = self.subreddits[self._subreddit_ids[name.lower()]]
+        return {'kind': 't5', 'data': {
+            'id': 'sr{i}'.format(i=self._subreddit_ids[name.lower()]), 'name': 't5_' + name,
+            'display_name': name, 'description': _words(name, 50), 'subscribers': 1000}}
+
+    def _submission(self, submission_id):
+        subreddit, i = self._parse_submission_id(submission_id)
+        return {'kind': 't3', 'data': {
+            'id': submission_id, 'name': 't3_' + submission_id, 'title': _words(submission_id, 8),
+            'selftext': _words(submission_id + 's', 30), 'subreddit': subreddit, 'score': 1000 - i,
+            'num_comments': self.top_level_comments, 'permalink': '/r/{s}/comments/{id}/'.format(
+                s=subreddit, id=submission_id)}}
+
+    def _child_ids(self, comment_id):
+        """Ids of the replies of a comment, or of the top level comments if given a submission id."""
+        is_submission = 'c' not in comment_id
+        if is_submission:
+            return ['{id}c{i}'.format(id=comment_id, i=i) for i in range(self.top_level_comments)]
+        depth = comment_id.count('x')
+        if depth >= self.reply_depth:
+            return []
+        return ['{id}x{i}'.format(id=comment_id, i=i) for i in range(self.replies_per_comment)]
+
+    def _comment(self, comment_id, replies):
+        submission_id = comment_id.split('c', 1)[0]
+        parent = comment_id.rsplit('x', 1)[0] if 'x' in comment_id else None
+        return {'kind': 't1', 'data': {
+            'id': comment_id, 'name': 't1_' + comment_id, 'body': _words(comment_id, 20),
+            'link_id': 't3_' + submission_id, 'parent_id': 't1_' + parent if parent else 't3_' + submission_id,
+            'score': 10, 'author': 'user' + comment_id[-1], 'replies': replies}}
+
+    def _more(self, parent_fullname, child_ids):
+        return {'kind': 'more', 'data': {
+            'id': child_ids[0], 'name': 't1_' + child_ids[0], 'parent_id': parent_fullname,
+            'count': len(child_ids), 'children': child_ids, 'depth': 0}}
+
+    def _listing(self, children):
+        return {'kind': 'Listing', 'data': {'after': None, 'before': None, 'children': children}}
+
+    def _comment_tree(self, comment_id):
+        """A comment with its initially visible replies and a "more" object for the rest."""
+        child_ids = self._child_ids(comment_id)
+        if not child_ids:
+            return self._comment(comment_id, '')
+        children = [self._comment_tree(c) for c in child_ids[:self.initial_replies]]
+        if len(child_ids) > self.initial_replies:
+            children.append(self._more('t1_' + comment_id, child_ids[self.initial_replies:]))
+        return self._comment(comment_id, self._listing(children))
+
+    def _flat_subtree(self, comment_id):
+        things = [self._comment(comment_id, '')]
+        for child_id in self._child_ids(comment_id):
+            things.extend(self._flat_subtree(child_id))
+        return things
+
+    def set_top_submissions(self, subreddit, indices):
+        """Rank the submissions with these indices at the top of a subreddit, e.g. when new posts become popular."""
+        with self._lock:
+            self._top_order[subreddit.lower()] = list(indices)
+
+    def edit_wiki_page(self, subreddit, page, timestamp=None):
+        """Add a revision to a wiki page, creating the page if it does not exist."""
+        with self._lock:
+            history = self._wiki_history.setdefault((subreddit.lower(), page), [])
+            history.append(time.time() if timestamp is None else timestamp)
+
+    def _revision_id(self, subreddit, page, n):
+        return '{sub}-{page}-r{n}'.format(sub=subreddit.lower(), page=page, n=n)
+
+    def wiki_page_content(self, subreddit, page):
+        """Return the markdown of the latest revision of a wiki page."""
+        history = self._wiki_history[(subreddit.lower(), page)]
+        return _words(self._revision_id(subreddit, page, len(history)), self.wiki_page_words)
+
+    def _wiki_page(self, subreddit, page):
+        history = self._wiki_history[(subreddit.lower(), page)]
+        revision_id = self._revision_id(subreddit, page, len(history))
+        content = self.wiki_page_content(subreddit, page)
+        return {'kind': 'wikipage', 'data': {
+            'content_md': content, 'content_html': '<p>{c}</p>'.format(c=content), 'may_revise': False,
+            'revision_by': None, 'revision_date': history[-1], 'revision_id': revision_id}}
+
+    # endpoints. each returns a JSON payload, or None for a 404.
+
+    ROUTES = [
+        (r'^/api/v1/access_token$', '_access_token'),
+        (r'^/r/([^/]+)/about$', '_about'),
+        (r'^/r/([^/]+)/(?:top|hot|new)$', '_top'),
+        (r'^/comments/([^/]+)$', '_comments'),
+        (r'^/api/morechildren$', '_morechildren'),
+        (r'^/api/info$', '_info'),
+        (r'^/r/([^/]+)/wiki/pages$', '_wiki_pages'),
+        (r'^/r/([^/]+)/wiki/revisions$', '_wiki_revisions'),
+        (r'^/r/([^/]+)/wiki/(.+)$', '_wiki'),
+    ]
+
+    def handle(self, method, path, query, body, headers):
+        """Return (status, json_body, extra_headers) for a request."""
+        params = dict(query)
+        params.update(body)
+        for pattern, endpoint in self.ROUTES:
+            match = re.match(pattern, path.rstrip('/'))
+            if match:
+                payload = getattr(self, endpoint)(params, headers, *match.groups())
+                if payload is not None:
+                    return 200, payload, {}
+        return 404, {'message': 'Not Found', 'error': 404}, {}
+
+    def _access_token(self, params, headers):
+        client_id = _basic_auth_user(headers.get('Authorization', ''))
+        return {'access_token': 'token-' + client_id, 'token_type': 'bearer', 'expires_in': 3600, 'scope': '*'}
+
+    def _about(self, params, headers, subreddit):
+        if subreddit.lower() in self._subreddit_ids:
+            return self._subreddit(subreddit)
+
+    def _top(self, params, headers, subreddit):
+        if subreddit.lower() not in self._subreddit_ids:
+            return None
+        limit = min(int(params.get('limit', 25)), 100)
+        order = self._top_order.get(subreddit.lower(), list(range(self.n_submissions)))
+        after = self._parse_submission_id(params.get('after', '').replace('t3_', ''))
+        start = order.index(after[1]) + 1 if after and after[1] in order else 0
+        ids = [self.submission_id(subreddit, i) for i in order[start:start + limit]]
+        listing = self._listing([self._submission(i) for i in ids])
+        if start + limit < len(order) and ids:
+            listing['data']['after'] = 't3_' + ids[-1]
+        return listing
+
+    def _comments(self, params, headers, submission_id):
+        if self._parse_submission_id(submission_id) is None:
+            return None
+        child_ids = self._child_ids(submission_id)
+        comments = [self._comment_tree(c) for c in child_ids[:self.initial_top_level]]
+        if len(child_ids) > self.initial_top_level:
+            comments.append(self._more('t3_' + submission_id, child_ids[self.initial_top_level:]))
+        return [self._listing([self._submission(submission_id)]), self._listing(comments)]
+
+    def _morechildren(self, params, headers):
+        things = []
+        for comment_id in params.get('children', '').split(','):
+            if comment_id:
+                things.extend(self._flat_subtree(comment_id))
+        return {'json': {'errors': [], 'data': {'things': things}}}
+
+    def _info(self, params, headers):
+        things = []
+        for fullname in params.get('id', '').split(','):
+            submission_id = fullname.replace('t3_', '')
+            if fullname.startswith('t3_') and self._parse_submission_id(submission_id) is not None:
+                things.append(self._submission(submission_id))
+        return self._listing(things)
+
+    def _wiki_pages(self, params, headers, subreddit):
+        if subreddit.lower() in self._subreddit_ids:
+            pages = sorted(page for sub, page in self._wiki_history if sub == subreddit.lower())
+            return {'kind': 'wikipagelisting', 'data': pages}
+
+    def _wiki_revisions(self, params, headers, subreddit):
+        if subreddit.lower() not in self._subreddit_ids:
+            return None
+        revisions = [{'id': self._revision_id(sub, page, n + 1), 'page': page, 'timestamp': timestamp,
+                      'reason': None, 'author': None, 'revision_hidden': False}
+                     for (sub, page), history in sorted(self._wiki_history.items()) if sub == subreddit.lower()
+                     for n, timestamp in enumerate(history)]
+        revisions.sort(key=lambda revision: revision['timestamp'], reverse=True)
+        return self._listing(revisions[:min(int(params.get('limit', 25)), 100)])
+
+    def _wiki(self, params, headers, subreddit, page):
+        if (subreddit.lower(), page) in self._wiki_history:
+            return self._wiki_page(subreddit, page)
+
+    def _rate_limit_headers(self, client):
+        if self.rate_limit is None:
+            return {}
+        now = time.time()
+        with self._lock:
+            window_start, used = self._client_windows.get(client, (now, 0))
+            if now - window_start >= self.rate_limit_window:
+                window_start, used = now, 0
+            used += 1
+            self._client_windows[client] = (window_start, used)
+        return {'X-Ratelimit-Used': str(used),
+                'X-Ratelimit-Remaining': str(max(0, self.rate_limit - used)),
+                'X-Ratelimit-Reset': str(int(max(1, window_start + self.rate_limit_window - now)))}
+
+    def respond(self, method, raw_path, body, headers):
+        """Apply latency and errors, then dispatch. Returns (status, payload bytes, headers)."""
+        url = urlparse(raw_path)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        form = {k: v[-1] for k, v in parse_qs(body).items()} if body else {}
+        endpoint = re.sub(r'/comments/[^/]+', '/comments/{id}', url.path.rstrip('/'))
+        endpoint = re.sub(r'^/r/[^/]+/', '/r/{subreddit}/', endpoint)
+        endpoint = re.sub(r'/wiki/(?!pages$|revisions$).+$', '/wiki/{page}', endpoint)
+
+        with self._lock:
+            delay = self.latency + self._rng.uniform(0, self.latency_jitter)
+            throttled = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+
+        if throttled:
+            status, payload, extra_headers = 429, {'message': 'Too Many Requests', 'error': 429}, {}
+        else:
+            status, payload, extra_headers = self.handle(method, url.path, query, form, headers)
+        extra_headers.update(self._rate_limit_headers(headers.get('Authorization', '')))
+
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.status_codes[status] += 1
+        return status, json.dumps(payload).encode('utf-8'), extra_headers
+
+
+def _basic_auth_user(authorization):
+    try:
+        return base64.b64decode(authorization.split(' ', 1)[1]).decode('utf-8').split(':', 1)[0]
+    except (IndexError, ValueError):
+        return 'anonymous'
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _dispatch(self, method):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length).decode('utf-8') if length else ''
+            status, payload, headers = server.respond(method, self.path, body, self.headers)
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=UTF-8')
+            self.send_header('Content-Length', str(len(payload)))
+            if self.close_connection:
+                # tell the client, otherwise it may reuse the socket for its next request
+                self.send_header('Connection', 'close')
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._dispatch('GET')
+
+        def do_POST(self):
+            self._dispatch('POST')
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
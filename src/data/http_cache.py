@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Record/replay HTTP cache for praw.
+
+CachingRequestor replaces prawcore's Requestor, the layer every praw HTTP request goes through.
+Successful GET responses are stored on disk, keyed by method, endpoint and parameters (never by
+headers, since the OAuth token changes between runs). Other requests, error responses and the OAuth
+token endpoints are never stored, so tokens stay off the disk and are never reused once expired. Modes:
+
+    record        always hit the network, store every response
+    replay        serve from the cache only, raise CacheMissError on a miss. Token requests get a
+                  placeholder token, since replayed requests never reach reddit
+    read-through  serve from the cache, fetch and store on a miss
+"""
+import base64
+import hashlib
+import json
+import os
+import os.path as op
+import threading
+from collections import OrderedDict
+
+import prawcore
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from subreddit_recommender.src.util import data_dir
+
+RECORD = 'record'
+REPLAY = 'replay'
+READ_THROUGH = 'read-through'
+MODES = [RECORD, REPLAY, READ_THROUGH]
+MAX_BYTES = 1024 * 1024 * 1024
+# eviction frees space down to this fraction of max_bytes, so it does not run on every put
+LOW_WATER_MARK = 0.9
+
+# OAuth endpoints, whose responses hold or revoke credentials
+_AUTH_PATHS = ['/api/v1/access_token', '/api/v1/revoke_token']
+_REPLAY_TOKEN = {'access_token': 'replay', 'token_type': 'bearer', 'expires_in': 3600, 'scope': '*'}
+
+# replayed rate limit headers would make prawcore throttle an offline run
+_DROPPED_HEADERS = ['x-ratelimit-remaining', 'x-ratelimit-reset', 'x-ratelimit-used']
+
+
+class CacheMissError(Exception):
+    """Exception to raise when a request is not in the cache in replay mode."""
+    pass
+
+
+def http_cache_dir(cache_dirname='http_cache'):
+    """Return the default location of the HTTP cache."""
+    return op.join(data_dir('interim'), cache_dirname)
+
+
+def _normalize(value):
+    """Make params/data JSON serializable and independent of ordering."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        value = list(value.items())
+    if isinstance(value, (list, tuple)):
+        return sorted([str(k), str(v)] for k, v in value)
+    return str(value)
+
+
+def is_auth_request(url):
+    """Return True for requests to the OAuth token endpoints."""
+    return any(url.rstrip('/').endswith(path) for path in _AUTH_PATHS)
+
+
+def is_cacheable(method, url):
+    """Return True if responses to the request may be stored."""
+    return method.upper() == 'GET' and not is_auth_request(url)
+
+
+def _replay_token_response(url):
+    response = requests.Response()
+    response.status_code = 200
+    response.reason = 'OK'
+    response.url = url
+    response.headers = CaseInsensitiveDict({'Content-Type': 'application/json; charset=UTF-8'})
+    response._content = json.dumps(_REPLAY_TOKEN).encode('utf-8')
+    response.encoding = 'utf-8'
+    return response
+
+
+def request_key(method, url, params=None, data=None, json_body=None):
+    """Return the cache key of a request."""
+    payload = json.dumps([method.upper(), url, _normalize(params), _normalize(data), json_body], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache(object):
+    """A directory of cached responses with size-based, least recently used eviction.
+
+    The order of use is kept in memory. It is read from file modification times only at startup,
+    which get keeps up to date for the next run.
+
+    Attributes:
+        cache_dir (str): Directory of the cache. Created if it does not exist.
+        max_bytes (int): When the cache grows past this, entries are evicted, least recently used first,
+            until it is back under LOW_WATER_MARK * max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        if not op.exists(cache_dir):
+            os.makedirs(cache_dir)
+        entries = []
+        for dirpath, _, filenames in os.walk(cache_dir):
+            for filename in filenames:
+                if filename.endswith('.json'):
+                    path = op.join(dirpath, filename)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, path, stat.st_size))
+        # least recently used first
+        self._sizes = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.size = sum(self._sizes.values())
+
+    def _path(self, key):
+        return op.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        """Return a cached requests.Response, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'r') as file:
+                entry = json.load(file)
+            os.utime(path, None)  # mark as recently used for the next run
+        except (IOError, OSError, ValueError):
+            return None
+        with self._lock:
+            if path in self._sizes:
+                self._sizes.move_to_end(path)
+
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry['reason']
+        response.url = entry['url']
+        response.headers = CaseInsensitiveDict({k: v for k, v in entry['headers'].items()
+                                                if k.lower() not in _DROPPED_HEADERS})
+        response._content = base64.b64decode(entry['content'])
+        response.encoding = entry['encoding']
+        return response
+
+    def put(self, key, response):
+        """Store a response."""
+        entry = {
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'url': response.url,
+            'headers': dict(response.headers),
+            'content': base64.b64encode(response.content).decode('ascii'),
+            'encoding': response.encoding,
+        }
+        path = self._path(key)
+        os.makedirs(op.dirname(path), exist_ok=True)
+
+        tmp_path = '{path}.{thread}.tmp'.format(path=path, thread=threading.get_ident())
+        with open(tmp_path, 'w') as file:
+            json.dump(entry, file)
+        size = os.stat(tmp_path).st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.size += size - self._sizes.pop(path, 0)
+            self._sizes[path] = size
+            if self.size > self.max_bytes:
+                self._evict(LOW_WATER_MARK * self.max_bytes)
+
+    def _evict(self, target_bytes):
+        while self._sizes and self.size > target_bytes:
+            path, size = self._sizes.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class CachingRequestor(prawcore.Requestor):
+    """prawcore Requestor that records responses to, and replays them from, a ResponseCache.
+
+    Pass it to praw with requestor_class=CachingRequestor and
+    requestor_kwargs={'cache_dir': ..., 'mode': ...}.
+    """
+
+    def __init__(self, *args, **kwargs):
+        cache_dir = kwargs.pop('cache_dir', None) or http_cache_dir()
+        mode = kwargs.pop('mode', READ_THROUGH)
+        max_bytes = kwargs.pop('max_bytes', MAX_BYTES)
+        if mode not in MODES:
+            raise ValueError('mode must be one of the following: {modes}'.format(modes=MODES))
+        super(CachingRequestor, self).__init__(*args, **kwargs)
+        self.mode = mode
+        self.cache = ResponseCache(cache_dir, max_bytes=max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def request(self, *args, **kwargs):
+        method = args[0] if len(args) > 0 else kwargs.get('method')
+        url = args[1] if len(args) > 1 else kwargs.get('url')
+        if not is_cacheable(method, url):
+            return self._uncached_request(method, url, *args, **kwargs)
+        key = request_key(method, url, params=kwargs.get('params'), data=kwargs.get('data'),
+                          json_body=kwargs.get('json'))
+
+        if self.mode != RECORD:
+            response = self.cache.get(key)
+            if response is not None:
+                self.hits += 1
+                return response
+            if self.mode == REPLAY:
+                raise CacheMissError('{method} {url} is not in the cache.'.format(method=method.upper(), url=url))
+
+        self.misses += 1
+        response = super(CachingRequestor, self).request(*args, **kwargs)
+        if response.status_code < 400:
+            self.cache.put(key, response)
+        return response
+
+    def _uncached_request(self, method, url, *args, **kwargs):
+        if self.mode != REPLAY:
+            return super(CachingRequestor, self).request(*args, **kwargs)
+        if is_auth_request(url):
+            return _replay_token_response(url)
+        raise CacheMissError('{method} {url} is never cached.'.format(method=method.upper(), url=url))
@@ -1,52 +1,143 @@
 import json
+import os
+import os.path as op
 import time
 
 import requests
-from bs4 import BeautifulSoup
 
 from subreddit_recommender.src.util import data_dir_file, env_var
 
 
+SUBREDDIT_LIST_URL = 'https://www.reddit.com/r/ListOfSubreddits/wiki/listofsubreddits'
+LIST_FILENAME = 'subreddit_list.json'
+HTML_FILENAME = 'subreddit_list.html'
+META_FILENAME = 'subreddit_list_meta.json'
+DIFF_FILENAME = 'subreddit_list_diff.json'
+MAX_RETRIES = 5
+TIMEOUT = 30
+
+
 class TooManyRequestsError(Exception):
     """Exception to raise when 'too many requests' is encountered."""
     pass
 
 
-def get_categorized_subreddit_list(sleep_time=2):
-    try:
-        _get_categorized_subreddit_list()
-    except TooManyRequestsError:
-        print('Rate limit reached.')
-        time.sleep(sleep_time)
-        get_categorized_subreddit_list(sleep_time + 2)
-
-
-def _get_categorized_subreddit_list():
-    SUBREDDIT_LIST_URL = 'https://www.reddit.com/r/ListOfSubreddits/wiki/listofsubreddits'
+def get_categorized_subreddit_list(max_retries=MAX_RETRIES, sleep_time=2, session=None):
+    """Refresh the subreddit list, retrying with exponential backoff when rate limited.
+
+    Returns:
+        diff: dict
+            Subreddits added to and removed from the list by this refresh, see diff_subreddit_lists.
+            An unchanged list leaves the stored diff of the last change in place.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return _get_categorized_subreddit_list(session=session)
+        except TooManyRequestsError:
+            if attempt == max_retries:
+                raise
+            delay = sleep_time * 2 ** attempt
+            print('Rate limit reached, retrying in {delay}s.'.format(delay=delay))
+            time.sleep(delay)
+
+
+def _load_if_exists(file_name):
+    path = data_dir_file(file_name, subdir='raw')
+    if not op.exists(path):
+        return None
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _write_json(obj, file_name):
+    path = data_dir_file(file_name, subdir='raw')
+    with open(path + '.tmp', 'w') as file:
+        file.write(json.dumps(obj, indent=4, sort_keys=True))
+    os.replace(path + '.tmp', path)
+
+
+def _conditional_headers(meta, old_dict):
+    """Return If-None-Match/If-Modified-Since headers, if there is a parsed local copy to fall back on."""
+    headers = {}
+    if meta is None or old_dict is None:
+        return headers
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def _get_categorized_subreddit_list(session=None):
+    session = session if session is not None else requests
+    old_dict = _load_if_exists(LIST_FILENAME)
     headers = {'User-Agent': env_var('USER_AGENT')}
-    req = requests.get(SUBREDDIT_LIST_URL, headers=headers)
-    content = req.content.decode('utf-8')
+    headers.update(_conditional_headers(_load_if_exists(META_FILENAME), old_dict))
 
-    # createa BS object and check for too many requests response
-    soup = BeautifulSoup(str(content), 'html.parser')
-    if 'too many requests' in soup.title.get_text().lower():
+    req = session.get(SUBREDDIT_LIST_URL, headers=headers, timeout=TIMEOUT)
+    if req.status_code == 429:
         raise TooManyRequestsError('Rate limit reached.')
 
-    # write to file for inspection
-    pretty_file_path = data_dir_file('formatted_subreddit_list.html', subdir='raw')
-    pretty_text = soup.prettify(encoding='utf-8')
-    with open(pretty_file_path, 'wb') as file:
-        file.write(pretty_text)
-
-    # extract and write tags
-    tag_types = ['h1', 'h2', 'a']
-    tags = soup.find_all(tag_types)
-
-    subreddit_dict = subreddits_to_dict(tags)
-    subreddit_json = json.dumps(subreddit_dict, indent=4, sort_keys=True)
-
-    with open(data_dir_file('subreddit_list.json', subdir='raw'), 'w') as file:
-        file.write(subreddit_json)
+    if req.status_code == 304:
+        # the stored diff keeps the additions of the last change until they are crawled
+        print('Subreddit list unchanged.')
+        return diff_subreddit_lists(old_dict, old_dict)
+    req.raise_for_status()
+
+    # keep a local copy for inspection and for the next conditional request
+    with open(data_dir_file(HTML_FILENAME, subdir='raw'), 'wb') as file:
+        file.write(req.content)
+
+    subreddit_dict = parse_subreddit_list(req.content)
+    diff = diff_subreddit_lists(old_dict or {}, subreddit_dict)
+    _write_json(subreddit_dict, LIST_FILENAME)
+    _write_json(diff, DIFF_FILENAME)
+    # written last, a conditional request must only skip the download once the list is up to date
+    _write_json({'etag': req.headers.get('ETag'), 'last_modified': req.headers.get('Last-Modified')},
+                META_FILENAME)
+    msg = '{added} subreddits added, {removed} removed.'
+    print(msg.format(added=len(diff['added']), removed=len(diff['removed'])))
+    return diff
+
+
+def parse_subreddit_list(content):
+    """Parse the wiki page into the subreddit dict, only building the tags subreddits_to_dict reads."""
+    # imported here so the crawler, which only needs added_subreddits, does not load bs4
+    from bs4 import BeautifulSoup, SoupStrainer
+    strainer = SoupStrainer(['h1', 'h2', 'a'])
+    soup = BeautifulSoup(content, 'html.parser', parse_only=strainer)
+    return subreddits_to_dict(soup.find_all(['h1', 'h2', 'a']))
+
+
+def _subreddit_tuples(subreddit_dict):
+    return {(cat, subcat, subreddit)
+            for cat, subcats in subreddit_dict.items()
+            for subcat, subreddits in subcats.items()
+            for subreddit in subreddits}
+
+
+def diff_subreddit_lists(old_dict, new_dict):
+    """Compare two subreddit dicts.
+
+    Returns:
+        diff: dict
+            'added' and 'removed' are sorted lists of [category, subcategory, subreddit].
+            A subreddit that moved to another (sub)category counts as removed and added.
+    """
+    old, new = _subreddit_tuples(old_dict), _subreddit_tuples(new_dict)
+    return {
+        'timestamp': time.time(),
+        'added': [list(t) for t in sorted(new - old)],
+        'removed': [list(t) for t in sorted(old - new)],
+    }
+
+
+def added_subreddits():
+    """Return the subreddits added by the last refresh as a set of (category, subcategory, subreddit)."""
+    diff = _load_if_exists(DIFF_FILENAME)
+    if diff is None:
+        raise IOError('No subreddit list diff found, refresh the list with make_subreddit_list.py first.')
+    return {tuple(t) for t in diff['added']}
 
 
 def subreddits_to_dict(tags):
@@ -87,5 +178,9 @@ def subreddits_to_dict(tags):
     return subreddit_dict
 
 
-if __name__ == '__main__':
+def main():
     get_categorized_subreddit_list()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""Completion manifest for the reddit downloader.
+
+The manifest is an append-only journal of JSON lines stored next to the downloaded data. Every
+finished (or failed) subreddit appends one record, flushed to disk immediately, so a crash or
+Ctrl-C loses at most the subreddits that were in flight. The latest record for a subreddit wins.
+"""
+import json
+import os
+import os.path as op
+import re
+import threading
+import time
+
+from subreddit_recommender.src.util import valid_subreddit_dirname
+
+MANIFEST_FILENAME = 'manifest.jsonl'
+COMPLETE = 'complete'
+FAILED = 'failed'
+
+_DURATION_UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+_BLOCK_SIZE = 64 * 1024
+
+
+def parse_duration(s):
+    """Parse a duration such as '90', '30m', '12h' or '7d' into seconds."""
+    match = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*$', str(s).lower())
+    if not match:
+        raise ValueError('Invalid duration: {s}. Expected a number followed by s, m, h or d.'.format(s=s))
+    value, unit = match.groups()
+    return float(value) * _DURATION_UNITS[unit or 's']
+
+
+def repair_journal(path):
+    """Truncate a JSON lines journal to its last complete line.
+
+    A crash can leave the last line half written. Readers skip it, but a writer appending to the file
+    would continue that line and lose its first record, so writers call this before appending.
+
+    Returns:
+        n_dropped: int
+            Number of bytes removed.
+    """
+    if not op.exists(path):
+        return 0
+    with open(path, 'rb+') as file:
+        size = end = file.seek(0, os.SEEK_END)
+        keep = 0
+        while end > 0:
+            start = max(0, end - _BLOCK_SIZE)
+            file.seek(start)
+            i = file.read(end - start).rfind(b'\n')
+            if i >= 0:
+                keep = start + i + 1
+                break
+            end = start
+        if keep < size:
+            file.truncate(keep)
+    return size - keep
+
+
+def subreddit_key(subreddit_tuple):
+    """Return the manifest key of a (category, subcategory, subreddit) tuple."""
+    return '/'.join(valid_subreddit_dirname(e) for e in subreddit_tuple)
+
+
+class Manifest(object):
+    """Records the fetch status, time and submission ids of every downloaded subreddit.
+
+    Attributes:
+        path (str): Path of the journal file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._records = {}
+        self._lock = threading.Lock()
+        self._repaired = False
+        self._load()
+
+    @classmethod
+    def in_directory(cls, reddit_data_dir):
+        """Open the manifest stored in a reddit data directory."""
+        return cls(op.join(reddit_data_dir, MANIFEST_FILENAME))
+
+    def _load(self):
+        if not op.exists(self.path):
+            return
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # partially written last line after a crash
+                    continue
+                self._records[record['key']] = record
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, subreddit_tuple):
+        return subreddit_key(subreddit_tuple) in self._records
+
+    def get(self, subreddit_tuple):
+        """Return the latest record of a subreddit, or None if it was never fetched."""
+        return self._records.get(subreddit_key(subreddit_tuple))
+
+    def record(self, subreddit_tuple, status, submission_ids=(), timestamp=None, **fields):
+        """Append a record for a subreddit and flush it to disk.
+
+        Extra keyword arguments are stored with the record, e.g. the revision ids of wiki pages.
+        """
+        record = dict(fields)
+        record.update({
+            'key': subreddit_key(subreddit_tuple),
+            'status': status,
+            'timestamp': time.time() if timestamp is None else timestamp,
+            'submission_ids': list(submission_ids),
+        })
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            dirname = op.dirname(self.path)
+            if dirname and not op.exists(dirname):
+                os.makedirs(dirname)
+            if not self._repaired:
+                repair_journal(self.path)
+                self._repaired = True
+            with open(self.path, 'a') as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            self._records[record['key']] = record
+        return record
+
+    def is_complete(self, subreddit_tuple, max_age=None, now=None):
+        """Return True if a subreddit was fetched successfully, and at most max_age seconds ago if given."""
+        record = self.get(subreddit_tuple)
+        if record is None or record['status'] != COMPLETE:
+            return False
+        if max_age is None:
+            return True
+        now = time.time() if now is None else now
+        return now - record['timestamp'] <= max_age
+
+    def pending(self, subreddit_tuples, max_age=None, now=None):
+        """Filter subreddit tuples down to those that still need to be fetched."""
+        now = time.time() if now is None else now
+        return [t for t in subreddit_tuples if not self.is_complete(t, max_age=max_age, now=now)]
+
+    def records(self):
+        """Return the latest record of every subreddit, sorted by key."""
+        return [self._records[key] for key in sorted(self._records)]
+
+    def completed_since(self, timestamp):
+        """Return the sorted keys of subreddits fetched successfully after timestamp."""
+        return sorted(key for key, record in self._records.items()
+                      if record['status'] == COMPLETE and record['timestamp'] > timestamp)
+
+    def compact(self):
+        """Rewrite the journal with only the latest record per subreddit."""
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                for key in sorted(self._records):
+                    file.write(json.dumps(self._records[key], sort_keys=True) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.path)
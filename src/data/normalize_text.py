@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""Text normalization stage.
+
+Downloads keep the text exactly as reddit returned it. This stage turns a raw corpus (a reddit_raw
+directory tree or a packed store) into a packed store of normalized documents, in a process pool:
+
+- Unicode folding: NFKC normalization and case folding, optionally stripping accents
+- markdown stripping: links keep their text, URLs, formatting characters and HTML entities go
+- whitespace collapsing: runs of whitespace become one space, empty lines are dropped
+
+Line breaks are kept, since every line of a submission is a comment chain.
+
+Each document's output is cached under the SHA-1 of its raw bytes, so re-running the stage after a
+refresh only normalizes the documents that changed.
+
+    python src/data/normalize_text.py --processes 8
+"""
+import argparse
+import hashlib
+import html
+import itertools
+import json
+import os
+import os.path as op
+import re
+import unicodedata
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+from subreddit_recommender.src.data.corpus_store import (INDEX_FILENAME, CorpusReader,
+                                                         CorpusWriter, _doc_sort_key,
+                                                         corpus_store_dir)
+from subreddit_recommender.src.data.manifest import repair_journal
+from subreddit_recommender.src.util import data_dir
+
+# bump when the normalization changes, so cached documents are normalized again
+NORMALIZER_VERSION = 1
+HASHES_FILENAME = 'hashes.jsonl'
+CHUNKSIZE = 16
+
+_MARKDOWN_LINK = re.compile(r'\[([^\]]*)\]\([^)]*\)')
+_URL = re.compile(r'(?:https?://|www\.)\S+')
+_FORMATTING = re.compile(r'[*_~`^#>|\\]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalized_store_dir(store_dirname='reddit_normalized'):
+    """Return the default location of the normalized corpus store."""
+    return op.join(data_dir('interim'), store_dirname)
+
+
+def fold_unicode(text, strip_accents=False):
+    """NFKC-normalize and case fold text. Non-latin scripts are kept intact.
+
+    If strip_accents is True, combining marks are removed as well, e.g. 'café' becomes 'cafe'.
+    """
+    text = unicodedata.normalize('NFKC', text).casefold()
+    if strip_accents:
+        decomposed = unicodedata.normalize('NFKD', text)
+        text = unicodedata.normalize('NFKC', ''.join(c for c in decomposed if not unicodedata.combining(c)))
+    return text
+
+
+def strip_markdown(text):
+    """Remove URLs, HTML entities and markdown syntax, keeping the text of links."""
+    text = html.unescape(text)
+    text = _MARKDOWN_LINK.sub(r'\1', text)
+    text = _URL.sub(' ', text)
+    return _FORMATTING.sub(' ', text)
+
+
+def collapse_whitespace(text):
+    """Collapse whitespace within lines and drop empty lines."""
+    lines = (_SPACES.sub(' ', line).strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+
+def normalize_text(text, strip_accents=False):
+    """Apply the whole normalization to a string."""
+    return collapse_whitespace(strip_markdown(fold_unicode(text, strip_accents=strip_accents)))
+
+
+def document_hash(raw, strip_accents=False):
+    """Return the cache key of a raw document."""
+    salt = '{version}:{accents}:'.format(version=NORMALIZER_VERSION, accents=int(strip_accents)).encode('ascii')
+    return hashlib.sha1(salt + bytes(raw)).hexdigest()
+
+
+def _normalize_document(task):
+    key, doc_name, raw, strip_accents = task
+    text = normalize_text(str(raw, 'utf-8', 'replace'), strip_accents=strip_accents)
+    return key, doc_name, text.encode('utf-8')
+
+
+def iter_raw_documents(source_dir):
+    """Yield (subreddit_key, doc_name, raw bytes) from a packed store or a reddit_raw directory tree."""
+    if op.exists(op.join(source_dir, INDEX_FILENAME)):
+        with CorpusReader(source_dir) as reader:
+            for key, doc_name, view in reader.iter_documents():
+                yield key, doc_name, bytes(view)
+                view.release()
+        return
+
+    for dirpath, _, filenames in sorted(os.walk(source_dir)):
+        key = op.relpath(dirpath, source_dir).replace(os.sep, '/')
+        if key.count('/') != 2:
+            continue
+        for doc_name in sorted(filenames, key=_doc_sort_key):
+            with open(op.join(dirpath, doc_name), 'rb') as file:
+                yield key, doc_name, file.read()
+
+
+def list_raw_documents(source_dir):
+    """Return {subreddit_key: set of doc names} of a packed store or a reddit_raw tree, without reading documents."""
+    if op.exists(op.join(source_dir, INDEX_FILENAME)):
+        with CorpusReader(source_dir) as reader:
+            return {key: set(reader.documents(key)) for key in reader.subreddits()}
+
+    documents = {}
+    for dirpath, _, filenames in os.walk(source_dir):
+        key = op.relpath(dirpath, source_dir).replace(os.sep, '/')
+        if key.count('/') == 2:
+            documents[key] = set(filenames)
+    return documents
+
+
+def _load_hashes(out_dir):
+    """Return {subreddit_key: {doc_name: hash}} of the documents in the normalized store."""
+    hashes = {}
+    path = op.join(out_dir, HASHES_FILENAME)
+    if op.exists(path):
+        with open(path, 'r') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:  # partially written last line
+                    continue
+                if record.get('reset'):
+                    hashes.pop(record['key'], None)
+                else:
+                    hashes.setdefault(record['key'], {})[record['doc']] = record['hash']
+    return hashes
+
+
+def _reset_removed(source_dir, hashes, writer, hash_file):
+    """Reset the subreddits that lost documents since the last run, so they are normalized again in full.
+
+    Returns:
+        n_reset: int
+    """
+    source_documents = list_raw_documents(source_dir)
+    stale = [key for key, docs in hashes.items() if set(docs) - source_documents.get(key, set())]
+    for key in sorted(stale):
+        writer.reset(tuple(key.split('/')))
+        hash_file.write(json.dumps({'key': key, 'reset': True}, sort_keys=True) + '\n')
+        del hashes[key]
+    return len(stale)
+
+
+def _pending_documents(source_dir, hashes, strip_accents, new_hashes):
+    """Yield pool tasks for documents whose cached output is missing or stale."""
+    for key, doc_name, raw in iter_raw_documents(source_dir):
+        digest = document_hash(raw, strip_accents=strip_accents)
+        if hashes.get(key, {}).get(doc_name) == digest:
+            continue
+        new_hashes[(key, doc_name)] = digest
+        yield key, doc_name, raw, strip_accents
+
+
+def normalize_corpus(source_dir, out_dir, processes=None, strip_accents=False, chunksize=CHUNKSIZE, verbose=1):
+    """Normalize every changed document of a raw corpus into a packed store.
+
+    A subreddit that lost documents since the last run (or is gone from the source) is reset in the
+    output store, and whatever is left of it is normalized again, so deleted text never lingers.
+
+    Args:
+        source_dir (str): A packed store or a reddit_raw directory tree.
+        out_dir (str): Packed store of normalized documents, also holding the cache of document hashes.
+        processes (int): Size of the process pool. Defaults to the number of CPUs.
+        strip_accents (bool): Remove combining marks after folding.
+        chunksize (int): Documents handed to a process at a time.
+
+    Returns:
+        n_normalized: int
+            Number of documents normalized, not counting cache hits.
+    """
+    t0 = default_timer()
+    hashes = _load_hashes(out_dir) if op.exists(out_dir) else {}
+    new_hashes = {}
+    tasks = _pending_documents(source_dir, hashes, strip_accents, new_hashes)
+
+    n_normalized = n_reset = 0
+    processes = processes or cpu_count()
+    pool = Pool(processes)
+    try:
+        repair_journal(op.join(out_dir, HASHES_FILENAME))
+        with CorpusWriter(out_dir) as writer, open(op.join(out_dir, HASHES_FILENAME), 'a') as hash_file:
+            n_reset = _reset_removed(source_dir, hashes, writer, hash_file)
+            # Pool.imap reads its input eagerly, so feed it in batches to bound the raw bytes held in memory
+            batch_size = chunksize * processes * 4
+            batch = list(itertools.islice(tasks, batch_size))
+            while batch:
+                for key, doc_name, text in pool.imap(_normalize_document, batch, chunksize=chunksize):
+                    writer.add(tuple(key.split('/')), doc_name, text)
+                    record = {'key': key, 'doc': doc_name, 'hash': new_hashes.pop((key, doc_name))}
+                    hash_file.write(json.dumps(record, sort_keys=True) + '\n')
+                    n_normalized += 1
+                batch = list(itertools.islice(tasks, batch_size))
+    finally:
+        pool.close()
+        pool.join()
+
+    if verbose > 0:
+        msg = '{n} documents normalized into {dir}, {n_reset} subreddits reset. Time elapsed: {time}s'
+        print(msg.format(n=n_normalized, dir=out_dir, n_reset=n_reset, time=round(default_timer() - t0, 2)))
+    return n_normalized
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Normalize the raw reddit corpus into a packed store.')
+    parser.add_argument('--source', default=None,
+                        help='Packed store or reddit_raw tree. Defaults to data/raw/reddit_packed if it exists, '
+                             'otherwise data/raw/reddit_raw.')
+    parser.add_argument('--output', default=None, help='Defaults to data/interim/reddit_normalized.')
+    parser.add_argument('--processes', type=int, default=None, help='Defaults to the number of CPUs.')
+    parser.add_argument('--strip-accents', action='store_true', help='Fold accented latin characters too.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    source_dir = args.source
+    if source_dir is None:
+        source_dir = corpus_store_dir()
+        if not op.exists(source_dir):
+            source_dir = op.join(data_dir('raw'), 'reddit_raw')
+    normalize_corpus(source_dir, args.output or normalized_store_dir(), processes=args.processes,
+                     strip_accents=args.strip_accents)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Work scheduling for the downloaders.
+
+Subreddits are pulled from a shared work-stealing queue instead of being split up front, and each
+subreddit is sent to the credential with the most rate limit budget left.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# reddit's OAuth rate limit window is 600 requests per 10 minutes
+DEFAULT_BUDGET = 600
+
+
+class WorkStealingQueue(object):
+    """A thread-safe set of per-worker deques.
+
+    Each worker pops from the front of its own deque. When it runs dry, it steals from the back of
+    the peer with the most pending work, so no worker idles while others still have a backlog.
+
+    Attributes:
+        items (list): Work items, dealt out round-robin.
+        n_workers (int): Number of workers pulling from the queue.
+    """
+
+    def __init__(self, items, n_workers):
+        if n_workers < 1:
+            raise ValueError('n_workers must be at least 1.')
+        self.n_workers = n_workers
+        self._deques = [deque(items[i::n_workers]) for i in range(n_workers)]
+        self._lock = threading.Lock()
+        self.steals = 0
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(d) for d in self._deques)
+
+    def get(self, worker_id):
+        """Return the next item for a worker, or None when all work is done."""
+        with self._lock:
+            own = self._deques[worker_id]
+            if own:
+                return own.popleft()
+
+            victim = max(self._deques, key=len)
+            if victim:
+                self.steals += 1
+                return victim.pop()
+        return None
+
+
+def rate_limit_budget(reddit, now=None):
+    """Return the number of requests a praw.Reddit instance can make before it is throttled.
+
+    Reads the remaining/reset values prawcore parses from reddit's X-Ratelimit headers.
+    """
+    now = time.time() if now is None else now
+    rate_limiter = getattr(getattr(reddit, '_core', None), '_rate_limiter', None)
+    remaining = getattr(rate_limiter, 'remaining', None)
+    reset_timestamp = getattr(rate_limiter, 'reset_timestamp', None)
+
+    if remaining is None or (reset_timestamp is not None and reset_timestamp <= now):
+        return DEFAULT_BUDGET
+    return remaining
+
+
+def seconds_to_reset(reddit, now=None):
+    """Return the seconds until a praw.Reddit instance's rate limit window resets."""
+    now = time.time() if now is None else now
+    rate_limiter = getattr(getattr(reddit, '_core', None), '_rate_limiter', None)
+    reset_timestamp = getattr(rate_limiter, 'reset_timestamp', None)
+    return max(0, reset_timestamp - now) if reset_timestamp is not None else 0
+
+
+class CredentialPool(object):
+    """Leases credentials to workers, preferring the one with the most rate limit budget left.
+
+    The budget of a credential is what reddit reports as remaining, less the leases currently out,
+    so concurrent workers spread over credentials instead of piling onto the same one.
+
+    Attributes:
+        members (list): Objects to lease, e.g. praw.Reddit instances or RedditSessions.
+        get_reddit (callable): Maps a member to its praw.Reddit instance.
+    """
+
+    def __init__(self, members, get_reddit=None):
+        if not members:
+            raise ValueError('Need at least one credential.')
+        self.members = list(members)
+        self.get_reddit = get_reddit if get_reddit is not None else (lambda member: member)
+        self._leases = [0] * len(self.members)
+        self._lock = threading.Lock()
+
+    def budget(self, index, now=None):
+        """Return the remaining budget of a member, accounting for outstanding leases."""
+        return rate_limit_budget(self.get_reddit(self.members[index]), now=now) - self._leases[index]
+
+    def acquire(self):
+        """Lease the member with the most budget left. Ties go to the one that resets soonest."""
+        now = time.time()
+        with self._lock:
+            def priority(i):
+                return self.budget(i, now=now), -seconds_to_reset(self.get_reddit(self.members[i]), now=now)
+
+            index = max(range(len(self.members)), key=priority)
+            self._leases[index] += 1
+        return index, self.members[index]
+
+    def release(self, index):
+        with self._lock:
+            self._leases[index] -= 1
+
+    @contextmanager
+    def lease(self):
+        """Context manager yielding the member with the most budget left."""
+        index, member = self.acquire()
+        try:
+            yield member
+        finally:
+            self.release(index)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""Deterministic sharding of the crawl over several machines.
+
+Each subreddit belongs to shard int(sha1(key)) mod N, which is the same on every machine and
+in every Python process. A machine started with --shard i/N downloads only its own subreddits, to
+its own partition:
+
+    data/raw/reddit_shards/shard_{i}_of_{N}/
+        shard.json          which shard this is and every subreddit assigned to it
+        manifest.jsonl      the shard's completion manifest
+        reddit_raw/         or reddit_packed/, depending on --store
+        reddit_wiki/        with --wiki, the shard's wiki tree and its manifest of page revisions
+
+Once the partition directories are copied to one machine, the merge command combines them into a
+single reddit_raw tree and manifest, and the wikis into one reddit_wiki tree. It reports missing shards,
+subreddits that are not complete yet, and subreddits of the local subreddit list that no shard was
+assigned.
+
+    python src/data/download_reddit_data.py --shard 0/4        # on each machine, 0/4 to 3/4
+    python src/data/sharding.py --n-shards 4                    # after copying the partitions over
+"""
+import argparse
+import hashlib
+import json
+import os
+import os.path as op
+import re
+import sys
+from timeit import default_timer
+
+from subreddit_recommender.src.data.corpus_store import (CorpusReader,
+                                                         _doc_sort_key)
+from subreddit_recommender.src.data.manifest import (COMPLETE, FAILED,
+                                                     Manifest, subreddit_key)
+from subreddit_recommender.src.data.wiki_harvest import WIKI_DIRNAME, wiki_dir
+from subreddit_recommender.src.util import data_dir, load_json
+
+SHARDS_DIRNAME = 'reddit_shards'
+SHARD_INFO_FILENAME = 'shard.json'
+TREE_DIRNAME = 'reddit_raw'
+PACKED_DIRNAME = 'reddit_packed'
+
+_PARTITION_DIRNAME = re.compile(r'^shard_(\d+)_of_(\d+)$')
+
+
+def parse_shard(s):
+    """Parse a shard such as '0/4' into (shard, n_shards). Shards are numbered from 0."""
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', str(s))
+    if not match or not int(match.group(1)) < int(match.group(2)):
+        raise ValueError('Invalid shard: {s}. Expected i/N with 0 <= i < N, e.g. 0/4.'.format(s=s))
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(subreddit_tuple, n_shards):
+    """Return the shard of a subreddit. Unlike hash(), stable across processes and machines."""
+    digest = hashlib.sha1(subreddit_key(subreddit_tuple).encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % n_shards
+
+
+def select_shard(subreddit_tuples, shard, n_shards):
+    """Filter subreddit tuples down to those assigned to a shard, keeping their order."""
+    return [t for t in subreddit_tuples if shard_of(t, n_shards) == shard]
+
+
+def shards_dir():
+    """Return the default directory holding the shard partitions."""
+    return op.join(data_dir('raw'), SHARDS_DIRNAME)
+
+
+def shard_partition_dir(shard, n_shards, root=None):
+    """Return the partition directory of a shard."""
+    return op.join(root or shards_dir(), 'shard_{i}_of_{n}'.format(i=shard, n=n_shards))
+
+
+def write_shard_info(partition_dir, shard, n_shards, subreddit_tuples):
+    """Record which shard a partition holds and the subreddits assigned to it."""
+    if not op.exists(partition_dir):
+        os.makedirs(partition_dir)
+    info = {'shard': shard, 'n_shards': n_shards, 'subreddits': sorted(subreddit_key(t) for t in subreddit_tuples)}
+    with open(op.join(partition_dir, SHARD_INFO_FILENAME), 'w') as file:
+        json.dump(info, file, indent=4)
+
+
+def find_partitions(root, n_shards):
+    """Return {shard: partition_dir} of the partitions of an N-way sharding found under root."""
+    partitions = {}
+    for dirname in sorted(os.listdir(root)) if op.exists(root) else []:
+        match = _PARTITION_DIRNAME.match(dirname)
+        if match and int(match.group(2)) == n_shards:
+            partitions[int(match.group(1))] = op.join(root, dirname)
+    return partitions
+
+
+def partition_reader(partition_dir):
+    """Return a CorpusReader of a packed partition, or None if the partition is a directory tree."""
+    packed_dir = op.join(partition_dir, PACKED_DIRNAME)
+    return CorpusReader(packed_dir) if op.exists(packed_dir) else None
+
+
+def partition_documents(partition_dir, key, reader=None):
+    """Return [(doc_name, bytes)] of a subreddit in a partition, description first.
+
+    Pass the partition_reader of a packed partition to avoid loading its index for every subreddit.
+    """
+    if reader is None:
+        reader = partition_reader(partition_dir)
+        if reader is not None:
+            with reader:
+                return partition_documents(partition_dir, key, reader=reader)
+    if reader is not None:
+        return [(doc_name, bytes(reader.get(key, doc_name))) for doc_name in reader.documents(key)]
+
+    return tree_documents(op.join(partition_dir, TREE_DIRNAME, *key.split('/')))
+
+
+def tree_documents(subreddit_dir):
+    """Return [(doc_name, bytes)] of a subreddit directory in a tree, or [] if there is none."""
+    if not op.isdir(subreddit_dir):
+        return []
+    documents = []
+    for doc_name in sorted(os.listdir(subreddit_dir), key=_doc_sort_key):
+        with open(op.join(subreddit_dir, doc_name), 'rb') as file:
+            documents.append((doc_name, file.read()))
+    return documents
+
+
+def replace_subreddit_dir(path, documents):
+    """Write a subreddit's documents to its directory, removing documents left over from earlier runs."""
+    if not op.exists(path):
+        os.makedirs(path)
+    names = set(doc_name for doc_name, _ in documents)
+    for doc_name in os.listdir(path):
+        if doc_name not in names:
+            os.remove(op.join(path, doc_name))
+    for doc_name, data in documents:
+        with open(op.join(path, doc_name), 'wb') as file:
+            file.write(data)
+
+
+def _latest_complete_records(partitions):
+    """Return {key: (shard, record)} of every complete subreddit, the latest record winning across partitions."""
+    latest = {}
+    for shard, partition_dir in sorted(partitions.items()):
+        for record in Manifest.in_directory(partition_dir).records():
+            if record['status'] != COMPLETE:
+                continue
+            if record['key'] not in latest or latest[record['key']][1]['timestamp'] < record['timestamp']:
+                latest[record['key']] = shard, record
+    return latest
+
+
+def merge_wikis(partitions, out_dir):
+    """Merge the wiki trees of the partitions into one wiki tree, with the page revisions in its manifest.
+
+    Returns:
+        n_merged: int
+    """
+    wiki_partitions = {shard: op.join(partition_dir, WIKI_DIRNAME) for shard, partition_dir in partitions.items()
+                       if op.isdir(op.join(partition_dir, WIKI_DIRNAME))}
+    if not wiki_partitions:
+        return 0
+    manifest = Manifest.in_directory(out_dir)
+    n_merged = 0
+    for key, (shard, record) in sorted(_latest_complete_records(wiki_partitions).items()):
+        subreddit_tuple = tuple(key.split('/'))
+        documents = tree_documents(op.join(wiki_partitions[shard], *subreddit_tuple))
+        replace_subreddit_dir(op.join(out_dir, *subreddit_tuple), documents)
+        manifest.record(subreddit_tuple, COMPLETE, timestamp=record['timestamp'], pages=record.get('pages', {}))
+        n_merged += 1
+    manifest.compact()
+    return n_merged
+
+
+def _assigned_keys(partitions):
+    assigned = set()
+    for partition_dir in partitions.values():
+        path = op.join(partition_dir, SHARD_INFO_FILENAME)
+        if op.exists(path):
+            with open(path, 'r') as file:
+                assigned.update(json.load(file)['subreddits'])
+    return assigned
+
+
+def merge_shards(n_shards, root=None, out_dir=None, subreddit_tuples=None, wiki_out_dir=None, verbose=1):
+    """Merge the shard partitions under root into one reddit_raw tree and validate completeness.
+
+    Args:
+        n_shards (int): Number of shards the crawl was split into.
+        root (str): Directory holding the partitions. Defaults to data/raw/reddit_shards.
+        out_dir (str): reddit_raw tree to merge into. Its manifest is updated too. Defaults to data/raw/reddit_raw.
+        subreddit_tuples (list(tuple)): If given, the subreddits expected, e.g. from the local subreddit
+            list. Those no shard was assigned are reported as unassigned. Defaults to the subreddits the
+            shards were assigned.
+        wiki_out_dir (str): Wiki tree to merge the wikis harvested by the shards into. Defaults to
+            data/raw/reddit_wiki.
+
+    Returns:
+        report: dict
+            'complete' is True if every shard is present and every expected subreddit was merged.
+    """
+    t0 = default_timer()
+    root = root or shards_dir()
+    out_dir = out_dir or op.join(data_dir('raw'), 'reddit_raw')
+    partitions = find_partitions(root, n_shards)
+    if not op.exists(out_dir):
+        os.makedirs(out_dir)
+    manifest = Manifest.in_directory(out_dir)
+    readers = {shard: partition_reader(partition_dir) for shard, partition_dir in partitions.items()}
+
+    merged, misplaced = set(), []
+    for key, (shard, record) in sorted(_latest_complete_records(partitions).items()):
+        documents = partition_documents(partitions[shard], key, reader=readers[shard])
+        if not documents:
+            continue
+        subreddit_tuple = tuple(key.split('/'))
+        if shard_of(subreddit_tuple, n_shards) != shard:
+            misplaced.append(key)
+        replace_subreddit_dir(op.join(out_dir, *subreddit_tuple), documents)
+        manifest.record(subreddit_tuple, COMPLETE, submission_ids=record['submission_ids'],
+                        timestamp=record['timestamp'])
+        merged.add(key)
+    manifest.compact()
+    for reader in readers.values():
+        if reader is not None:
+            reader.close()
+    n_wikis = merge_wikis(partitions, wiki_out_dir or wiki_dir())
+
+    assigned = _assigned_keys(partitions)
+    expected = set(subreddit_key(t) for t in subreddit_tuples) if subreddit_tuples is not None else assigned
+    failed = set(record['key'] for partition_dir in partitions.values()
+                 for record in Manifest.in_directory(partition_dir).records() if record['status'] == FAILED)
+    missing = sorted(expected - merged)
+    report = {
+        'n_shards': n_shards,
+        'missing_shards': [i for i in range(n_shards) if i not in partitions],
+        'n_expected': len(expected),
+        'n_merged': len(merged),
+        'n_wikis_merged': n_wikis,
+        'missing': missing,
+        'failed': sorted(failed & set(missing)),
+        'unassigned': sorted(expected - assigned) if subreddit_tuples is not None else [],
+        'misplaced': misplaced,
+        'elapsed_s': default_timer() - t0,
+    }
+    report['complete'] = not (report['missing_shards'] or report['missing'])
+    if verbose > 0:
+        print(format_report(report, out_dir))
+    return report
+
+
+def format_report(report, out_dir):
+    lines = ['{n} of {total} subreddits merged into {dir}. Time elapsed: {time}s'.format(
+        n=report['n_merged'], total=report['n_expected'], dir=out_dir, time=round(report['elapsed_s'], 2))]
+    if report['n_wikis_merged']:
+        lines.append('{n} subreddit wikis merged.'.format(n=report['n_wikis_merged']))
+    if report['missing_shards']:
+        lines.append('Missing shards: {shards}'.format(shards=', '.join(map(str, report['missing_shards']))))
+    if report['missing']:
+        msg = '{n} subreddits missing ({failed} failed), e.g. {examples}'
+        lines.append(msg.format(n=len(report['missing']), failed=len(report['failed']),
+                                examples=', '.join(report['missing'][:5])))
+    if report['unassigned']:
+        msg = '{n} subreddits of the local subreddit list were not assigned to any shard, e.g. {examples}'
+        lines.append(msg.format(n=len(report['unassigned']), examples=', '.join(report['unassigned'][:5])))
+    if report['misplaced']:
+        lines.append('{n} subreddits were downloaded by the wrong shard.'.format(n=len(report['misplaced'])))
+    lines.append('COMPLETE' if report['complete'] else 'INCOMPLETE')
+    return '\n'.join(lines)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Merge the partitions of a sharded crawl into one reddit_raw tree.')
+    parser.add_argument('--n-shards', type=int, required=True, help='Number of shards the crawl was split into.')
+    parser.add_argument('--partitions', default=None, help='Defaults to data/raw/reddit_shards.')
+    parser.add_argument('--output', default=None, help='Defaults to data/raw/reddit_raw.')
+    parser.add_argument('--check-list', action='store_true',
+                        help='Expect every subreddit of the local subreddit_list.json, not just those assigned.')
+    parser.add_argument('--report', default=None, help='Also write the report to this JSON file.')
+    return parser.parse_args(args)
+
+
+def main():
+    from subreddit_recommender.src.data.download_reddit_data import (flatten_subreddit_dict,
+                                                                     remove_defunct)
+
+    args = parse_args()
+    subreddit_tuples = None
+    if args.check_list:
+        subreddit_tuples = remove_defunct(flatten_subreddit_dict(load_json('subreddit_list.json')))
+    report = merge_shards(args.n_shards, root=args.partitions, out_dir=args.output, subreddit_tuples=subreddit_tuples)
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(report, file, indent=4, sort_keys=True)
+    if not report['complete']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
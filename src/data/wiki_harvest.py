@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Concurrent, budgeted harvesting of subreddit wikis.
+
+Wikis are fetched as their own stage of the crawl, by a pool of threads that share the credentials
+like the thread engine does. Every subreddit gets a page budget and a byte budget, so a wiki with
+hundreds of pages costs at most a few requests. Per subreddit:
+
+1. the page listing is fetched. Pages under config/ (stylesheets, AutoModerator rules) are skipped.
+2. if the wiki was harvested before, the revisions listing is read newest first back to the last
+   harvest. Every page edited since shows up with its latest revision id. Pages whose stored revision
+   id is still current are kept without fetching them again.
+3. pages are taken in order, index first, until the page or byte budget is spent. The page that
+   crosses the byte budget is truncated.
+
+Pages are stored one file per page in data/raw/reddit_wiki/category/subcategory/subreddit/, so the
+wiki tree reads like a reddit_raw tree. The revision id and size of every stored page are recorded
+in the manifest of the wiki tree.
+
+    python src/data/wiki_harvest.py --max-pages 20 --max-bytes 200000
+"""
+import argparse
+import os
+import os.path as op
+import threading
+from collections import Counter
+from multiprocessing.dummy import Pool as ThreadPool
+from timeit import default_timer
+from urllib.parse import quote, unquote
+
+import prawcore
+
+from subreddit_recommender.src.data.crawl_metrics import CrawlMetrics
+from subreddit_recommender.src.data.manifest import (COMPLETE, FAILED,
+                                                     Manifest, parse_duration,
+                                                     subreddit_key)
+from subreddit_recommender.src.data.scheduler import (CredentialPool,
+                                                      WorkStealingQueue)
+from subreddit_recommender.src.util import data_dir, valid_subreddit_dirname
+
+MAX_PAGES = 20
+MAX_BYTES = 200000
+N_THREADS = 10
+REVISIONS_LIMIT = 500
+# revision timestamps come from reddit, harvest times from the local clock
+CLOCK_SKEW = 60 * 60
+SKIP_PREFIXES = ('config/',)
+PAGE_PREFIX = 'wiki_'
+WIKI_DIRNAME = 'reddit_wiki'
+
+# a wiki that is disabled, private or missing is not an error
+_NO_WIKI = (prawcore.Forbidden, prawcore.NotFound, prawcore.Redirect)
+
+
+def wiki_dir():
+    """Return the default directory of the harvested wikis."""
+    return op.join(data_dir('raw'), WIKI_DIRNAME)
+
+
+def page_filename(page_name):
+    """Return the file name of a wiki page. Page names can contain slashes, e.g. 'faq/rules'."""
+    return PAGE_PREFIX + quote(page_name, safe='')
+
+
+def page_name(filename):
+    return unquote(filename[len(PAGE_PREFIX):])
+
+
+def page_order(page_names):
+    """Return the pages worth harvesting, in the order they are harvested: index first, then by name."""
+    pages = sorted(set(name for name in page_names if not name.startswith(SKIP_PREFIXES)))
+    return sorted(pages, key=lambda name: (name != 'index', name))
+
+
+def truncate_utf8(text, max_bytes):
+    """Return text cut to at most max_bytes bytes of utf-8, without splitting a character."""
+    data = text.encode('utf-8')
+    if len(data) <= max_bytes:
+        return text
+    return data[:max_bytes].decode('utf-8', 'ignore')
+
+
+def latest_revisions(praw_subreddit, since, limit=REVISIONS_LIMIT):
+    """Return ({page: revision id}, complete) of the pages edited since a timestamp.
+
+    complete is False if the revisions listing ended before reaching the timestamp, in which case
+    pages missing from the result may have been edited too.
+    """
+    latest, n = {}, 0
+    for revision in praw_subreddit.wiki.revisions(limit=limit):
+        if revision['timestamp'] < since:
+            return latest, True
+        latest.setdefault(revision['page'].name, revision['id'])
+        n += 1
+    return latest, n < limit
+
+
+def _stored_pages(subreddit_dir):
+    if not op.isdir(subreddit_dir):
+        return {}
+    return {page_name(f): op.join(subreddit_dir, f) for f in os.listdir(subreddit_dir) if f.startswith(PAGE_PREFIX)}
+
+
+def _is_unchanged(name, previous, latest, complete):
+    if name not in previous:
+        return False
+    if name in latest:
+        return latest[name] == previous[name]['revision']
+    return complete
+
+
+def _list_pages(praw_subreddit):
+    try:
+        return page_order(page.name for page in praw_subreddit.wiki)
+    except _NO_WIKI:
+        return []
+
+
+def _known_revisions(praw_subreddit, previous):
+    """Return (stored pages, latest revisions, complete) of a subreddit, see latest_revisions."""
+    previous_pages = (previous or {}).get('pages', {})
+    if not previous_pages:
+        return previous_pages, {}, False
+    try:
+        return (previous_pages,) + latest_revisions(praw_subreddit, since=previous['timestamp'] - CLOCK_SKEW)
+    except _NO_WIKI:
+        return previous_pages, {}, False
+
+
+def harvest_subreddit_wiki(praw_subreddit, subreddit_dir, previous=None, max_pages=MAX_PAGES, max_bytes=MAX_BYTES):
+    """Harvest the wiki of one subreddit into subreddit_dir, within a page and byte budget.
+
+    Args:
+        praw_subreddit (praw.models.Subreddit): Subreddit whose wiki is harvested.
+        subreddit_dir (str): Directory of the page files.
+        previous (dict): The manifest record of the last harvest, if any.
+        max_pages (int): Pages kept at most, unchanged ones included.
+        max_bytes (int): Bytes of page text kept at most.
+
+    Returns:
+        (pages, stats): (dict, Counter)
+            {page: {'revision': ..., 'bytes': ..., 'truncated': ...}} of every stored page, and counts of
+            pages fetched, unchanged, over budget and unavailable.
+    """
+    stats = Counter()
+    names = _list_pages(praw_subreddit)
+    stored = _stored_pages(subreddit_dir)
+    previous_pages, latest, complete = _known_revisions(praw_subreddit, previous)
+
+    pages, n_bytes = {}, 0
+    for name in names:
+        if len(pages) >= max_pages or n_bytes >= max_bytes:
+            stats['over_budget'] += 1
+            continue
+        if name in stored and _is_unchanged(name, previous_pages, latest, complete) \
+                and n_bytes + previous_pages[name]['bytes'] <= max_bytes:
+            pages[name] = previous_pages[name]
+            n_bytes += previous_pages[name]['bytes']
+            stats['unchanged'] += 1
+            continue
+
+        try:
+            page = praw_subreddit.wiki[name]
+            text, revision = page.content_md or '', page.revision_id
+        except _NO_WIKI:
+            stats['unavailable'] += 1
+            continue
+        kept = truncate_utf8(text, max_bytes - n_bytes)
+        _write_page(subreddit_dir, name, kept)
+        size = len(kept.encode('utf-8'))
+        pages[name] = {'revision': revision, 'bytes': size, 'truncated': kept != text}
+        n_bytes += size
+        stats['fetched'] += 1
+
+    for name, path in stored.items():
+        if name not in pages:
+            os.remove(path)
+    stats['bytes'] = n_bytes
+    return pages, stats
+
+
+def _write_page(subreddit_dir, name, text):
+    if not op.exists(subreddit_dir):
+        os.makedirs(subreddit_dir, exist_ok=True)
+    path = op.join(subreddit_dir, page_filename(name))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        file.write(text)
+    os.replace(tmp_path, path)
+
+
+def _harvest_worker(payload):
+    work_queue, worker_id, credential_pool, manifest, out_dir, budgets, stats, stats_lock, metrics, verbose = payload
+    with metrics.worker('wiki-{i}'.format(i=worker_id)):
+        while True:
+            subreddit_tuple = work_queue.get(worker_id)
+            if subreddit_tuple is None:
+                return
+            t0 = default_timer()
+            subreddit = valid_subreddit_dirname(subreddit_tuple[2])
+            subreddit_dir = op.join(out_dir, *subreddit_key(subreddit_tuple).split('/'))
+            try:
+                with credential_pool.lease() as reddit:
+                    pages, subreddit_stats = harvest_subreddit_wiki(reddit.subreddit(subreddit), subreddit_dir,
+                                                                    previous=manifest.get(subreddit_tuple),
+                                                                    **budgets)
+            except Exception as e:
+                print('Wiki worker #{id_}: failed to harvest {sub}: {e!r}'.format(id_=worker_id, sub=subreddit, e=e))
+                manifest.record(subreddit_tuple, FAILED)
+                with stats_lock:
+                    stats['failed'] += 1
+                continue
+
+            manifest.record(subreddit_tuple, COMPLETE, pages=pages)
+            with stats_lock:
+                stats.update(subreddit_stats)
+                stats['subreddits'] += 1
+            if verbose > 0:
+                msg = 'Wiki worker #{id_}: {sub}, {n} pages fetched, {unchanged} unchanged, {remaining} remaining. '
+                msg += 'Time elapsed: {time}s'
+                print(msg.format(id_=worker_id, sub=subreddit, n=subreddit_stats['fetched'],
+                                 unchanged=subreddit_stats['unchanged'], remaining=len(work_queue),
+                                 time=round(default_timer() - t0, 2)))
+
+
+def harvest_wikis(subreddit_tuples, reddit_instances, out_dir=None, max_pages=MAX_PAGES, max_bytes=MAX_BYTES,
+                  n_threads=N_THREADS, resume=False, refresh_older_than=None, metrics=None, verbose=1):
+    """Harvest the wikis of many subreddits with a pool of threads.
+
+    Args:
+        subreddit_tuples (list(tuple)): List of (category, subcategory, subreddit).
+        reddit_instances (list(praw.Reddit)): One authenticated instance per credential.
+        out_dir (str): Defaults to data/raw/reddit_wiki. Its manifest holds the stored revision ids.
+        max_pages (int): Pages kept per subreddit.
+        max_bytes (int): Bytes of page text kept per subreddit.
+        resume (bool): If True, skips subreddits whose wiki was harvested before.
+        refresh_older_than (float): If given, skips subreddits harvested less than this many seconds ago.
+        metrics (CrawlMetrics): If given, requests are recorded under the workers 'wiki-0', 'wiki-1', ...
+
+    Returns:
+        stats: Counter
+            Subreddits harvested and failed, pages fetched, unchanged, over budget and unavailable, and bytes.
+    """
+    out_dir = out_dir or wiki_dir()
+    manifest = Manifest.in_directory(out_dir)
+    if resume or refresh_older_than is not None:
+        subreddit_tuples = manifest.pending(subreddit_tuples, max_age=refresh_older_than)
+    metrics = metrics if metrics is not None else CrawlMetrics()
+    stats, stats_lock = Counter(), threading.Lock()
+    budgets = {'max_pages': max_pages, 'max_bytes': max_bytes}
+    work_queue = WorkStealingQueue(subreddit_tuples, n_threads)
+    credential_pool = CredentialPool(reddit_instances)
+    payloads = [(work_queue, worker_id, credential_pool, manifest, out_dir, budgets, stats, stats_lock, metrics,
+                 verbose)
+                for worker_id in range(n_threads)]
+
+    t0 = default_timer()
+    pool = ThreadPool(n_threads)
+    try:
+        pool.map(_harvest_worker, payloads)
+    finally:
+        pool.close()
+    manifest.compact()
+    if verbose > 0:
+        print(format_stats(stats, default_timer() - t0))
+    return stats
+
+
+def format_stats(stats, elapsed):
+    msg = ('Wikis of {n} subreddits harvested ({failed} failed): {fetched} pages fetched, {unchanged} unchanged, '
+           '{over} over budget, {mb:.1f}MB. Time elapsed: {time}s')
+    return msg.format(n=stats['subreddits'], failed=stats['failed'], fetched=stats['fetched'],
+                      unchanged=stats['unchanged'], over=stats['over_budget'], mb=stats['bytes'] / 2.0 ** 20,
+                      time=round(elapsed, 2))
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Harvest the wikis of every subreddit in subreddit_list.json.')
+    parser.add_argument('--max-pages', type=int, default=MAX_PAGES, help='Pages kept per subreddit.')
+    parser.add_argument('--max-bytes', type=int, default=MAX_BYTES, help='Bytes of wiki text kept per subreddit.')
+    parser.add_argument('--threads', type=int, default=N_THREADS)
+    parser.add_argument('--refresh-older-than', type=parse_duration, default=None, metavar='DURATION',
+                        help='Skip subreddits harvested less than DURATION ago, e.g. 12h or 7d.')
+    parser.add_argument('--output', default=None, help='Defaults to data/raw/reddit_wiki.')
+    return parser.parse_args(args)
+
+
+def main():
+    from subreddit_recommender.src.data.download_reddit_data import (flatten_subreddit_dict,
+                                                                     open_reddit_instance,
+                                                                     remove_defunct)
+    from subreddit_recommender.src.util import load_json, parse_client_ids
+
+    args = parse_args()
+    subreddit_tuples = remove_defunct(flatten_subreddit_dict(load_json('subreddit_list.json')))
+    reddit_instances = [open_reddit_instance(credentials) for credentials in parse_client_ids()]
+    harvest_wikis(subreddit_tuples, reddit_instances, out_dir=args.output, max_pages=args.max_pages,
+                  max_bytes=args.max_bytes, n_threads=args.threads, refresh_older_than=args.refresh_older_than)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""Streaming corpus of tagged documents.
+
+SubredditCorpus walks the corpus one document at a time and yields TaggedDocuments, so gensim can
+make as many passes over it as it needs without the corpus ever being held in memory. Every
+submission is a document tagged with its subreddit, category and subcategory, which trains one
+vector per subreddit and one per (sub)category alongside it.
+
+By default documents come from the deduplicated store (data/interim/reddit_deduped) if it exists, then
+the normalized store (data/interim/reddit_normalized), otherwise from the raw reddit_raw tree laid out
+by data_dir_subreddit.
+"""
+import os
+import os.path as op
+import re
+from collections import namedtuple
+
+from subreddit_recommender.src.data.corpus_store import (INDEX_FILENAME,
+                                                         CorpusReader,
+                                                         _doc_sort_key)
+from subreddit_recommender.src.data.dedup import deduped_store_dir
+from subreddit_recommender.src.data.normalize_text import (iter_raw_documents,
+                                                           normalize_text,
+                                                           normalized_store_dir)
+from subreddit_recommender.src.util import data_dir
+
+# gensim 3.0 silently truncates documents longer than this, so longer ones are split
+MAX_DOCUMENT_WORDS = 10000
+CATEGORY_PREFIX = 'category:'
+SUBCATEGORY_PREFIX = 'subcategory:'
+
+# same fields as gensim.models.doc2vec.TaggedDocument, which only needs .words and .tags
+TaggedDocument = namedtuple('TaggedDocument', 'words tags')
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+
+
+def default_corpus_dir():
+    """Return the deduplicated store, else the normalized store, else the raw directory tree, whichever exists."""
+    for store_dir in (deduped_store_dir(), normalized_store_dir()):
+        if op.exists(store_dir):
+            return store_dir
+    return op.join(data_dir('raw'), 'reddit_raw')
+
+
+def is_normalized(corpus_dir):
+    """Return whether a corpus holds normalized text already, i.e. is the normalized or deduplicated store."""
+    return corpus_dir in (normalized_store_dir(), deduped_store_dir())
+
+
+def is_packed_store(corpus_dir):
+    return op.exists(op.join(corpus_dir, INDEX_FILENAME))
+
+
+def subreddit_keys(corpus_dir):
+    """Return the sorted keys ('category/subcategory/subreddit') of all subreddits in a corpus."""
+    if is_packed_store(corpus_dir):
+        with CorpusReader(corpus_dir) as reader:
+            return reader.subreddits()
+
+    keys = []
+    for cat in sorted(os.listdir(corpus_dir)):
+        if not op.isdir(op.join(corpus_dir, cat)):
+            continue
+        for subcat in sorted(os.listdir(op.join(corpus_dir, cat))):
+            if not op.isdir(op.join(corpus_dir, cat, subcat)):
+                continue
+            keys.extend('/'.join([cat, subcat, subreddit])
+                        for subreddit in sorted(os.listdir(op.join(corpus_dir, cat, subcat))))
+    return keys
+
+
+def read_subreddit(corpus_dir, key, reader=None):
+    """Return [(doc_name, text)] of one subreddit, description first.
+
+    Pass an open CorpusReader to avoid reopening a packed store for every subreddit.
+    """
+    if is_packed_store(corpus_dir):
+        if reader is None:
+            with CorpusReader(corpus_dir) as reader:
+                return read_subreddit(corpus_dir, key, reader=reader)
+        return [(doc_name, reader.text(key, doc_name)) for doc_name in reader.documents(key)]
+
+    subreddit_dir = op.join(corpus_dir, *key.split('/'))
+    documents = []
+    for doc_name in sorted(os.listdir(subreddit_dir), key=_doc_sort_key):
+        with open(op.join(subreddit_dir, doc_name), 'rb') as file:
+            documents.append((doc_name, str(file.read(), 'utf-8', 'replace')))
+    return documents
+
+
+def tokenize(text):
+    """Split text into lower case word tokens. Works on any script."""
+    return _TOKEN.findall(text.lower())
+
+
+def document_tags(subreddit_key):
+    """Return the tags of a document in a subreddit.
+
+    The subreddit is tagged by its full key, since a subreddit can be listed in several categories,
+    e.g. ['Animals/Pets/cats', 'category:Animals', 'subcategory:Pets'].
+    """
+    cat, subcat, _ = subreddit_key.split('/')
+    return [subreddit_key, CATEGORY_PREFIX + cat, SUBCATEGORY_PREFIX + subcat]
+
+
+class SubredditCorpus(object):
+    """Restartable iterable of TaggedDocuments, read lazily from a packed store or a reddit_raw tree.
+
+    Attributes:
+        corpus_dir (str): Packed store or reddit_raw tree. Defaults to default_corpus_dir().
+        include_descriptions (bool): Yield subreddit descriptions as documents too.
+        normalize (bool): Normalize raw text first. Not needed for the normalized or deduplicated store.
+        tag_categories (bool): Tag documents with their category and subcategory as well.
+        subreddits (set(str)): If given, only documents of these subreddit keys are read.
+    """
+
+    def __init__(self, corpus_dir=None, include_descriptions=True, normalize=None, tag_categories=True,
+                 subreddits=None):
+        self.corpus_dir = corpus_dir or default_corpus_dir()
+        self.include_descriptions = include_descriptions
+        self.normalize = normalize if normalize is not None else not is_normalized(self.corpus_dir)
+        self.tag_categories = tag_categories
+        self.subreddits = subreddits
+
+    def iter_texts(self):
+        """Yield (subreddit_key, doc_name, text) for every document."""
+        for key, doc_name, raw in iter_raw_documents(self.corpus_dir):
+            if self.subreddits is not None and key not in self.subreddits:
+                continue
+            if doc_name == 'description' and not self.include_descriptions:
+                continue
+            text = str(raw, 'utf-8', 'replace')
+            yield key, doc_name, normalize_text(text) if self.normalize else text
+
+    def __iter__(self):
+        for key, doc_name, text in self.iter_texts():
+            tags = document_tags(key) if self.tag_categories else document_tags(key)[:1]
+            words = tokenize(text)
+            for start in range(0, len(words), MAX_DOCUMENT_WORDS):
+                yield TaggedDocument(words[start:start + MAX_DOCUMENT_WORDS], tags)
+
+
+class Sentences(object):
+    """Restartable iterable over the word lists of a SubredditCorpus, for Word2Vec."""
+
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __iter__(self):
+        for document in self.corpus:
+            yield document.words
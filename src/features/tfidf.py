@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Hashed TF-IDF features, one row per subreddit.
+
+A subreddit's description and submissions are hashed into term counts with a HashingVectorizer,
+so no vocabulary has to be fitted or held in memory. Subreddits are counted in chunks across a
+process pool. The IDF weights are computed from the stacked count matrix, which is cheap next to
+counting, so an incremental run only re-counts the subreddits whose documents changed and
+reweights everything.
+
+Written to data/processed/tfidf:
+
+    counts.npz    raw hashed term counts, kept for incremental runs
+    tfidf.npz     L2 normalized TF-IDF rows
+    rows.json     the subreddit key and fingerprint of every row
+
+    python src/features/tfidf.py --incremental
+"""
+import argparse
+import hashlib
+import json
+import os
+import os.path as op
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize as l2_normalize
+
+from subreddit_recommender.src.data.corpus_store import CorpusReader
+from subreddit_recommender.src.data.normalize_text import normalize_text
+from subreddit_recommender.src.features.corpus import (default_corpus_dir,
+                                                       is_normalized,
+                                                       is_packed_store,
+                                                       read_subreddit,
+                                                       subreddit_keys, tokenize)
+from subreddit_recommender.src.util import data_dir
+
+N_FEATURES = 2 ** 20
+CHUNK_SIZE = 64
+COUNTS_FILENAME = 'counts.npz'
+TFIDF_FILENAME = 'tfidf.npz'
+ROWS_FILENAME = 'rows.json'
+
+_readers = {}  # one open CorpusReader per packed store, per process
+
+
+def tfidf_dir(dirname='tfidf'):
+    """Return the default location of the TF-IDF features."""
+    return op.join(data_dir('processed'), dirname)
+
+
+def make_vectorizer(n_features=N_FEATURES):
+    """Return the stateless vectorizer producing raw term counts."""
+    return HashingVectorizer(n_features=n_features, tokenizer=tokenize, lowercase=False, alternate_sign=False,
+                             norm=None, dtype=np.float32)
+
+
+def _reader(corpus_dir):
+    if corpus_dir not in _readers:
+        _readers[corpus_dir] = CorpusReader(corpus_dir)
+    return _readers[corpus_dir]
+
+
+def subreddit_fingerprints(corpus_dir):
+    """Return {subreddit_key: fingerprint}. A fingerprint changes whenever a subreddit's documents do.
+
+    Fingerprints of a packed store come from the document locations in its index, those of a
+    directory tree from file sizes and modification times, so neither reads any documents.
+    """
+    fingerprints = {}
+    if is_packed_store(corpus_dir):
+        with CorpusReader(corpus_dir) as reader:
+            for key in reader.subreddits():
+                state = sorted(reader.locations(key).items())
+                fingerprints[key] = hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+        return fingerprints
+
+    for key in subreddit_keys(corpus_dir):
+        subreddit_dir = op.join(corpus_dir, *key.split('/'))
+        state = []
+        for doc_name in sorted(os.listdir(subreddit_dir)):
+            stat = os.stat(op.join(subreddit_dir, doc_name))
+            state.append([doc_name, stat.st_size, stat.st_mtime_ns])
+        fingerprints[key] = hashlib.sha1(json.dumps(state).encode('utf-8')).hexdigest()
+    return fingerprints
+
+
+def _count_chunk(task):
+    """Return the hashed term counts of a chunk of subreddits, one row each."""
+    corpus_dir, keys, normalize, n_features = task
+    reader = _reader(corpus_dir) if is_packed_store(corpus_dir) else None
+    texts = []
+    for key in keys:
+        text = '\n'.join(text for _, text in read_subreddit(corpus_dir, key, reader=reader))
+        texts.append(normalize_text(text) if normalize else text)
+    return make_vectorizer(n_features).transform(texts).tocsr()
+
+
+def count_terms(corpus_dir, keys, processes=None, chunk_size=CHUNK_SIZE, n_features=N_FEATURES, normalize=False):
+    """Count the hashed terms of the given subreddits in a process pool.
+
+    Returns:
+        counts: scipy.sparse.csr_matrix
+            One row per key, in order.
+    """
+    if not keys:
+        return sp.csr_matrix((0, n_features), dtype=np.float32)
+    tasks = [(corpus_dir, keys[i:i + chunk_size], normalize, n_features) for i in range(0, len(keys), chunk_size)]
+    pool = Pool(processes or cpu_count())
+    try:
+        return sp.vstack(pool.map(_count_chunk, tasks), format='csr')
+    finally:
+        pool.close()
+        pool.join()
+
+
+def tfidf_from_counts(counts):
+    """Reweight term counts with smoothed IDF and L2 normalize the rows, like sklearn's TfidfTransformer."""
+    n_rows = counts.shape[0]
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log((1.0 + n_rows) / (1.0 + df)) + 1.0
+    tfidf = counts.multiply(idf.astype(np.float32)).tocsr()
+    return l2_normalize(tfidf, norm='l2', copy=False)
+
+
+def load_rows(out_dir):
+    with open(op.join(out_dir, ROWS_FILENAME), 'r') as file:
+        return json.load(file)
+
+
+def load_tfidf(out_dir=None):
+    """Return (tfidf matrix, list of subreddit keys) as written by build_tfidf."""
+    out_dir = out_dir or tfidf_dir()
+    rows = load_rows(out_dir)
+    return sp.load_npz(op.join(out_dir, TFIDF_FILENAME)), rows['keys']
+
+
+def _previous_counts(out_dir, n_features):
+    """Return ({key: row}, fingerprints, counts) of a previous build, or empty ones."""
+    if not (op.exists(op.join(out_dir, ROWS_FILENAME)) and op.exists(op.join(out_dir, COUNTS_FILENAME))):
+        return {}, [], None
+    rows = load_rows(out_dir)
+    counts = sp.load_npz(op.join(out_dir, COUNTS_FILENAME)).tocsr()
+    if rows.get('n_features') != n_features or counts.shape[0] != len(rows['keys']):
+        return {}, [], None
+    return {key: i for i, key in enumerate(rows['keys'])}, rows['fingerprints'], counts
+
+
+def _save(out_dir, keys, fingerprints, counts, n_features):
+    if not op.exists(out_dir):
+        os.makedirs(out_dir)
+    sp.save_npz(op.join(out_dir, COUNTS_FILENAME), counts)
+    sp.save_npz(op.join(out_dir, TFIDF_FILENAME), tfidf_from_counts(counts))
+    with open(op.join(out_dir, ROWS_FILENAME), 'w') as file:
+        json.dump({'keys': keys, 'fingerprints': [fingerprints[k] for k in keys], 'n_features': n_features}, file)
+
+
+def build_tfidf(corpus_dir=None, out_dir=None, incremental=False, processes=None, chunk_size=CHUNK_SIZE,
+                n_features=N_FEATURES, normalize=None, verbose=1):
+    """Build the TF-IDF matrix of every subreddit in a corpus.
+
+    Args:
+        corpus_dir (str): Packed store or reddit_raw tree. Defaults to default_corpus_dir().
+        out_dir (str): Defaults to data/processed/tfidf.
+        incremental (bool): Only count the terms of subreddits that are new or changed since the last build.
+        normalize (bool): Normalize text before counting. Defaults to True unless it is normalized already.
+
+    Returns:
+        n_counted: int
+            Number of subreddits whose terms were counted.
+    """
+    t0 = default_timer()
+    corpus_dir = corpus_dir or default_corpus_dir()
+    out_dir = out_dir or tfidf_dir()
+    normalize = normalize if normalize is not None else not is_normalized(corpus_dir)
+
+    fingerprints = subreddit_fingerprints(corpus_dir)
+    keys = sorted(fingerprints)
+    previous_rows, previous_fingerprints, previous_counts = ({}, [], None)
+    if incremental:
+        previous_rows, previous_fingerprints, previous_counts = _previous_counts(out_dir, n_features)
+
+    changed = [k for k in keys
+               if k not in previous_rows or previous_fingerprints[previous_rows[k]] != fingerprints[k]]
+    new_counts = count_terms(corpus_dir, changed, processes=processes, chunk_size=chunk_size,
+                             n_features=n_features, normalize=normalize)
+
+    if previous_counts is None:
+        counts = new_counts
+    else:
+        # stack the kept rows of the old matrix and the new rows, then put them in key order
+        changed_set = set(changed)
+        kept = [k for k in keys if k in previous_rows and k not in changed_set]
+        stacked = sp.vstack([previous_counts[[previous_rows[k] for k in kept]], new_counts], format='csr')
+        position = {k: i for i, k in enumerate(kept + changed)}
+        counts = stacked[[position[k] for k in keys]]
+
+    _save(out_dir, keys, fingerprints, counts, n_features)
+    if verbose > 0:
+        msg = '{n} of {total} subreddits counted, TF-IDF saved to {dir}. Time elapsed: {time}s'
+        print(msg.format(n=len(changed), total=len(keys), dir=out_dir, time=round(default_timer() - t0, 2)))
+    return len(changed)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Build hashed TF-IDF features, one row per subreddit.')
+    parser.add_argument('--corpus', default=None, help='Packed store or reddit_raw tree.')
+    parser.add_argument('--output', default=None, help='Defaults to data/processed/tfidf.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only recount subreddits that changed since the last build.')
+    parser.add_argument('--processes', type=int, default=None, help='Defaults to the number of CPUs.')
+    parser.add_argument('--n-features', type=int, default=N_FEATURES, help='Number of hash buckets.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    build_tfidf(args.corpus, args.output, incremental=args.incremental, processes=args.processes,
+                n_features=args.n_features)
+
+
+if __name__ == '__main__':
+    main()
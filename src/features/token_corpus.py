@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+"""Token-ID encoding of the corpus in memory-mapped arrays.
+
+Tokenizing and normalizing text again on every pass is most of the cost of iterating the corpus,
+and every training process would hold its own copy of the token lists. The corpus is therefore
+encoded once: the vocabulary is built in a process pool, and the whole corpus is written as one
+flat token array plus document offsets. Written to data/processed/token_corpus:
+
+    vocab.json              words in token-ID order (most frequent first) and their counts
+    tokens.npy              uint32 token IDs of every document, back to back
+    offsets.npy             int64, document i is tokens[offsets[i]:offsets[i + 1]]
+    subreddit_offsets.npy   int64, the documents of subreddit j are subreddit_offsets[j]:subreddit_offsets[j + 1]
+    meta.json               subreddit keys and document names, in the order of the arrays
+
+TokenCorpus loads the arrays memory-mapped and read-only, so a document is a view into the page
+cache rather than a copy. A TokenCorpus pickles as its path: worker processes it is passed to map
+the same files, and share their pages with every other process reading them.
+
+    python src/features/token_corpus.py --min-count 2 --processes 8
+"""
+import argparse
+import json
+import os
+import os.path as op
+import shutil
+from multiprocessing import Pool, cpu_count
+from timeit import default_timer
+
+import numpy as np
+
+from subreddit_recommender.src.data.corpus_store import CorpusReader
+from subreddit_recommender.src.data.normalize_text import normalize_text
+from subreddit_recommender.src.features.corpus import (MAX_DOCUMENT_WORDS,
+                                                       TaggedDocument,
+                                                       default_corpus_dir,
+                                                       document_tags,
+                                                       is_normalized,
+                                                       is_packed_store,
+                                                       read_subreddit,
+                                                       subreddit_keys, tokenize)
+from subreddit_recommender.src.util import data_dir
+
+MIN_COUNT = 1
+CHUNK_SIZE = 64
+BLOCK_TOKENS = 2 ** 24  # tokens remapped at once in the second pass
+VOCAB_FILENAME = 'vocab.json'
+TOKENS_FILENAME = 'tokens.npy'
+OFFSETS_FILENAME = 'offsets.npy'
+SUBREDDIT_OFFSETS_FILENAME = 'subreddit_offsets.npy'
+META_FILENAME = 'meta.json'
+TOKEN_DTYPE = np.uint32
+
+_DROPPED = np.iinfo(TOKEN_DTYPE).max
+_readers = {}  # one open CorpusReader per packed store, per process
+
+
+def token_corpus_dir(dirname='token_corpus'):
+    """Return the default location of the token-ID corpus."""
+    return op.join(data_dir('processed'), dirname)
+
+
+def is_token_corpus(path):
+    """Return whether a directory holds a token-ID corpus."""
+    return op.exists(op.join(path, META_FILENAME)) and op.exists(op.join(path, TOKENS_FILENAME))
+
+
+def _reader(corpus_dir):
+    if corpus_dir not in _readers:
+        _readers[corpus_dir] = CorpusReader(corpus_dir)
+    return _readers[corpus_dir]
+
+
+def _encode_chunk(task):
+    """Tokenize a chunk of subreddits against a vocabulary local to the chunk.
+
+    Returns:
+        (doc_names, lengths, ids, words): (list(list(str)), np.ndarray, np.ndarray, list(str))
+            The document names of every subreddit, the length of every document, the local token
+            IDs of all documents back to back, and the words of the local IDs.
+    """
+    corpus_dir, keys, normalize = task
+    reader = _reader(corpus_dir) if is_packed_store(corpus_dir) else None
+    local, ids, lengths, doc_names = {}, [], [], []
+    for key in keys:
+        names = []
+        for doc_name, text in read_subreddit(corpus_dir, key, reader=reader):
+            words = tokenize(normalize_text(text) if normalize else text)
+            ids.extend(local.setdefault(word, len(local)) for word in words)
+            lengths.append(len(words))
+            names.append(doc_name)
+        doc_names.append(names)
+    words = [None] * len(local)
+    for word, i in local.items():
+        words[i] = word
+    return doc_names, np.array(lengths, dtype=np.int64), np.array(ids, dtype=TOKEN_DTYPE), words
+
+
+def _count_tokens(corpus_dir, keys, tmp_path, processes, chunk_size, normalize):
+    """First pass: write the corpus with provisional token IDs (in order of first appearance) to tmp_path.
+
+    Returns:
+        (words, counts, doc_names, lengths): the words of the provisional IDs, their counts, and the
+        document names and lengths in corpus order.
+    """
+    vocab, counts, doc_names, lengths = {}, np.zeros(0, dtype=np.int64), [], []
+    tasks = [(corpus_dir, keys[i:i + chunk_size], normalize) for i in range(0, len(keys), chunk_size)]
+    pool = Pool(processes or cpu_count())
+    try:
+        with open(tmp_path, 'wb') as tmp_file:
+            for chunk_doc_names, chunk_lengths, ids, words in pool.imap(_encode_chunk, tasks):
+                mapping = np.array([vocab.setdefault(word, len(vocab)) for word in words], dtype=TOKEN_DTYPE)
+                ids = mapping[ids]
+                if len(vocab) > len(counts):
+                    counts = np.concatenate([counts, np.zeros(len(vocab) - len(counts), dtype=np.int64)])
+                counts += np.bincount(ids, minlength=len(counts))
+                ids.tofile(tmp_file)
+                doc_names.extend(chunk_doc_names)
+                lengths.append(chunk_lengths)
+    finally:
+        pool.close()
+        pool.join()
+
+    words = [None] * len(vocab)
+    for word, i in vocab.items():
+        words[i] = word
+    return words, counts, doc_names, np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+
+def _final_vocabulary(words, counts, min_count):
+    """Order the vocabulary by count (ties by first appearance) and drop words below min_count.
+
+    Returns:
+        (words, counts, remap): the kept words and counts in token-ID order, and the token ID of every
+        provisional ID, _DROPPED for dropped words.
+    """
+    order = np.argsort(-counts, kind='mergesort')
+    order = order[counts[order] >= min_count]
+    remap = np.full(len(words), _DROPPED, dtype=TOKEN_DTYPE)
+    remap[order] = np.arange(len(order), dtype=TOKEN_DTYPE)
+    return [words[i] for i in order], counts[order], remap
+
+
+def _write_tokens(tmp_path, out_dir, remap, lengths, n_tokens):
+    """Second pass: remap the provisional IDs block by block and write tokens.npy and offsets.npy."""
+    provisional = np.memmap(tmp_path, dtype=TOKEN_DTYPE, mode='r') if lengths.sum() else np.zeros(0, TOKEN_DTYPE)
+    tokens = np.lib.format.open_memmap(op.join(out_dir, TOKENS_FILENAME), mode='w+', dtype=TOKEN_DTYPE,
+                                       shape=(int(n_tokens),))
+    kept_lengths = np.zeros(len(lengths), dtype=np.int64)
+    old_offsets = np.concatenate([[0], np.cumsum(lengths)])
+    position, doc = 0, 0
+    while doc < len(lengths):
+        # whole documents only, so the kept length of each one can be counted
+        stop = max(doc + 1, int(np.searchsorted(old_offsets, old_offsets[doc] + BLOCK_TOKENS, side='right')) - 1)
+        block = remap[provisional[old_offsets[doc]:old_offsets[stop]]]
+        kept = block != _DROPPED
+        doc_of_token = np.repeat(np.arange(doc, stop), lengths[doc:stop])
+        kept_lengths[doc:stop] = np.bincount(doc_of_token[kept] - doc, minlength=stop - doc)
+        block = block[kept]
+        tokens[position:position + len(block)] = block
+        position += len(block)
+        doc = stop
+    tokens.flush()
+    del tokens, provisional
+    np.save(op.join(out_dir, OFFSETS_FILENAME), np.concatenate([[0], np.cumsum(kept_lengths)]).astype(np.int64))
+
+
+def build_token_corpus(corpus_dir=None, out_dir=None, min_count=MIN_COUNT, processes=None, chunk_size=CHUNK_SIZE,
+                       normalize=None, verbose=1):
+    """Encode a corpus as token IDs in memory-mappable arrays.
+
+    Args:
+        corpus_dir (str): Packed store or reddit_raw tree. Defaults to default_corpus_dir().
+        out_dir (str): Defaults to data/processed/token_corpus. Replaced as a whole once the new corpus is written.
+        min_count (int): Words occurring fewer times are dropped from the vocabulary and the documents.
+        processes (int): Tokenizing processes. Defaults to the number of CPUs.
+        chunk_size (int): Subreddits per task.
+        normalize (bool): Normalize text first. Defaults to True unless it is normalized already.
+
+    Returns:
+        corpus: TokenCorpus
+    """
+    t0 = default_timer()
+    corpus_dir = corpus_dir or default_corpus_dir()
+    out_dir = out_dir or token_corpus_dir()
+    normalize = normalize if normalize is not None else not is_normalized(corpus_dir)
+    keys = subreddit_keys(corpus_dir)
+
+    build_dir = out_dir.rstrip(os.sep) + '.building'
+    if op.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+    tmp_path = op.join(build_dir, 'provisional.bin')
+    words, counts, doc_names, lengths = _count_tokens(corpus_dir, keys, tmp_path, processes, chunk_size, normalize)
+    words, counts, remap = _final_vocabulary(words, counts, min_count)
+    _write_tokens(tmp_path, build_dir, remap, lengths, counts.sum())
+    os.remove(tmp_path)
+
+    n_documents = np.array([len(names) for names in doc_names], dtype=np.int64)
+    np.save(op.join(build_dir, SUBREDDIT_OFFSETS_FILENAME), np.concatenate([[0], np.cumsum(n_documents)]))
+    with open(op.join(build_dir, VOCAB_FILENAME), 'w') as file:
+        json.dump({'words': words, 'counts': counts.tolist(), 'min_count': min_count}, file)
+    with open(op.join(build_dir, META_FILENAME), 'w') as file:
+        json.dump({'keys': keys, 'doc_names': [name for names in doc_names for name in names],
+                   'corpus_dir': corpus_dir, 'n_tokens': int(counts.sum())}, file)
+
+    # processes that still map the old files keep reading them, since replacing the directory does not touch them
+    if op.exists(out_dir):
+        old_dir = out_dir.rstrip(os.sep) + '.old'
+        os.rename(out_dir, old_dir)
+        os.rename(build_dir, out_dir)
+        shutil.rmtree(old_dir)
+    else:
+        os.rename(build_dir, out_dir)
+
+    if verbose > 0:
+        msg = '{n_tokens} tokens of {n_docs} documents in {n_subs} subreddits, {n_words} words, saved to {dir}. '
+        msg += 'Time elapsed: {time}s'
+        print(msg.format(n_tokens=int(counts.sum()), n_docs=int(n_documents.sum()), n_subs=len(keys),
+                         n_words=len(words), dir=out_dir, time=round(default_timer() - t0, 2)))
+    return TokenCorpus(out_dir)
+
+
+class TokenCorpus(object):
+    """Read-only, memory-mapped token-ID corpus as written by build_token_corpus.
+
+    Documents are zero-copy views into the mapped token array. Pickling only stores the path, so a
+    TokenCorpus passed to worker processes is mapped again by each of them instead of copied.
+
+    Attributes:
+        corpus_dir (str): Directory of the token-ID corpus. Defaults to data/processed/token_corpus.
+        keys (list(str)): Subreddit keys, in the order of subreddit_offsets.
+        doc_names (list(str)): Name of every document, e.g. 'description' or 'sub_0'.
+        tokens (np.memmap): uint32 token IDs of all documents.
+        offsets (np.memmap): Document boundaries in tokens.
+        subreddit_offsets (np.memmap): Subreddit boundaries in documents.
+    """
+
+    def __init__(self, corpus_dir=None):
+        self.corpus_dir = corpus_dir or token_corpus_dir()
+        self._open()
+
+    def _open(self):
+        with open(op.join(self.corpus_dir, META_FILENAME), 'r') as file:
+            meta = json.load(file)
+        self.keys = meta['keys']
+        self.doc_names = meta['doc_names']
+        self.tokens = np.load(op.join(self.corpus_dir, TOKENS_FILENAME), mmap_mode='r')
+        self.offsets = np.load(op.join(self.corpus_dir, OFFSETS_FILENAME), mmap_mode='r')
+        self.subreddit_offsets = np.load(op.join(self.corpus_dir, SUBREDDIT_OFFSETS_FILENAME), mmap_mode='r')
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        self._words = None
+        self._word_ids = None
+
+    def __getstate__(self):
+        return {'corpus_dir': self.corpus_dir}
+
+    def __setstate__(self, state):
+        self.corpus_dir = state['corpus_dir']
+        self._open()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def words(self):
+        """Object array of the vocabulary, indexed by token ID. Loaded on first use."""
+        if self._words is None:
+            with open(op.join(self.corpus_dir, VOCAB_FILENAME), 'r') as file:
+                self._words = np.array(json.load(file)['words'], dtype=object)
+        return self._words
+
+    def word_id(self, word):
+        """Return the token ID of a word, or None if it is not in the vocabulary."""
+        if self._word_ids is None:
+            self._word_ids = {word: i for i, word in enumerate(self.words)}
+        return self._word_ids.get(word)
+
+    def document(self, i):
+        """Return the token IDs of document i, as a read-only view."""
+        return self.tokens[self.offsets[i]:self.offsets[i + 1]]
+
+    def subreddit_documents(self, key):
+        """Return the range of document indexes of a subreddit."""
+        row = self._rows[key]
+        return range(int(self.subreddit_offsets[row]), int(self.subreddit_offsets[row + 1]))
+
+    def subreddit_tokens(self, key):
+        """Return the token IDs of all documents of a subreddit, as one read-only view."""
+        documents = self.subreddit_documents(key)
+        return self.tokens[self.offsets[documents.start]:self.offsets[documents.stop]]
+
+    def decode(self, ids):
+        """Return the words of token IDs."""
+        return self.words[np.asarray(ids)].tolist()
+
+    def partitions(self, n_parts):
+        """Split the documents into n_parts contiguous ranges of about the same number of tokens, one per worker."""
+        bounds = np.searchsorted(self.offsets, np.linspace(0, self.offsets[-1], n_parts + 1)[1:-1])
+        bounds = [0] + [int(b) for b in bounds] + [len(self)]
+        return [range(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def tagged_documents(self, include_descriptions=True, tag_categories=True):
+        """Return a restartable iterable of TaggedDocuments, as SubredditCorpus yields them."""
+        return TaggedTokenDocuments(self, include_descriptions=include_descriptions, tag_categories=tag_categories)
+
+
+class TaggedTokenDocuments(object):
+    """Restartable iterable of TaggedDocuments decoded from a TokenCorpus, for gensim.
+
+    Attributes:
+        corpus (TokenCorpus): Token-ID corpus to decode.
+        include_descriptions (bool): Yield subreddit descriptions as documents too.
+        tag_categories (bool): Tag documents with their category and subcategory as well.
+    """
+
+    def __init__(self, corpus, include_descriptions=True, tag_categories=True):
+        self.corpus = corpus
+        self.include_descriptions = include_descriptions
+        self.tag_categories = tag_categories
+
+    def __iter__(self):
+        for key in self.corpus.keys:
+            tags = document_tags(key) if self.tag_categories else document_tags(key)[:1]
+            for i in self.corpus.subreddit_documents(key):
+                if self.corpus.doc_names[i] == 'description' and not self.include_descriptions:
+                    continue
+                words = self.corpus.decode(self.corpus.document(i))
+                for start in range(0, len(words), MAX_DOCUMENT_WORDS):
+                    yield TaggedDocument(words[start:start + MAX_DOCUMENT_WORDS], tags)
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Encode the corpus as token IDs in memory-mapped arrays.')
+    parser.add_argument('--corpus', default=None, help='Packed store or reddit_raw tree.')
+    parser.add_argument('--output', default=None, help='Defaults to data/processed/token_corpus.')
+    parser.add_argument('--min-count', type=int, default=MIN_COUNT, help='Drop words occurring fewer times.')
+    parser.add_argument('--processes', type=int, default=None, help='Defaults to the number of CPUs.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    build_token_corpus(args.corpus, args.output, min_count=args.min_count, processes=args.processes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Approximate nearest neighbour index over subreddit vectors.
+
+Random projection LSH with cosine similarity. Each of n_tables hash tables hashes a vector to the
+signs of its projections onto n_bits random hyperplanes. A query collects the subreddits that
+share a bucket with it in any table, and ranks only those candidates exactly. Recall and latency
+are traded off by:
+
+- n_tables: more tables find more true neighbours, at the cost of memory and build time
+- n_bits: more bits make smaller buckets, so fewer candidates are ranked
+- n_probes: buckets whose code differs in the least confident bits are searched as well
+
+Rows are keyed by (category, subcategory, subreddit). Results can be restricted to a category or
+subcategory, and subreddits can be excluded, e.g. the ones a user already follows.
+
+An index is saved as a directory of .npy files and loaded memory-mapped. Versioned indexes live in
+numbered subdirectories of a root, and a CURRENT file names the one readers should load. It is
+replaced atomically, so a reader sees either the old or the new version, never a mix.
+
+    python src/models/ann_index.py --model models/doc2vec/subreddits.model
+"""
+import argparse
+import json
+import os
+import os.path as op
+import shutil
+import time
+from timeit import default_timer
+
+import numpy as np
+
+from subreddit_recommender.src.data.manifest import subreddit_key
+from subreddit_recommender.src.util import models_dir
+
+N_TABLES = 8
+N_BITS = 12
+N_PROBES = 4
+ARRAYS = ['vectors', 'planes', 'order', 'sorted_codes']
+KEYS_FILENAME = 'keys.json'
+CURRENT_FILENAME = 'CURRENT'
+VERSION_DIRNAME = 'v{version:06d}'
+META_FILENAME = 'meta.json'
+KEEP_VERSIONS = 3
+
+
+def ann_index_dir(name='subreddits'):
+    """Return the default location of a saved index."""
+    return op.join(models_dir('ann_index'), name)
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def subreddit_vectors(model):
+    """Return (keys, vectors) of the subreddit tags of a trained Doc2Vec model.
+
+    Subreddits are tagged by 'category/subcategory/subreddit', category and subcategory tags are skipped.
+    """
+    keys = [tag for tag in model.docvecs.offset2doctag if tag.count('/') == 2]
+    return keys, np.vstack([model.docvecs[key] for key in keys])
+
+
+def _key(subreddit):
+    return subreddit if isinstance(subreddit, str) else subreddit_key(subreddit)
+
+
+def _bit_weights(n_bits):
+    return 1 << np.arange(n_bits, dtype=np.int64)
+
+
+def _hash(planes, queries):
+    """Return (codes, projections) of unit length queries, n_tables x n and n_tables x n x n_bits."""
+    projections = np.einsum('tbd,nd->tnb', planes, queries)
+    codes = (projections > 0).astype(np.int64).dot(_bit_weights(planes.shape[1]))
+    return codes, projections
+
+
+class AnnIndex(object):
+    """Random projection LSH index with exact reranking of candidates.
+
+    Attributes:
+        keys (list(str)): 'category/subcategory/subreddit' of every row.
+        vectors (np.ndarray): Unit length row vectors, n x dim.
+        planes (np.ndarray): Random hyperplanes, n_tables x n_bits x dim.
+        order (np.ndarray): Per table, row ids sorted by bucket code, n_tables x n.
+        sorted_codes (np.ndarray): Per table, the sorted bucket codes, n_tables x n.
+    """
+
+    def __init__(self, keys, vectors, planes, order, sorted_codes):
+        self.keys = list(keys)
+        self.vectors = vectors
+        self.planes = planes
+        self.order = order
+        self.sorted_codes = sorted_codes
+        self.n_tables, self.n_bits, self.dim = planes.shape
+        self._rows = {key: i for i, key in enumerate(self.keys)}
+        self._categories = np.array([key.split('/')[0] for key in self.keys])
+        self._subcategories = np.array([key.split('/')[1] for key in self.keys])
+        self._bit_weights = _bit_weights(self.n_bits)
+
+    @classmethod
+    def build(cls, keys, vectors, n_tables=N_TABLES, n_bits=N_BITS, seed=0):
+        """Hash every vector into n_tables tables of 2 ** n_bits buckets."""
+        if n_bits > 62:
+            raise ValueError('n_bits must be at most 62.')
+        keys = [_key(k) for k in keys]
+        vectors = normalize_rows(vectors)
+        planes = np.random.RandomState(seed).randn(n_tables, n_bits, vectors.shape[1]).astype(np.float32)
+        codes = _hash(planes, vectors)[0]  # n_tables x n
+        order = np.argsort(codes, axis=1, kind='mergesort')
+        sorted_codes = codes[np.arange(n_tables)[:, np.newaxis], order]
+        return cls(keys, vectors, planes, order, sorted_codes)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, subreddit):
+        return _key(subreddit) in self._rows
+
+    def row(self, subreddit):
+        """Return the row of a subreddit, given its tuple or key."""
+        return self._rows[_key(subreddit)]
+
+    def vector(self, subreddit):
+        return self.vectors[self.row(subreddit)]
+
+    def codes(self):
+        """Return the bucket code of every row in every table, n_tables x n."""
+        codes = np.empty_like(self.sorted_codes)
+        codes[np.arange(self.n_tables)[:, np.newaxis], self.order] = self.sorted_codes
+        return codes
+
+    def patched(self, updates):
+        """Return a copy of the index with some rows replaced or added, rehashing only those rows.
+
+        Args:
+            updates (dict): Maps subreddit tuples or keys to their new vectors. Unknown subreddits are appended.
+        """
+        if not updates:
+            return self
+        keys, codes = list(self.keys), self.codes()
+        updates = {_key(k): v for k, v in updates.items()}
+        added = sorted(k for k in updates if k not in self._rows)
+        vectors = np.vstack([np.asarray(self.vectors), np.zeros((len(added), self.dim), np.float32)])
+        codes = np.hstack([codes, np.zeros((self.n_tables, len(added)), codes.dtype)])
+        keys.extend(added)
+
+        rows = {key: i for i, key in enumerate(keys)}
+        changed = np.array([rows[k] for k in sorted(updates)], dtype=np.int64)
+        vectors[changed] = normalize_rows([updates[k] for k in sorted(updates)])
+        codes[:, changed] = _hash(self.planes, vectors[changed])[0]
+
+        order = np.argsort(codes, axis=1, kind='mergesort')
+        sorted_codes = codes[np.arange(self.n_tables)[:, np.newaxis], order]
+        return AnnIndex(keys, vectors, np.asarray(self.planes), order, sorted_codes)
+
+    def _probe_codes(self, code, projection, n_probes):
+        """Return the bucket code of a query plus the codes differing in its n_probes least confident bits."""
+        flips = np.argsort(np.abs(projection))[:n_probes]
+        return [code] + [code ^ int(self._bit_weights[bit]) for bit in flips]
+
+    def candidates(self, query_codes, projections, n_probes=N_PROBES):
+        """Return the sorted row ids that share a probed bucket with one query in any table."""
+        found = []
+        for t in range(self.n_tables):
+            for code in self._probe_codes(int(query_codes[t]), projections[t], n_probes):
+                lo, hi = np.searchsorted(self.sorted_codes[t], [code, code + 1])
+                found.append(self.order[t, lo:hi])
+        return np.unique(np.concatenate(found)) if found else np.empty(0, np.int64)
+
+    def allowed_mask(self, category=None, subcategory=None, exclude=None):
+        """Return a boolean mask of the rows a query may return, or None if all are allowed."""
+        if category is None and subcategory is None and not exclude:
+            return None
+        mask = np.ones(len(self.keys), dtype=bool)
+        if category is not None:
+            mask &= self._categories == category
+        if subcategory is not None:
+            mask &= self._subcategories == subcategory
+        for subreddit in exclude or []:
+            if subreddit in self:
+                mask[self.row(subreddit)] = False
+        return mask
+
+    def _top_k(self, query, rows, k):
+        scores = self.vectors[rows].dot(query)
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        ranking = np.argsort(-scores, kind='mergesort')
+        return rows[ranking], scores[ranking]
+
+    def query_batch(self, queries, k=10, n_probes=N_PROBES, category=None, subcategory=None, exclude=None,
+                    exact=False):
+        """Return the top k neighbours of every query.
+
+        Args:
+            queries (np.ndarray): n x dim.
+            n_probes (int): Extra buckets searched per table. Higher is slower, with better recall.
+            category (str): Only return subreddits of this category.
+            subcategory (str): Only return subreddits of this subcategory.
+            exclude (list): Subreddits never returned, as tuples or keys.
+            exact (bool): Rank every allowed subreddit instead of the LSH candidates.
+
+        Returns:
+            results: list(list(tuple))
+                Per query, [((category, subcategory, subreddit), cosine similarity)], best first.
+        """
+        queries = normalize_rows(np.atleast_2d(queries))
+        mask = self.allowed_mask(category, subcategory, exclude)
+        all_rows = np.arange(len(self.keys)) if mask is None else np.flatnonzero(mask)
+        codes, projections = _hash(self.planes, queries)
+
+        results = []
+        for i, query in enumerate(queries):
+            rows = all_rows
+            if not exact:
+                rows = self.candidates(codes[:, i], projections[:, i], n_probes=n_probes)
+                if mask is not None:
+                    rows = rows[mask[rows]]
+                if len(rows) < k:  # too few candidates, fall back to a full scan
+                    rows = all_rows
+            rows, scores = self._top_k(query, rows, k)
+            results.append([(tuple(self.keys[r].split('/')), float(s)) for r, s in zip(rows, scores)])
+        return results
+
+    def query(self, vector, k=10, **kwargs):
+        """Return the top k neighbours of a single vector. See query_batch."""
+        return self.query_batch(vector[np.newaxis, :], k=k, **kwargs)[0]
+
+    def similar(self, subreddit, k=10, **kwargs):
+        """Return the top k subreddits most similar to a subreddit in the index, excluding itself."""
+        exclude = list(kwargs.pop('exclude', None) or []) + [subreddit]
+        return self.query(self.vector(subreddit), k=k, exclude=exclude, **kwargs)
+
+    def save(self, path):
+        """Save as a directory of .npy files and a key list."""
+        if not op.exists(path):
+            os.makedirs(path)
+        for name in ARRAYS:
+            np.save(op.join(path, name + '.npy'), getattr(self, name))
+        with open(op.join(path, KEYS_FILENAME), 'w') as file:
+            json.dump(self.keys, file)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a saved index. By default its arrays are memory-mapped read-only.
+
+        If path is the root of versioned indexes, its current version is loaded.
+        """
+        path = resolve_version(path)
+        arrays = [np.load(op.join(path, name + '.npy'), mmap_mode=mmap_mode) for name in ARRAYS]
+        with open(op.join(path, KEYS_FILENAME), 'r') as file:
+            keys = json.load(file)
+        return cls(keys, *arrays)
+
+
+def current_version(root):
+    """Return the name of the current version under a root of versioned indexes, or None."""
+    try:
+        with open(op.join(root, CURRENT_FILENAME), 'r') as file:
+            return file.read().strip() or None
+    except (IOError, OSError):
+        return None
+
+
+def resolve_version(path):
+    """Return the directory of the current version if path is a versioned root, otherwise path."""
+    version = current_version(path)
+    return op.join(path, version) if version else path
+
+
+def version_meta(root, version=None):
+    """Return the metadata saved with a version, by default the current one."""
+    version = version or current_version(root)
+    with open(op.join(root, version, META_FILENAME), 'r') as file:
+        return json.load(file)
+
+
+def save_version(index, root, meta=None, keep=KEEP_VERSIONS):
+    """Save an index as the next version under root, make it current and prune old versions.
+
+    Returns:
+        version: str
+    """
+    previous = current_version(root)
+    number = int(previous[1:]) + 1 if previous else 1
+    version = VERSION_DIRNAME.format(version=number)
+    index.save(op.join(root, version))
+
+    meta = dict(meta or {})
+    meta.update({'version': version, 'parent': previous, 'created': time.time(), 'n_subreddits': len(index)})
+    with open(op.join(root, version, META_FILENAME), 'w') as file:
+        json.dump(meta, file, indent=4, sort_keys=True)
+
+    tmp_path = op.join(root, CURRENT_FILENAME + '.tmp')
+    with open(tmp_path, 'w') as file:
+        file.write(version)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, op.join(root, CURRENT_FILENAME))
+
+    # readers that already mapped a pruned version keep their pages until they close them
+    versions = sorted(name for name in os.listdir(root) if name.startswith('v') and name[1:].isdigit())
+    for name in versions[:-keep]:
+        shutil.rmtree(op.join(root, name), ignore_errors=True)
+    return version
+
+
+def recall_at_k(index, queries, k=10, **kwargs):
+    """Fraction of the exact top k neighbours the LSH search finds, averaged over queries."""
+    approximate = index.query_batch(queries, k=k, **kwargs)
+    exact = index.query_batch(queries, k=k, exact=True, **kwargs)
+    hits = [len(set(a for a, _ in approx) & set(e for e, _ in ex)) / float(max(len(ex), 1))
+            for approx, ex in zip(approximate, exact)]
+    return float(np.mean(hits)) if hits else 0.0
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Build an LSH index over the subreddit vectors of a Doc2Vec model.')
+    parser.add_argument('--model', required=True, help='Path of a Doc2Vec model saved by train_embeddings.py.')
+    parser.add_argument('--output', default=None, help='Defaults to models/ann_index/subreddits.')
+    parser.add_argument('--tables', type=int, default=N_TABLES)
+    parser.add_argument('--bits', type=int, default=N_BITS)
+    return parser.parse_args(args)
+
+
+def main():
+    from subreddit_recommender.src.models.train_embeddings import load_model
+
+    args = parse_args()
+    t0 = default_timer()
+    keys, vectors = subreddit_vectors(load_model(args.model, 'doc2vec'))
+    index = AnnIndex.build(keys, vectors, n_tables=args.tables, n_bits=args.bits)
+    save_version(index, args.output or ann_index_dir(), meta={'model': args.model})
+    sample = vectors[:min(len(vectors), 200)]
+    msg = '{n} subreddits indexed, recall@10 on a sample: {recall:.3f}. Time elapsed: {time}s'
+    print(msg.format(n=len(index), recall=recall_at_k(index, sample), time=round(default_timer() - t0, 2)))
+
+
+if __name__ == '__main__':
+    main()
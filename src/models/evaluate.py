@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""Recommendation quality and latency of models and index variants.
+
+The subreddit list already sorts every subreddit into a category and subcategory, so those serve as
+labels: a good neighbour of a subreddit is another subreddit of the same subcategory. For every
+source of subreddit vectors (a Doc2Vec model or a saved index) and every index variant, this
+reports:
+
+- recall@k: same-subcategory neighbours among the top k, over min(k, number of such subreddits)
+- MRR: mean reciprocal rank of the first same-subcategory neighbour in the top k
+- build time and memory of the index arrays
+- p50/p99 latency of single queries and of query batches
+
+Other listings of the same subreddit (a subreddit can appear in several categories) are excluded
+from its neighbours. Doc2Vec models trained with category tags have seen these labels, so compare
+those among themselves, or train with tag_categories=False for a held-out evaluation.
+
+The results are saved as JSON, and a previous run can be passed as baseline to print the changes.
+
+    python src/models/evaluate.py --model models/doc2vec/subreddits.model --baseline last.json
+"""
+import argparse
+import json
+import os
+import os.path as op
+import time
+from collections import Counter, defaultdict
+from timeit import default_timer
+
+import numpy as np
+
+from subreddit_recommender.src.data.manifest import subreddit_key
+from subreddit_recommender.src.models.ann_index import (ARRAYS, KEYS_FILENAME,
+                                                        AnnIndex,
+                                                        resolve_version)
+from subreddit_recommender.src.util import data_dir, load_json, models_dir
+
+K = 10
+MAX_QUERIES = 1000
+BATCH_SIZE = 64
+LEVELS = {'category': 1, 'subcategory': 2}
+
+
+def lsh_variant(n_tables, n_bits, n_probes):
+    return {'name': 'lsh-t{t}-b{b}-p{p}'.format(t=n_tables, b=n_bits, p=n_probes),
+            'n_tables': n_tables, 'n_bits': n_bits, 'n_probes': n_probes, 'exact': False}
+
+
+# an exact variant is a flat index without hash tables, ranking every subreddit
+EXACT = {'name': 'exact', 'n_tables': 0, 'n_bits': 0, 'n_probes': 0, 'exact': True}
+DEFAULT_VARIANTS = [EXACT, lsh_variant(8, 12, 0), lsh_variant(8, 12, 4), lsh_variant(16, 12, 4),
+                    lsh_variant(4, 10, 2)]
+
+
+def evaluation_dir():
+    """Return the default directory of saved evaluation runs."""
+    return models_dir('evaluation')
+
+
+class Labels(object):
+    """Ground truth groups of the rows of an index.
+
+    Attributes:
+        groups (np.ndarray): Group id of every row, -1 for rows without a label.
+        n_relevant (np.ndarray): Number of rows sharing a row's group, other listings of the same subreddit
+            not counted.
+        same_name (dict): Maps every lower case subreddit name to its keys.
+    """
+
+    def __init__(self, keys, level='subcategory', subreddit_tuples=None):
+        depth = LEVELS[level]
+        allowed = set(subreddit_key(t) for t in subreddit_tuples) if subreddit_tuples is not None else None
+        group_ids, names = {}, [key.split('/')[-1].lower() for key in keys]
+        self.groups = np.full(len(keys), -1, dtype=np.int64)
+        for i, key in enumerate(keys):
+            if allowed is None or key in allowed:
+                self.groups[i] = group_ids.setdefault(tuple(key.split('/')[:depth]), len(group_ids))
+
+        group_sizes = np.bincount(self.groups[self.groups >= 0], minlength=len(group_ids))
+        listings = Counter((g, name) for g, name in zip(self.groups, names) if g >= 0)
+        self.n_relevant = np.array([group_sizes[g] - listings[(g, name)] if g >= 0 else 0
+                                    for g, name in zip(self.groups, names)], dtype=np.int64)
+        self.same_name = defaultdict(list)
+        for key, name in zip(keys, names):
+            self.same_name[name].append(key)
+        self._names = names
+
+    def query_rows(self, max_queries=None, seed=0):
+        """Return the rows that have at least one relevant neighbour, a random sample if there are too many."""
+        rows = np.flatnonzero(self.n_relevant > 0)
+        if max_queries is not None and len(rows) > max_queries:
+            rows = np.sort(np.random.RandomState(seed).choice(rows, size=max_queries, replace=False))
+        return rows
+
+    def excluded(self, row):
+        """Return the keys never counted as neighbours of a row: every listing of the same subreddit."""
+        return self.same_name[self._names[row]]
+
+
+def ranking_metrics(query_row, ranked_rows, labels, k):
+    """Return (recall@k, reciprocal rank) of the ranked neighbours of one query row."""
+    hits = labels.groups[np.asarray(ranked_rows[:k], dtype=np.int64)] == labels.groups[query_row]
+    recall = hits.sum() / float(min(k, labels.n_relevant[query_row]))
+    first = np.flatnonzero(hits)
+    return float(recall), 1.0 / (first[0] + 1) if len(first) else 0.0
+
+
+def index_nbytes(index):
+    return int(sum(np.asarray(getattr(index, name)).nbytes for name in ARRAYS))
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else None
+
+
+def evaluate_variant(keys, vectors, variant, labels, query_rows, k=K, batch_size=BATCH_SIZE):
+    """Build one index variant and measure its quality and latency.
+
+    Returns:
+        result: dict
+    """
+    t0 = default_timer()
+    index = AnnIndex.build(keys, vectors, n_tables=variant['n_tables'], n_bits=variant['n_bits'])
+    build_s = default_timer() - t0
+    search = {'n_probes': variant['n_probes'], 'exact': variant['exact']}
+
+    recalls, reciprocal_ranks, single_latencies = [], [], []
+    for row in query_rows:
+        t0 = default_timer()
+        neighbours = index.query(index.vectors[row], k=k, exclude=labels.excluded(row), **search)
+        single_latencies.append(default_timer() - t0)
+        recall, reciprocal_rank = ranking_metrics(row, [index.row(key) for key, _ in neighbours], labels, k)
+        recalls.append(recall)
+        reciprocal_ranks.append(reciprocal_rank)
+
+    batch_latencies = []
+    for start in range(0, len(query_rows), batch_size):
+        t0 = default_timer()
+        index.query_batch(index.vectors[query_rows[start:start + batch_size]], k=k, **search)
+        batch_latencies.append(default_timer() - t0)
+
+    return {
+        'variant': variant['name'],
+        'params': {name: variant[name] for name in ('n_tables', 'n_bits', 'n_probes', 'exact')},
+        'recall_at_k': float(np.mean(recalls)) if recalls else None,
+        'mrr': float(np.mean(reciprocal_ranks)) if reciprocal_ranks else None,
+        'build_s': build_s,
+        'index_bytes': index_nbytes(index),
+        'single_p50_s': percentile(single_latencies, 50),
+        'single_p99_s': percentile(single_latencies, 99),
+        'batch_p50_s': percentile(batch_latencies, 50),
+        'batch_p99_s': percentile(batch_latencies, 99),
+    }
+
+
+def evaluate(sources, variants=DEFAULT_VARIANTS, k=K, level='subcategory', subreddit_tuples=None,
+             max_queries=MAX_QUERIES, batch_size=BATCH_SIZE, seed=0, verbose=1):
+    """Evaluate every index variant on the vectors of every source.
+
+    Args:
+        sources (dict): Maps a name to the (keys, vectors) of a model, e.g. from load_source.
+        variants (list(dict)): Index variants, see lsh_variant and EXACT.
+        level (str): 'subcategory' or 'category', the label shared by relevant neighbours.
+        subreddit_tuples (list(tuple)): If given, only subreddits of this list are labelled, e.g. the
+            subreddit list without the Defunct category. Defaults to the keys of each source.
+        max_queries (int): Queries per source, sampled with seed if more subreddits are labelled.
+        batch_size (int): Queries per batch when timing batch queries.
+
+    Returns:
+        run: dict
+            The settings of the run, and in 'results' one dict per source and variant.
+    """
+    run = {'created': time.time(), 'k': k, 'level': level, 'batch_size': batch_size, 'results': []}
+    for name in sorted(sources):
+        keys, vectors = sources[name]
+        labels = Labels(keys, level=level, subreddit_tuples=subreddit_tuples)
+        query_rows = labels.query_rows(max_queries, seed=seed)
+        for variant in variants:
+            result = {'model': name, 'n_subreddits': len(keys), 'n_queries': len(query_rows)}
+            result.update(evaluate_variant(keys, vectors, variant, labels, query_rows, k=k, batch_size=batch_size))
+            run['results'].append(result)
+            if verbose > 0:
+                print(format_result(result, k))
+    return run
+
+
+def format_result(result, k, baseline=None):
+    msg = ('{model:<24} {variant:<16} recall@{k} {recall:.3f}  MRR {mrr:.3f}  build {build:>7.1f}ms  '
+           '{mb:>7.1f}MB  single p50 {p50:>6.2f}ms p99 {p99:>6.2f}ms  batch p99 {batch:>7.1f}ms')
+    line = msg.format(model=result['model'], variant=result['variant'], k=k,
+                      recall=result['recall_at_k'] or 0, mrr=result['mrr'] or 0,
+                      build=1000 * result['build_s'], mb=result['index_bytes'] / 2.0 ** 20,
+                      p50=1000 * (result['single_p50_s'] or 0), p99=1000 * (result['single_p99_s'] or 0),
+                      batch=1000 * (result['batch_p99_s'] or 0))
+    if baseline is not None:
+        msg = '  (recall {recall:+.3f}, MRR {mrr:+.3f}, single p99 {p99:+.2f}ms vs. baseline)'
+        line += msg.format(recall=(result['recall_at_k'] or 0) - (baseline['recall_at_k'] or 0),
+                           mrr=(result['mrr'] or 0) - (baseline['mrr'] or 0),
+                           p99=1000 * ((result['single_p99_s'] or 0) - (baseline['single_p99_s'] or 0)))
+    return line
+
+
+def compare_runs(run, baseline_run):
+    """Return the results of a run as lines, with the change from the same model and variant of a baseline run."""
+    previous = {(r['model'], r['variant']): r for r in baseline_run['results']}
+    return [format_result(r, run['k'], baseline=previous.get((r['model'], r['variant']))) for r in run['results']]
+
+
+def load_source(path):
+    """Return (keys, vectors) of a saved AnnIndex or, otherwise, of the subreddit tags of a Doc2Vec model."""
+    if op.exists(op.join(resolve_version(path), KEYS_FILENAME)):
+        index = AnnIndex.load(path)
+        return index.keys, np.asarray(index.vectors)
+
+    from subreddit_recommender.src.models.ann_index import subreddit_vectors
+    from subreddit_recommender.src.models.train_embeddings import load_model
+    return subreddit_vectors(load_model(path, 'doc2vec'))
+
+
+def parse_variants(tables, bits, probes):
+    """Return the exact variant plus one LSH variant per combination of tables, bits and probes."""
+    return [EXACT] + [lsh_variant(t, b, p) for t in tables for b in bits for p in probes]
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Evaluate recommendation quality and latency of models and indexes.')
+    parser.add_argument('--model', nargs='+', required=True,
+                        help='Doc2Vec models saved by train_embeddings.py, or saved AnnIndex directories.')
+    parser.add_argument('--k', type=int, default=K)
+    parser.add_argument('--level', choices=sorted(LEVELS), default='subcategory')
+    parser.add_argument('--queries', type=int, default=MAX_QUERIES, help='Maximum number of query subreddits.')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--tables', type=int, nargs='+', default=None, help='Hash tables of the LSH variants.')
+    parser.add_argument('--bits', type=int, nargs='+', default=[12], help='Bits per table of the LSH variants.')
+    parser.add_argument('--probes', type=int, nargs='+', default=[0, 4], help='Probes of the LSH variants.')
+    parser.add_argument('--output', default=None, help='Defaults to models/evaluation/evaluation_<time>.json.')
+    parser.add_argument('--baseline', default=None, help='An earlier output to compare against.')
+    return parser.parse_args(args)
+
+
+def main():
+    from subreddit_recommender.src.data.download_reddit_data import (flatten_subreddit_dict,
+                                                                     remove_defunct)
+
+    args = parse_args()
+    subreddit_tuples = None
+    if op.exists(op.join(data_dir('raw'), 'subreddit_list.json')):
+        subreddit_tuples = remove_defunct(flatten_subreddit_dict(load_json('subreddit_list.json')))
+    variants = parse_variants(args.tables, args.bits, args.probes) if args.tables else DEFAULT_VARIANTS
+    sources = {path: load_source(path) for path in args.model}
+    run = evaluate(sources, variants=variants, k=args.k, level=args.level, subreddit_tuples=subreddit_tuples,
+                   max_queries=args.queries, batch_size=args.batch_size, verbose=0 if args.baseline else 1)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            print('\n'.join(compare_runs(run, json.load(file))))
+
+    output = args.output or op.join(evaluation_dir(), 'evaluation_{time}.json'.format(time=int(run['created'])))
+    if op.dirname(output) and not op.exists(op.dirname(output)):
+        os.makedirs(op.dirname(output))
+    with open(output, 'w') as file:
+        json.dump(run, file, indent=4, sort_keys=True)
+    print('Results saved to {path}'.format(path=output))
+
+
+if __name__ == '__main__':
+    main()
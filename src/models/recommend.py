@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Batch recommendations for many users at once.
+
+Every user is a list of subreddits they follow. A chunk of users becomes a sparse users x subreddits
+matrix, so the user vectors (mean of the followed subreddit vectors) take one sparse product, and
+all their scores one dense product with the subreddit vectors. Followed subreddits are masked out,
+in every category they are listed in, and the top k are selected with argpartition, keeping each
+subreddit name once. Memory is bounded by chunk_size x n_subreddits scores.
+
+Input is JSON lines of {"user": ..., "subreddits": [...]}, output JSON lines of
+{"user": ..., "recommendations": [[category, subcategory, subreddit, score], ...]}.
+
+    python src/models/recommend.py users.jsonl recommendations.jsonl --k 10
+"""
+import argparse
+import itertools
+import json
+from collections import defaultdict
+from timeit import default_timer
+
+import numpy as np
+import scipy.sparse as sp
+
+from subreddit_recommender.src.data.manifest import subreddit_key
+from subreddit_recommender.src.models.ann_index import (AnnIndex,
+                                                        ann_index_dir,
+                                                        normalize_rows)
+from subreddit_recommender.src.util import valid_subreddit_dirname
+
+K = 10
+CHUNK_SIZE = 1024
+
+
+class SubredditResolver(object):
+    """Maps the ways a subreddit can be named to rows of an index.
+
+    A tuple or 'category/subcategory/subreddit' key names one row. A bare name such as 'cats' or
+    '/r/cats' names every row of that subreddit, since a subreddit can be listed in several categories.
+
+    Attributes:
+        max_listings (int): The most rows any subreddit name has.
+    """
+
+    def __init__(self, keys):
+        self._rows = {key: i for i, key in enumerate(keys)}
+        self._names = [key.split('/')[-1].lower() for key in keys]
+        self._by_name = defaultdict(list)
+        for i, name in enumerate(self._names):
+            self._by_name[name].append(i)
+        self.max_listings = max([len(rows) for rows in self._by_name.values()] or [1])
+
+    def rows(self, subreddit):
+        """Return the rows of a subreddit, or [] if it is unknown."""
+        if isinstance(subreddit, (tuple, list)):
+            key = subreddit_key(subreddit)
+            return [self._rows[key]] if key in self._rows else []
+        if subreddit.count('/') == 2 and subreddit in self._rows:
+            return [self._rows[subreddit]]
+        return self._by_name.get(valid_subreddit_dirname(subreddit).lower(), [])
+
+    def same_name_rows(self, rows):
+        """Return the rows of every listing of the subreddits in rows."""
+        return sorted(set(r for row in rows for r in self._by_name[self._names[row]]))
+
+
+def unique_by_name(recommendations, k):
+    """Keep the first of the recommendations of the same subreddit, listed in several categories, up to k."""
+    names, unique = set(), []
+    for key, score in recommendations:
+        if key[-1].lower() not in names:
+            names.add(key[-1].lower())
+            unique.append((key, score))
+            if len(unique) == k:
+                break
+    return unique
+
+
+def _rows_matrix(row_lists, n_subreddits):
+    indptr, indices = [0], []
+    for rows in row_lists:
+        indices.extend(rows)
+        indptr.append(len(indices))
+    data = np.ones(len(indices), dtype=np.float32)
+    return sp.csr_matrix((data, indices, indptr), shape=(len(row_lists), n_subreddits))
+
+
+def follow_matrix(users, resolver, n_subreddits, same_name=False):
+    """Return a users x subreddits csr matrix with a 1 for every followed subreddit.
+
+    With same_name, every listing of a followed subreddit gets a 1, not only the one the user named.
+    """
+    row_lists = []
+    for subreddits in users:
+        rows = sorted(set(r for s in subreddits for r in resolver.rows(s)))
+        row_lists.append(resolver.same_name_rows(rows) if same_name else rows)
+    return _rows_matrix(row_lists, n_subreddits)
+
+
+def _recommend_chunk(follows, vectors, k, masked=None):
+    """Return (rows, scores) of the top k subreddits of every user, best first.
+
+    The rows of masked, follows by default, are never returned.
+    """
+    counts = np.asarray(follows.sum(axis=1)).ravel()
+    user_vectors = normalize_rows(follows.dot(vectors) / np.maximum(counts, 1)[:, np.newaxis])
+    scores = user_vectors.dot(np.asarray(vectors).T)
+
+    followed_users, followed_rows = (follows if masked is None else masked).nonzero()
+    scores[followed_users, followed_rows] = -np.inf
+    scores[counts == 0] = -np.inf  # nothing to go on
+
+    k = min(k, scores.shape[1])
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = scores[np.arange(len(top))[:, np.newaxis], top]
+    ranking = np.argsort(-top_scores, axis=1, kind='mergesort')
+    take = np.arange(len(top))[:, np.newaxis], ranking
+    return top[take], top_scores[take]
+
+
+def recommend_batch(index, users, k=K, chunk_size=CHUNK_SIZE):
+    """Recommend k subreddits to every user.
+
+    Args:
+        index (AnnIndex): Supplies the subreddit keys and unit length vectors.
+        users (iterable(list)): Per user, the followed subreddits as tuples, keys or names.
+        chunk_size (int): Users scored together. Bounds memory to chunk_size x n_subreddits floats.
+
+    Yields:
+        recommendations: list(tuple)
+            Per user, in order, [((category, subcategory, subreddit), score)]. Empty for users following
+            no known subreddit.
+    """
+    resolver = SubredditResolver(index.keys)
+    keys = [tuple(key.split('/')) for key in index.keys]
+    # enough candidates that k remain after dropping other listings of the same subreddit
+    n_candidates = k * resolver.max_listings
+    users = iter(users)
+    chunk = list(itertools.islice(users, chunk_size))
+    while chunk:
+        follows = follow_matrix(chunk, resolver, len(keys))
+        masked = follow_matrix(chunk, resolver, len(keys), same_name=True)
+        top, scores = _recommend_chunk(follows, index.vectors, n_candidates, masked=masked)
+        for rows, row_scores in zip(top, scores):
+            yield unique_by_name([(keys[r], float(s)) for r, s in zip(rows, row_scores) if np.isfinite(s)], k)
+        chunk = list(itertools.islice(users, chunk_size))
+
+
+def _read_users(path):
+    with open(path, 'r') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def recommend_file(users_path, output_path, index, k=K, chunk_size=CHUNK_SIZE):
+    """Stream users from a JSON lines file and write their recommendations as JSON lines.
+
+    Returns:
+        n_users: int
+    """
+    records, follows = itertools.tee(_read_users(users_path))
+    n_users = 0
+    with open(output_path, 'w') as file:
+        recommendations = recommend_batch(index, (r['subreddits'] for r in follows), k=k, chunk_size=chunk_size)
+        for record, recommended in zip(records, recommendations):
+            line = {'user': record.get('user'),
+                    'recommendations': [list(key) + [round(score, 6)] for key, score in recommended]}
+            file.write(json.dumps(line) + '\n')
+            n_users += 1
+    return n_users
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Recommend subreddits to every user in a JSON lines file.')
+    parser.add_argument('users', help='JSON lines of {"user": ..., "subreddits": [...]}.')
+    parser.add_argument('output', help='Recommendations are written here as JSON lines.')
+    parser.add_argument('--index', default=None, help='Saved AnnIndex. Defaults to models/ann_index/subreddits.')
+    parser.add_argument('--k', type=int, default=K)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    t0 = default_timer()
+    index = AnnIndex.load(args.index or ann_index_dir())
+    n_users = recommend_file(args.users, args.output, index, k=args.k, chunk_size=args.chunk_size)
+    msg = 'Recommendations for {n} users written to {path}. Time elapsed: {time}s'
+    print(msg.format(n=n_users, path=args.output, time=round(default_timer() - t0, 2)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""Asyncio HTTP recommendation server.
+
+The subreddit vectors and LSH index are memory-mapped at startup, so a restarted server answers its
+first query without reading the model into memory. Endpoints:
+
+    GET /recommend?subreddits=cats,dogs&k=10&category=Animals
+    GET /metrics     request count, p50/p99 latency in ms, cache and coalescing counters
+    GET /health
+
+Results are kept in an LRU cache with a time to live, and identical queries arriving while one is
+being computed wait for that computation instead of starting their own.
+
+    python src/models/serve.py --port 8000
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from subreddit_recommender.src.models.ann_index import (AnnIndex,
+                                                        ann_index_dir,
+                                                        current_version)
+from subreddit_recommender.src.models.recommend import (K, SubredditResolver,
+                                                        unique_by_name)
+
+HOST = '127.0.0.1'
+PORT = 8000
+CACHE_SIZE = 10000
+CACHE_TTL = 600
+MAX_K = 100
+LATENCY_WINDOW = 10000
+RELOAD_INTERVAL = 10
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _current_task():
+    # asyncio.current_task was added in 3.7, Task.current_task removed in 3.9
+    current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+    return current_task()
+
+
+async def _discard_body(reader, headers):
+    """Read past the body of a request. Returns False if its length is unknown, the connection must close."""
+    if 'transfer-encoding' in headers:
+        return False
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        return False
+    if length > 0:
+        await reader.readexactly(length)
+    return length >= 0
+
+
+class TTLCache(object):
+    """Least recently used cache whose entries expire after ttl seconds.
+
+    Attributes:
+        max_size (int): Least recently used entries are dropped beyond this many.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return a cached value, or None if it is missing or expired."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (self._clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+def recommend_one(index, resolver, subreddits, k=K, category=None):
+    """Recommend k subreddits to a user following the given subreddits, using the LSH index.
+
+    Returns:
+        recommendations: list(list)
+            [[category, subcategory, subreddit, score]], best first. Empty if no subreddit is known.
+    """
+    rows = sorted(set(r for s in subreddits for r in resolver.rows(s)))
+    if not rows:
+        return []
+    user = np.asarray(index.vectors[rows]).mean(axis=0)
+    exclude = [index.keys[r] for r in resolver.same_name_rows(rows)]
+    neighbours = index.query(user, k=k * resolver.max_listings, category=category, exclude=exclude)
+    return [list(key) + [round(score, 6)] for key, score in unique_by_name(neighbours, k)]
+
+
+def parse_query(query):
+    """Return the normalized (subreddits, k, category) of a /recommend query string."""
+    params = parse_qs(query)
+    subreddits = [s.strip() for value in params.get('subreddits', []) for s in value.split(',') if s.strip()]
+    if not subreddits:
+        raise ValueError('subreddits is required, e.g. /recommend?subreddits=cats,dogs')
+    k = int(params.get('k', [K])[-1])
+    if not 0 < k <= MAX_K:
+        raise ValueError('k must be between 1 and {max_k}.'.format(max_k=MAX_K))
+    category = params.get('category', [None])[-1]
+    return tuple(sorted(set(_normalize_subreddit(s) for s in subreddits))), k, category
+
+
+def _normalize_subreddit(subreddit):
+    """Lowercase subreddit names, which the resolver matches without case. Full keys are kept as given."""
+    if subreddit.count('/') == 2 and not subreddit.startswith('/'):
+        return subreddit
+    return subreddit.lower()
+
+
+class RecommendationServer(object):
+    """Serves recommendations from a memory-mapped AnnIndex.
+
+    Attributes:
+        index_path (str): Directory of a saved AnnIndex.
+        cache_size (int): Number of query results kept.
+        cache_ttl (float): Seconds a cached result stays valid.
+        workers (int): Threads computing recommendations. numpy releases the GIL while scoring.
+        reload_interval (float): Seconds between checks for a new index version. None to never reload.
+    """
+
+    def __init__(self, index_path=None, host=HOST, port=PORT, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL,
+                 workers=4, reload_interval=RELOAD_INTERVAL):
+        self.index_path = index_path or ann_index_dir()
+        self.reload_interval = reload_interval
+        self.host = host
+        self.port = port
+        self.cache = TTLCache(cache_size, cache_ttl)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stats = {'requests': 0, 'cache_hits': 0, 'coalesced': 0, 'computed': 0, 'errors': 0}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._in_flight = {}
+        self._connections = set()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self.load()
+
+    def _load_version(self):
+        version = current_version(self.index_path)
+        index = AnnIndex.load(self.index_path)
+        return version, index, SubredditResolver(index.keys)
+
+    def _swap(self, loaded, load_time):
+        # a single assignment, so every request sees one complete version
+        self.version, self.index, self.resolver = loaded
+        self.cache.clear()  # cached results came from the previous version
+        self.load_time = load_time
+
+    def load(self):
+        """Memory-map the current version of the index."""
+        t0 = default_timer()
+        loaded = self._load_version()
+        self._swap(loaded, default_timer() - t0)
+
+    async def _watch_versions(self):
+        """Load new index versions in the background and swap to them between requests."""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            if current_version(self.index_path) == self.version:
+                continue
+            t0 = default_timer()
+            try:
+                loaded = await self._loop.run_in_executor(self._executor, self._load_version)
+            except (IOError, OSError, ValueError):
+                continue  # pruned or half written, try again next time
+            self._swap(loaded, default_timer() - t0)
+
+    @property
+    def url(self):
+        return 'http://{host}:{port}'.format(host=self.host, port=self.port)
+
+    async def recommend(self, query):
+        """Return the recommendations of a normalized query, from the cache or a shared computation.
+
+        Cache and in-flight entries are keyed by the index version as well, so a result computed on the
+        previous version is never served once a new version is swapped in.
+        """
+        key = self.version, query
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            return cached
+        if key in self._in_flight:
+            self.stats['coalesced'] += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        subreddits, k, category = query
+        future = self._loop.run_in_executor(self._executor, recommend_one, self.index, self.resolver,
+                                            subreddits, k, category)
+        self._in_flight[key] = future
+        try:
+            result = await future
+        finally:
+            del self._in_flight[key]
+        self.stats['computed'] += 1
+        if key[0] == self.version:
+            self.cache.put(key, result)
+        return result
+
+    def metrics(self):
+        latencies = np.asarray(self.latencies) * 1000
+        metrics = dict(self.stats)
+        metrics.update({
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'cache_size': len(self.cache),
+            'n_subreddits': len(self.index),
+            'version': self.version,
+            'load_time_s': self.load_time,
+        })
+        return metrics
+
+    async def respond(self, request):
+        """Return (status, payload) of a request line split into method, target and version."""
+        if len(request) != 3:
+            return 400, {'error': 'Malformed request line.'}
+        try:
+            return await self.route(request[0], request[1])
+        except Exception as e:
+            self.stats['errors'] += 1
+            return 500, {'error': repr(e)}
+
+    async def route(self, method, target):
+        """Return (status, payload) of a request."""
+        url = urlparse(target)
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported.'}
+        if url.path == '/recommend':
+            try:
+                query = parse_query(url.query)
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            return 200, {'subreddits': list(query[0]), 'recommendations': await self.recommend(query)}
+        if url.path == '/metrics':
+            return 200, self.metrics()
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'Not Found'}
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one keep-alive connection."""
+        task = _current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                # a body left unread would be parsed as the next request line
+                body_read = await _discard_body(reader, headers)
+
+                t0 = default_timer()
+                request = request_line.decode('latin-1').split()
+                status, payload = await self.respond(request)
+                self.stats['requests'] += 1
+                self.latencies.append(default_timer() - t0)
+
+                body = json.dumps(payload).encode('utf-8')
+                keep_alive = body_read and len(request) == 3 and headers.get('connection', '').lower() != 'close'
+                head = ('HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n'
+                        'Content-Length: {length}\r\nConnection: {connection}\r\n{allow}\r\n')
+                writer.write(head.format(status=status, reason=_REASONS[status], length=len(body),
+                                         connection='keep-alive' if keep_alive else 'close',
+                                         allow='Allow: GET\r\n' if status == 405 else '').encode('latin-1'))
+                writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    def _serve(self, started):
+        asyncio.set_event_loop(self._loop)
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self.handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        watcher = self._loop.create_task(self._watch_versions()) if self.reload_interval else None
+        started.set()
+        self._loop.run_forever()
+
+        if watcher is not None:
+            watcher.cancel()
+            self._loop.run_until_complete(asyncio.gather(watcher, return_exceptions=True))
+
+        # close idle keep-alive connections before the loop goes away
+        self._server.close()
+        for task in list(self._connections):
+            task.cancel()
+        self._loop.run_until_complete(asyncio.gather(*self._connections, return_exceptions=True))
+        self._loop.run_until_complete(self._server.wait_closed())
+        self._loop.close()
+
+    def start(self):
+        """Serve from a background thread. Port 0 picks a free port."""
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(started,), daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._executor.shutdown()
+
+    def serve_forever(self):
+        """Serve from the calling thread until interrupted."""
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._serve(threading.Event())
+        except KeyboardInterrupt:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Serve subreddit recommendations over HTTP.')
+    parser.add_argument('--index', default=None, help='Saved AnnIndex. Defaults to models/ann_index/subreddits.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--cache-size', type=int, default=CACHE_SIZE)
+    parser.add_argument('--cache-ttl', type=float, default=CACHE_TTL, help='Seconds a cached result stays valid.')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_INTERVAL,
+                        help='Seconds between checks for a new index version.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    server = RecommendationServer(args.index, host=args.host, port=args.port, cache_size=args.cache_size,
+                                  cache_ttl=args.cache_ttl, workers=args.workers,
+                                  reload_interval=args.reload_interval)
+    msg = 'Serving {n} subreddits on {url}, index loaded in {time}ms.'
+    print(msg.format(n=len(server.index), url=server.url, time=round(1000 * server.load_time, 1)))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
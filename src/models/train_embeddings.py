@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Train Doc2Vec or Word2Vec embeddings on the streaming subreddit corpus.
+
+Training runs one epoch at a time over a SubredditCorpus, with gensim's worker threads. After
+every epoch a checkpoint is written, so an interrupted run continues with --resume. The final
+model is saved with every array in its own .npy file, so it can be loaded memory-mapped and
+read-only: processes loading the same model share its pages instead of each holding a copy.
+
+    python src/models/train_embeddings.py --model doc2vec --epochs 10 --workers 8
+"""
+import argparse
+import json
+import os
+import os.path as op
+from multiprocessing import cpu_count
+from timeit import default_timer
+
+from gensim.models import Doc2Vec, Word2Vec
+
+from subreddit_recommender.src.features.corpus import Sentences, SubredditCorpus
+from subreddit_recommender.src.features.token_corpus import TokenCorpus, is_token_corpus
+from subreddit_recommender.src.util import models_dir
+
+MODELS = {'doc2vec': Doc2Vec, 'word2vec': Word2Vec}
+VECTOR_SIZE = 300
+WINDOW = 8
+MIN_COUNT = 5
+EPOCHS = 10
+ALPHA = 0.025
+MIN_ALPHA = 0.0001
+
+
+def model_path(name, kind='doc2vec'):
+    """Return the path of a trained model in the models directory."""
+    return op.join(models_dir(kind), name + '.model')
+
+
+def checkpoint_path(name, kind='doc2vec'):
+    return op.join(models_dir(op.join(kind, 'checkpoints')), name + '.model')
+
+
+def _training_data(corpus, kind):
+    return corpus if kind == 'doc2vec' else Sentences(corpus)
+
+
+def build_model(kind, corpus, vector_size=VECTOR_SIZE, window=WINDOW, min_count=MIN_COUNT, workers=None,
+                seed=1, **params):
+    """Create a model and build its vocabulary with one pass over the corpus."""
+    model = MODELS[kind](size=vector_size, window=window, min_count=min_count, workers=workers or cpu_count(),
+                         alpha=ALPHA, min_alpha=MIN_ALPHA, seed=seed, **params)
+    model.build_vocab(_training_data(corpus, kind))
+    return model
+
+
+def _epoch_alphas(epoch, epochs):
+    """Linearly decay the learning rate from ALPHA to MIN_ALPHA over all epochs."""
+    step = (ALPHA - MIN_ALPHA) / epochs
+    return ALPHA - step * epoch, ALPHA - step * (epoch + 1)
+
+
+def save_checkpoint(model, path, epoch, epochs):
+    directory = op.dirname(path)
+    if not op.exists(directory):
+        os.makedirs(directory)
+    model.save(path)
+    with open(path + '.json', 'w') as file:
+        json.dump({'epoch': epoch, 'epochs': epochs}, file)
+
+
+def load_checkpoint(path, kind):
+    """Return (model, epochs completed), or (None, 0) if there is no checkpoint."""
+    if not (op.exists(path) and op.exists(path + '.json')):
+        return None, 0
+    with open(path + '.json', 'r') as file:
+        state = json.load(file)
+    return MODELS[kind].load(path), state['epoch'] + 1
+
+
+def train_model(model, corpus, kind, epochs=EPOCHS, start_epoch=0, checkpoint=None, verbose=1):
+    """Train for the remaining epochs, checkpointing after each one."""
+    data = _training_data(corpus, kind)
+    for epoch in range(start_epoch, epochs):
+        t0 = default_timer()
+        start_alpha, end_alpha = _epoch_alphas(epoch, epochs)
+        model.train(data, total_examples=model.corpus_count, epochs=1, start_alpha=start_alpha, end_alpha=end_alpha)
+        if checkpoint is not None:
+            save_checkpoint(model, checkpoint, epoch, epochs)
+        if verbose > 0:
+            msg = 'Epoch {i} / {n} complete. Time elapsed: {time}s'
+            print(msg.format(i=epoch + 1, n=epochs, time=round(default_timer() - t0, 2)))
+    return model
+
+
+def save_model(model, path):
+    """Save a model with every numpy array in a separate file, so load_model can memory-map them all."""
+    directory = op.dirname(path)
+    if not op.exists(directory):
+        os.makedirs(directory)
+    model.save(path, sep_limit=0)
+
+
+def load_model(path, kind='doc2vec', mmap='r'):
+    """Load a model saved by save_model. With mmap='r' its arrays are shared read-only between processes."""
+    return MODELS[kind].load(path, mmap=mmap)
+
+
+def train(kind='doc2vec', name='subreddits', corpus=None, epochs=EPOCHS, resume=False, verbose=1, **params):
+    """Train a model on the subreddit corpus and save it to the models directory.
+
+    Args:
+        kind (str): 'doc2vec' or 'word2vec'.
+        name (str): File name of the model, without extension.
+        corpus (SubredditCorpus): Defaults to the normalized corpus, or the raw corpus if there is none.
+        resume (bool): Continue from the last checkpoint of a model with the same name.
+        params: Passed on to build_model, e.g. vector_size and workers.
+
+    Returns:
+        path: str
+            Where the model was saved.
+    """
+    if kind not in MODELS:
+        raise ValueError('kind must be one of the following: {kinds}'.format(kinds=sorted(MODELS)))
+    corpus = corpus if corpus is not None else SubredditCorpus()
+    checkpoint = checkpoint_path(name, kind)
+
+    model, start_epoch = load_checkpoint(checkpoint, kind) if resume else (None, 0)
+    if model is None:
+        model = build_model(kind, corpus, **params)
+    elif verbose > 0:
+        print('Resuming from epoch {i}.'.format(i=start_epoch + 1))
+
+    train_model(model, corpus, kind, epochs=epochs, start_epoch=start_epoch, checkpoint=checkpoint, verbose=verbose)
+    path = model_path(name, kind)
+    save_model(model, path)
+    if verbose > 0:
+        print('Model saved to {path}.'.format(path=path))
+    return path
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Train subreddit embeddings on the streaming corpus.')
+    parser.add_argument('--model', choices=sorted(MODELS), default='doc2vec')
+    parser.add_argument('--name', default='subreddits', help='File name of the model in models/<model>/.')
+    parser.add_argument('--corpus', default=None, help='Packed store, reddit_raw tree or token-ID corpus to train on.')
+    parser.add_argument('--vector-size', type=int, default=VECTOR_SIZE)
+    parser.add_argument('--window', type=int, default=WINDOW)
+    parser.add_argument('--min-count', type=int, default=MIN_COUNT)
+    parser.add_argument('--epochs', type=int, default=EPOCHS)
+    parser.add_argument('--workers', type=int, default=None, help='Training threads. Defaults to the number of CPUs.')
+    parser.add_argument('--resume', action='store_true', help='Continue from the last checkpoint.')
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args()
+    if args.corpus and is_token_corpus(args.corpus):
+        corpus = TokenCorpus(args.corpus).tagged_documents()
+    else:
+        corpus = SubredditCorpus(args.corpus) if args.corpus else None
+    train(args.model, name=args.name, corpus=corpus, epochs=args.epochs, resume=args.resume,
+          vector_size=args.vector_size, window=args.window, min_count=args.min_count, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
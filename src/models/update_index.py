@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""Incremental embedding and index updates.
+
+After a refresh re-crawls some subreddits, their vectors are re-inferred with the trained Doc2Vec
+model, which stays frozen, and patched into a copy of the current index. Only the changed rows are
+rehashed. The copy is saved as a new version and made current atomically, so the recommendation
+server can swap to it between two requests.
+
+Which subreddits changed comes from the download manifest: everything fetched after the current
+version was created.
+
+    python src/models/update_index.py --model models/doc2vec/subreddits.model
+"""
+import argparse
+import os.path as op
+from timeit import default_timer
+
+import numpy as np
+
+from subreddit_recommender.src.data.manifest import Manifest
+from subreddit_recommender.src.features.corpus import SubredditCorpus
+from subreddit_recommender.src.models.ann_index import (KEYS_FILENAME,
+                                                        AnnIndex,
+                                                        ann_index_dir,
+                                                        current_version,
+                                                        save_version,
+                                                        version_meta)
+from subreddit_recommender.src.util import data_dir
+
+INFER_STEPS = 20
+
+
+def infer_subreddit_vectors(model, keys, corpus_dir=None, steps=INFER_STEPS):
+    """Infer a vector per subreddit as the mean of its documents' inferred vectors.
+
+    The model is not modified. Subreddits without any documents are left out.
+
+    Returns:
+        vectors: dict
+            Maps subreddit keys to vectors.
+    """
+    corpus = SubredditCorpus(corpus_dir, tag_categories=False, subreddits=set(keys))
+    sums, counts = {}, {}
+    for document in corpus:
+        key = document.tags[0]
+        vector = model.infer_vector(document.words, steps=steps)
+        sums[key] = sums.get(key, 0) + vector
+        counts[key] = counts.get(key, 0) + 1
+    return {key: np.asarray(sums[key] / counts[key], dtype=np.float32) for key in sums}
+
+
+def changed_since_current(index_root, manifest):
+    """Return the keys of subreddits fetched after the current index version was created."""
+    if current_version(index_root):
+        since = version_meta(index_root)['created']
+    else:  # an unversioned index
+        since = op.getmtime(op.join(index_root, KEYS_FILENAME))
+    return manifest.completed_since(since)
+
+
+def update_index(model, index_root=None, keys=None, manifest=None, corpus_dir=None, steps=INFER_STEPS, verbose=1):
+    """Re-infer the vectors of changed subreddits and publish a patched index version.
+
+    Args:
+        model (gensim.models.Doc2Vec): Frozen model used for inference.
+        index_root (str): Root of the versioned indexes. An unversioned index there becomes the parent
+                          of the first version.
+        keys (list(str)): Subreddits to update. Defaults to those the manifest records as fetched
+                          since the current version.
+        manifest (Manifest): Defaults to the manifest of data/raw/reddit_raw.
+
+    Returns:
+        version: str
+            The new current version, or None if nothing changed.
+    """
+    t0 = default_timer()
+    index_root = index_root or ann_index_dir()
+    if keys is None:
+        manifest = manifest or Manifest.in_directory(op.join(data_dir('raw'), 'reddit_raw'))
+        keys = changed_since_current(index_root, manifest)
+    if not keys:
+        if verbose > 0:
+            print('No subreddits changed.')
+        return None
+
+    updates = infer_subreddit_vectors(model, keys, corpus_dir=corpus_dir, steps=steps)
+    index = AnnIndex.load(index_root).patched(updates)
+    version = save_version(index, index_root, meta={'updated': sorted(updates)})
+    if verbose > 0:
+        msg = '{n} subreddits updated in version {version}. Time elapsed: {time}s'
+        print(msg.format(n=len(updates), version=version, time=round(default_timer() - t0, 2)))
+    return version
+
+
+def parse_args(args=None):
+    parser = argparse.ArgumentParser(description='Patch re-crawled subreddits into the recommendation index.')
+    parser.add_argument('--model', required=True, help='Doc2Vec model saved by train_embeddings.py.')
+    parser.add_argument('--index', default=None, help='Root of the versioned indexes. '
+                                                      'Defaults to models/ann_index/subreddits.')
+    parser.add_argument('--corpus', default=None, help='Packed store or reddit_raw tree.')
+    parser.add_argument('--subreddits', nargs='*', default=None,
+                        help='Keys (category/subcategory/subreddit) to update. Defaults to the ones the '
+                             'manifest records as fetched since the current version.')
+    parser.add_argument('--steps', type=int, default=INFER_STEPS, help='Inference epochs per document.')
+    return parser.parse_args(args)
+
+
+def main():
+    from subreddit_recommender.src.models.train_embeddings import load_model
+
+    args = parse_args()
+    update_index(load_model(args.model, 'doc2vec'), args.index, keys=args.subreddits, corpus_dir=args.corpus,
+                 steps=args.steps)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,81 @@
 import json
 import os
 import os.path as op
+import threading
+from collections import namedtuple
+
+# an API key of the .env, e.g. CLIENT_0=client_id:client_secret
+Credentials = namedtuple('Credentials', 'client_id client_secret')
+
+_settings = None
+
+
+class Settings(object):
+    """Project paths and .env values, resolved once per process.
+
+    The base directory is found on first use and memoized. The .env is parsed once and parsed again
+    only when its modification time or size changes, which costs a single stat per lookup.
+
+    Attributes:
+        base_dir (str): The project directory, holding src and data.
+    """
+
+    def __init__(self, base_dir=None):
+        self._base_dir = base_dir
+        self._env = None
+        self._env_stamp = None
+        self._lock = threading.Lock()
+
+    @property
+    def base_dir(self):
+        if self._base_dir is None:
+            self._base_dir = _base_dir(path=op.dirname(op.abspath(__file__)), frame=0)
+        return self._base_dir
+
+    @property
+    def env_path(self):
+        return op.join(self.base_dir, '.env')
+
+    def env(self):
+        """Return the variables of the .env as a dictionary, or None if there is no .env."""
+        try:
+            stat = os.stat(self.env_path)
+        except OSError:
+            return None
+        stamp = stat.st_mtime_ns, stat.st_size
+        with self._lock:
+            if stamp != self._env_stamp:
+                self._env, self._env_stamp = parse_env(self.env_path), stamp
+            return self._env
+
+    def credentials(self):
+        """Return the API keys of the .env, in the order they are listed.
+
+        Returns:
+            credentials: list(Credentials)
+        """
+        credentials = []
+        for key, value in (self.env() or {}).items():
+            if not key.startswith('CLIENT'):
+                continue
+            if ':' not in value:
+                raise ValueError('{key} in .env should be of the form client_id:client_secret.'.format(key=key))
+            credentials.append(Credentials(*value.split(':', 1)))
+        return credentials
+
+
+def get_settings():
+    """Return the settings of this process, created on first use."""
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
 
 
 def load_env():
     """Load the .env in the base directory as a dictionary."""
-    env_path = op.join(base_dir(), '.env')
-    if op.exists(env_path):
-        vars = parse_env(env_path)
-        return vars
-    return None
+    env = get_settings().env()
+    return dict(env) if env is not None else None
 
 
 def parse_env(path):
@@ -30,26 +96,20 @@ def parse_env(path):
 
 def env_var(var):
     """Grab an environment variable without case sensitivity, by key."""
-    env = load_env()
+    env = get_settings().env() or {}
     for key, value in env.items():
         if var.lower() in key.lower():
-            return env[key]
+            return value
 
 
 def parse_client_ids():
     """Parse .env and return a list of client ids and client keys.
 
     Returns:
-        client_ids: list(tuple)
+        client_ids: list(Credentials)
             List of (client_id, client_secret)
     """
-    client_ids = []
-    env = load_env()
-    for key in env.keys():
-        if key.startswith('CLIENT'):
-            client_id = tuple(env[key].split(':'))
-            client_ids.append(client_id)
-    return client_ids
+    return get_settings().credentials()
 
 
 def strip_unwanted_chars(s):
@@ -63,8 +123,7 @@ def strip_unwanted_chars(s):
 
 def base_dir():
     """Return the base directory for the project. Assumes the DS cookiecutter template."""
-    path = os.path.dirname(os.path.abspath(__file__))
-    return _base_dir(path=path, frame=0)
+    return get_settings().base_dir
 
 
 def _base_dir(path, frame):
@@ -98,6 +157,12 @@ def data_dir(subdir=''):
     return op.join(data_dir, subdir) if subdir else data_dir
 
 
+def models_dir(subdir=''):
+    """Return the full path of the models directory, or a subdirectory of it."""
+    path = op.join(base_dir(), 'models')
+    return op.join(path, subdir) if subdir else path
+
+
 def data_dir_file(file_name, subdir=''):
     """Return the file path to a specified data subdirectory. Creates subdirectory if does not exist."""
     if not subdir:
@@ -108,6 +173,30 @@ def data_dir_file(file_name, subdir=''):
     return op.join(dirname, file_name)
 
 
+def create_directories(paths):
+    """Create directories and their missing parents in one pass.
+
+    Every distinct directory costs at most one mkdir, however many paths share it.
+
+    Returns:
+        n_created: int
+    """
+    n_created, known = 0, set()
+    for path in sorted(set(op.abspath(p) for p in paths)):
+        missing = []
+        while path not in known and op.dirname(path) != path:
+            missing.append(path)
+            path = op.dirname(path)
+        for directory in reversed(missing):
+            try:
+                os.mkdir(directory)
+                n_created += 1
+            except FileExistsError:
+                pass
+            known.add(directory)
+    return n_created
+
+
 def data_dir_subreddit(*args, raw_data_dirname='reddit_raw'):
     """Return the subreddit data directory.
 
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from subreddit_recommender.src.models.ann_index import AnnIndex, recall_at_k
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = np.random.RandomState(0)
+    keys = [('Cat{c}'.format(c=i % 3), 'Sub{s}'.format(s=i % 5), '/r/sub{i}'.format(i=i)) for i in range(500)]
+    return AnnIndex.build(keys, rng.randn(500, 32), n_tables=8, n_bits=6)
+
+
+def test_query_matches_exact_search(index):
+    neighbours = index.similar(('Cat1', 'Sub1', '/r/sub1'), k=5, exact=True)
+    assert 5 == len(neighbours)
+    assert ('Cat1', 'Sub1', 'sub1') not in [key for key, _ in neighbours]
+    scores = [score for _, score in neighbours]
+    assert sorted(scores, reverse=True) == scores
+
+    similarities = index.vectors.dot(index.vector('Cat1/Sub1/sub1'))
+    similarities[index.row('Cat1/Sub1/sub1')] = -np.inf
+    np.testing.assert_allclose(np.sort(similarities)[::-1][:5], scores, rtol=1e-5)
+
+
+def test_recall_grows_with_probes(index):
+    queries = np.asarray(index.vectors[:50]) + 0.1
+    low = recall_at_k(index, queries, k=10, n_probes=0)
+    high = recall_at_k(index, queries, k=10, n_probes=4)
+    assert low <= high
+    assert high > 0.8
+
+
+def test_filters(index):
+    results = index.query_batch(index.vectors[:3], k=4, category='Cat2', exclude=[('Cat2', 'Sub2', '/r/sub2')])
+    for neighbours in results:
+        assert 4 == len(neighbours)
+        assert all(key[0] == 'Cat2' and key[2] != 'sub2' for key, _ in neighbours)
+    assert all(key[1] == 'Sub3' for key, _ in index.query(index.vectors[0], k=5, subcategory='Sub3'))
+
+
+def test_save_and_mmap_load(index, tmpdir):
+    index.save(str(tmpdir))
+    loaded = AnnIndex.load(str(tmpdir))
+    assert isinstance(loaded.vectors, np.memmap)
+    assert index.query(index.vectors[7], k=5) == loaded.query(loaded.vectors[7], k=5)
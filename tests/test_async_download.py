@@ -0,0 +1,104 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from subreddit_recommender.src.data.async_download import (RedditSession,
+                                                           TokenBucket,
+                                                           fetch_subreddit)
+
+
+class FakeSubmission(object):
+    def __init__(self, id_, title):
+        self.id = id_
+        self.title = title
+
+
+class FakeSubreddit(object):
+    description = 'about cats'
+
+    def top(self, limit):
+        return [FakeSubmission(str(i), 'post {i}'.format(i=i)) for i in range(limit)]
+
+
+class FakeReddit(object):
+    def subreddit(self, name):
+        return FakeSubreddit()
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_token_bucket_limits_rate():
+    async def acquire_all():
+        bucket = TokenBucket(rate=100, capacity=2)
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        for _ in range(6):
+            await bucket.acquire()
+        return loop.time() - t0
+
+    # 2 tokens are free, the remaining 4 take at least 4 / 100 seconds
+    assert run(acquire_all()) >= 0.035
+
+
+def test_token_bucket_invalid():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, capacity=1)
+
+
+def test_fetch_subreddit(monkeypatch):
+    monkeypatch.setattr('subreddit_recommender.src.data.async_download.submission_text',
+                        lambda submission, depth, budget: submission.title)
+
+    async def fetch():
+        session = RedditSession(FakeReddit(), concurrency=2, rate=1000, burst=10)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            return await fetch_subreddit(session, executor, 'cats', top_n_submissions=3, comment_depth=1)
+
+    description, submission_ids, submissions = run(fetch())
+    assert 'about cats' == description
+    assert ['0', '1', '2'] == submission_ids
+    assert ['post 0', 'post 1', 'post 2'] == submissions
+
+
+class FakeRequestor(object):
+    def __init__(self):
+        self.n_requests = 0
+
+    def request(self, method, url):
+        self.n_requests += 1
+
+
+class RequestingReddit(object):
+    """Exposes a requestor where praw keeps it."""
+
+    def __init__(self):
+        self.requestor = FakeRequestor()
+        authenticator = type('Authenticator', (object,), {'_requestor': self.requestor})
+        authorizer = type('Authorizer', (object,), {'_authenticator': authenticator})
+        self._core = type('Core', (object,), {'_authorizer': authorizer})
+
+
+def test_every_request_takes_a_token():
+    reddit = RequestingReddit()
+
+    def three_requests():
+        for _ in range(3):
+            reddit.requestor.request('GET', '/r/cats/top')
+
+    async def call_twice():
+        session = RedditSession(reddit, concurrency=2, rate=0.01, burst=10)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            for _ in range(2):
+                await session.call(executor, three_requests)
+        return session
+
+    session = run(call_twice())
+    assert 6 == reddit.requestor.n_requests
+    assert 4 == round(session._bucket._tokens)
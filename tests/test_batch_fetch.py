@@ -0,0 +1,61 @@
+import praw
+
+from subreddit_recommender.src.data.batch_fetch import (download_reddit_data_batched,
+                                                        fetch_submissions_by_fullname)
+from subreddit_recommender.src.data.corpus_store import CorpusReader, CorpusWriter
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+from subreddit_recommender.src.data.manifest import COMPLETE, FAILED, Manifest
+
+
+def test_fetch_submissions_by_fullname():
+    with FakeRedditServer(['cats', 'dogs'], n_submissions=60) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        fullnames = ['t3_' + server.submission_id(sub, i) for sub in ['cats', 'dogs'] for i in range(60)]
+        submissions = fetch_submissions_by_fullname(reddit, fullnames)
+        assert sorted(fullnames) == sorted(submissions)
+        assert 2 == server.requests['/api/info']
+
+
+def test_refresh_lists_new_top_submissions(tmpdir):
+    subreddit_tuples = [('Animals', 'Pets', '/r/cats'), ('Animals', 'Pets', '/r/dogs')]
+    with FakeRedditServer(['cats', 'dogs'], n_submissions=6, top_level_comments=4) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        manifest = Manifest.in_directory(str(tmpdir))
+
+        def refresh():
+            with CorpusWriter(str(tmpdir.join('packed'))) as corpus_writer:
+                return download_reddit_data_batched(subreddit_tuples, [reddit], top_n_submissions=3, comment_depth=2,
+                                                    max_in_flight=4, manifest=manifest, corpus_writer=corpus_writer,
+                                                    verbose=0)
+
+        def cats_ids():
+            return manifest.get(subreddit_tuples[0])['submission_ids']
+
+        assert 2 == refresh()
+        assert COMPLETE == manifest.get(subreddit_tuples[0])['status']
+        assert [server.submission_id('cats', i) for i in range(3)] == cats_ids()
+
+        # newly popular submissions replace the old top posts
+        server.set_top_submissions('cats', [5, 0, 4])
+        server.reset_stats()
+        assert 2 == refresh()
+        assert 2 == server.requests['/r/{subreddit}/top']
+        assert 0 == server.requests['/api/info']
+        assert [server.submission_id('cats', i) for i in [5, 0, 4]] == cats_ids()
+
+        reader = CorpusReader(str(tmpdir.join('packed')))
+        assert 2 == len(reader.subreddits())
+        reader.close()
+
+
+def test_download_batched_records_failed_subreddits(tmpdir):
+    subreddit_tuples = [('Animals', 'Pets', '/r/cats'), ('Animals', 'Pets', '/r/private'),
+                        ('Animals', 'Pets', '/r/dogs')]
+    with FakeRedditServer(['cats', 'dogs'], n_submissions=2, top_level_comments=2) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        manifest = Manifest.in_directory(str(tmpdir))
+        with CorpusWriter(str(tmpdir.join('packed'))) as corpus_writer:
+            n = download_reddit_data_batched(subreddit_tuples, [reddit], top_n_submissions=2, comment_depth=1,
+                                             manifest=manifest, corpus_writer=corpus_writer, verbose=0)
+        assert 2 == n
+        assert [COMPLETE, FAILED, COMPLETE] == [manifest.get(t)['status'] for t in subreddit_tuples]
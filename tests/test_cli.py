@@ -0,0 +1,69 @@
+import importlib.util
+import subprocess
+import sys
+
+import pytest
+
+from subreddit_recommender.src import cli
+
+
+def _loaded_after(statement):
+    code = 'import sys; {statement}; print(" ".join(sorted(sys.modules)))'.format(statement=statement)
+    return set(subprocess.check_output([sys.executable, '-c', code]).decode().split())
+
+
+def test_every_stage_has_a_module():
+    for command, stages in cli.COMMANDS.items():
+        for stage in stages:
+            args = [stage] if stage else []
+            module_name, prog, rest = cli.resolve(command, args + ['--flag'])
+            assert ['--flag'] == rest
+            assert prog.startswith('subreddit_recommender {command}'.format(command=command))
+            assert importlib.util.find_spec(module_name) is not None
+
+
+def test_resolve_requires_a_stage():
+    assert ('subreddit_recommender.src.data.download_reddit_data', 'subreddit_recommender crawl', ['--resume']) == \
+        cli.resolve('crawl', ['--resume'])
+    with pytest.raises(SystemExit):
+        cli.resolve('features', ['--incremental'])
+
+
+def test_heavy_packages_are_imported_lazily():
+    loaded = _loaded_after('import subreddit_recommender.src.cli')
+    assert not loaded & {'numpy', 'praw', 'requests', 'bs4', 'scipy'}
+
+    loaded = _loaded_after('import subreddit_recommender.src.data.download_reddit_data')
+    assert 'praw' in loaded
+    assert not loaded & {'bs4', 'scipy', 'sklearn'}
+
+
+def test_main_runs_stage(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    with pytest.raises(SystemExit) as exc:
+        cli.main(['--profile-imports', 'crawl', 'merge', '-h'])
+    assert 0 == exc.value.code
+    out, err = capsys.readouterr()
+    assert out.startswith('usage: subreddit_recommender crawl merge')
+    assert err.startswith('Imports took')
+
+
+def test_imports_are_only_hooked_when_profiling(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['test'])
+    monkeypatch.setattr(cli, 'ImportProfiler', None)
+    with pytest.raises(SystemExit):
+        cli.main(['crawl', 'merge', '-h'])
+    out, err = capsys.readouterr()
+    assert out.startswith('usage: subreddit_recommender crawl merge')
+    assert '' == err
+
+
+def test_import_profiler(tmpdir, monkeypatch):
+    tmpdir.join('profiled_outer.py').write('import profiled_inner\n')
+    tmpdir.join('profiled_inner.py').write('import time\ntime.sleep(0.05)\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    with cli.ImportProfiler() as profiler:
+        __import__('profiled_outer')
+    assert profiler.times['profiled_inner'] >= 0.05
+    assert profiler.times['profiled_outer'] < 0.05
+    assert 'profiled_inner' in profiler.report().splitlines()[1]
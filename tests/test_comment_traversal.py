@@ -0,0 +1,69 @@
+import praw
+import pytest
+
+from subreddit_recommender.src.data.comment_traversal import (RequestBudget,
+                                                              iter_comment_chains)
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+
+
+@pytest.fixture(scope='module')
+def server():
+    # 6 top level comments, 4 shown. 3 replies per comment, 1 shown.
+    with FakeRedditServer(['cats'], n_submissions=1, top_level_comments=6, initial_top_level=4,
+                          replies_per_comment=3, initial_replies=1, reply_depth=1) as server:
+        yield server
+
+
+def load_comments(server):
+    reddit = praw.Reddit(**server.praw_config())
+    submission = reddit.submission(server.submission_id('cats', 0))
+    return submission.comments
+
+
+def test_request_budget():
+    subreddit = RequestBudget(3)
+    submission = subreddit.child(2)
+    assert submission.spend() and submission.spend()
+    assert not submission.spend()
+    assert 1 == subreddit.remaining
+
+    other = subreddit.child(5)
+    assert other.spend()
+    assert not other.spend()
+    assert 0 == other.remaining
+
+
+def test_unlimited_budget_fills_depth(server):
+    comments = load_comments(server)
+    server.reset_stats()
+    chains = list(iter_comment_chains(comments, depth=2, max_comments=100))
+
+    assert 6 == len(chains)
+    assert all(3 == len(chain.split('\n')) for chain in chains)
+
+
+def test_no_expansion_when_depth_satisfied(server):
+    comments = load_comments(server)
+    server.reset_stats()
+    chains = list(iter_comment_chains(comments, depth=1, max_comments=4, budget=RequestBudget(10)))
+
+    assert 4 == len(chains)
+    assert 0 == server.n_requests
+
+
+def test_budget_caps_expansions(server):
+    comments = load_comments(server)
+    server.reset_stats()
+    budget = RequestBudget(2)
+    chains = list(iter_comment_chains(comments, depth=2, max_comments=100, budget=budget))
+
+    assert 2 == server.requests['/api/morechildren'] == budget.spent
+    assert 4 == len(chains)
+
+
+def test_chains_are_lazy(server):
+    comments = load_comments(server)
+    server.reset_stats()
+    chains = iter_comment_chains(comments, depth=2, budget=RequestBudget(10))
+    next(chains)
+    assert 1 == server.requests['/api/morechildren']
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from subreddit_recommender.src.data.corpus_store import CorpusWriter
+from subreddit_recommender.src.features import corpus as corpus_module
+from subreddit_recommender.src.features.corpus import Sentences, SubredditCorpus, tokenize
+
+
+def test_tokenize():
+    assert ['les', 'chats', 'noirs', 'кошки', '42'] == tokenize('Les chats-noirs, КОШКИ! 42')
+
+
+def test_subreddit_corpus_is_restartable(tmpdir):
+    tmpdir.join('A', 'B', 'cats', 'description').write_text('All about cats', encoding='utf-8', ensure=True)
+    tmpdir.join('A', 'B', 'cats', 'sub_0').write_text('**Cats** are great\nMeow meow', encoding='utf-8', ensure=True)
+    tmpdir.join('A', 'C', 'dogs', 'sub_0').write_text('Woof', encoding='utf-8', ensure=True)
+
+    corpus = SubredditCorpus(str(tmpdir))
+    documents = list(corpus)
+    assert documents == list(corpus)
+    assert 3 == len(documents)
+    assert ['cats', 'are', 'great', 'meow', 'meow'] == documents[1].words
+    assert ['A/B/cats', 'category:A', 'subcategory:B'] == documents[1].tags
+
+    corpus = SubredditCorpus(str(tmpdir), include_descriptions=False, tag_categories=False, subreddits={'A/C/dogs'})
+    assert [(['woof'], ['A/C/dogs'])] == list(corpus)
+    assert [['woof']] == list(Sentences(corpus))
+
+
+def test_long_documents_are_split(tmpdir, monkeypatch):
+    monkeypatch.setattr(corpus_module, 'MAX_DOCUMENT_WORDS', 4)
+    with CorpusWriter(str(tmpdir)) as writer:
+        writer.add(('A', 'B', 'cats'), 'sub_0', ' '.join(['meow'] * 10))
+    assert [4, 4, 2] == [len(d.words) for d in SubredditCorpus(str(tmpdir))]
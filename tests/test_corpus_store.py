@@ -0,0 +1,96 @@
+import os
+import os.path as op
+
+import pytest
+
+from subreddit_recommender.src.data.corpus_store import (INDEX_FILENAME,
+                                                         CorpusReader,
+                                                         CorpusWriter,
+                                                         convert_raw_tree)
+
+CATS = ('Animals', 'Cats', 'cats')
+DOGS = ('Animals', 'Dogs', 'dogs')
+
+
+@pytest.fixture
+def store_dir(tmpdir):
+    return op.join(str(tmpdir), 'packed')
+
+
+def test_write_and_read(store_dir):
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(CATS, 'all about cats', ['first post', u'caf\xe9 post'])
+        writer.add_subreddit(DOGS, '', ['woof'])
+
+    with CorpusReader(store_dir) as reader:
+        assert ['Animals/Cats/cats', 'Animals/Dogs/dogs'] == reader.subreddits()
+        assert ['description', 'sub_0', 'sub_1'] == reader.documents(CATS)
+        assert b'first post' == reader.get(CATS, 'sub_0').tobytes()
+        assert u'caf\xe9 post' == reader.text(CATS, 'sub_1')
+        assert '' == reader.text(DOGS, 'description')
+        assert 5 == len(list(reader.iter_documents()))
+        with pytest.raises(KeyError):
+            reader.get(CATS, 'sub_2')
+
+
+def test_readd_replaces_documents(store_dir):
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(CATS, 'old', ['a', 'b', 'c'])
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(CATS, 'new', ['d'])
+
+    with CorpusReader(store_dir) as reader:
+        assert ['description', 'sub_0'] == reader.documents(CATS)
+        assert 'new' == reader.text(CATS, 'description')
+
+
+def test_reset_subreddits_are_not_counted(store_dir):
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(CATS, 'cats', ['meow'])
+        writer.add_subreddit(DOGS, 'dogs', ['woof'])
+        writer.reset(DOGS)
+
+    with CorpusReader(store_dir) as reader:
+        assert 1 == len(reader) == len(reader.subreddits())
+        assert CATS in reader
+        assert DOGS not in reader
+
+
+def test_append_after_partial_index_line(store_dir):
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(CATS, 'cats', ['meow'])
+    with open(op.join(store_dir, INDEX_FILENAME), 'a') as file:
+        file.write('{"key": "Animals/Dogs/do')
+    with CorpusWriter(store_dir) as writer:
+        writer.add_subreddit(DOGS, 'dogs', ['woof'])
+
+    with CorpusReader(store_dir) as reader:
+        assert ['Animals/Cats/cats', 'Animals/Dogs/dogs'] == reader.subreddits()
+        assert ['description', 'sub_0'] == reader.documents(DOGS)
+
+
+def test_shards_roll_over(store_dir):
+    with CorpusWriter(store_dir, shard_size=10) as writer:
+        writer.add_subreddit(CATS, 'x' * 20, ['y' * 20, 'z' * 20])
+
+    assert 3 == len([name for name in os.listdir(store_dir) if name.endswith('.bin')])
+    with CorpusReader(store_dir) as reader:
+        assert 'z' * 20 == reader.text(CATS, 'sub_1')
+
+
+def test_convert_raw_tree(tmpdir, store_dir):
+    raw_dir = op.join(str(tmpdir), 'reddit_raw')
+    subreddit_dir = op.join(raw_dir, *CATS)
+    os.makedirs(subreddit_dir)
+    os.makedirs(op.join(raw_dir, *DOGS))  # not downloaded yet
+    for name, text in [('description', 'about'), ('sub_0', 'zero'), ('sub_10', 'ten'), ('sub_2', 'two')]:
+        with open(op.join(subreddit_dir, name), 'w') as file:
+            file.write(text)
+    with open(op.join(raw_dir, 'manifest.jsonl'), 'w') as file:
+        file.write('')
+
+    assert 1 == convert_raw_tree(raw_dir, store_dir, verbose=0)
+    with CorpusReader(store_dir) as reader:
+        assert ['description', 'sub_0', 'sub_2', 'sub_10'] == reader.documents(CATS)
+        assert 'ten' == reader.text(CATS, 'sub_10')
+        assert DOGS not in reader
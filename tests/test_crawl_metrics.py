@@ -0,0 +1,62 @@
+import json
+import os.path as op
+
+import praw
+
+from subreddit_recommender.src.data.crawl_metrics import (JSON_FILENAME,
+                                                          PROMETHEUS_FILENAME,
+                                                          CrawlMetrics,
+                                                          Histogram,
+                                                          endpoint_kind,
+                                                          instrument_reddit)
+from subreddit_recommender.src.data.download_reddit_data import submission_text
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(0.1, 1.0))
+    for value in [0.05, 0.05, 0.5, 5.0]:
+        histogram.observe(value)
+    assert [('0.1', 2), ('1.0', 3), ('+Inf', 4)] == histogram.cumulative_counts()
+    assert 0.1 == histogram.quantile(0.5)
+    assert 1.0 == histogram.quantile(0.99)
+    assert Histogram().quantile(0.5) is None
+
+
+def test_endpoint_kind():
+    assert 'morechildren' == endpoint_kind('https://oauth.reddit.com/api/morechildren/')
+    assert 'comments' == endpoint_kind('https://oauth.reddit.com/comments/abc/')
+    assert 'listing' == endpoint_kind('https://oauth.reddit.com/r/cats/top')
+    assert 'auth' == endpoint_kind('https://www.reddit.com/api/v1/access_token')
+
+
+def test_instrument_reddit(tmpdir):
+    metrics = CrawlMetrics()
+    with FakeRedditServer(['cats'], n_submissions=2, top_level_comments=4, initial_top_level=2) as server:
+        reddit = instrument_reddit(praw.Reddit(**server.praw_config()), metrics, credential=0)
+        with metrics.worker(7):
+            submission = list(reddit.subreddit('cats').top(limit=2))[0]
+            submission_text(submission, comment_depth=2)
+            with metrics.writing():
+                pass
+        n_requests = server.n_requests
+
+    snapshot = metrics.snapshot()
+    assert n_requests == snapshot['requests']
+    assert snapshot['replace_more_expansions'] >= 1
+    assert snapshot['bytes'] > 0
+    assert 1 == snapshot['writes']
+    assert {('7', '0')} == {(s['worker'], s['credential']) for s in snapshot['series']}
+
+    metrics.export(str(tmpdir))
+    with open(op.join(str(tmpdir), JSON_FILENAME), 'r') as file:
+        assert n_requests == json.load(file)['requests']
+    with open(op.join(str(tmpdir), PROMETHEUS_FILENAME), 'r') as file:
+        prometheus = file.read()
+    line = 'crawler_requests_total{{worker="7",credential="0"}} {n}'.format(n=n_requests)
+    assert line in prometheus.splitlines()
+    assert 'le="+Inf"' in prometheus
+    assert 1 == prometheus.count('# TYPE crawler_request_latency_seconds histogram')
+    line = 'crawler_request_latency_seconds_count{{worker="7",credential="0"}} {n}'.format(n=n_requests)
+    assert line in prometheus.splitlines()
+    assert 'Credential 0' in metrics.summary()
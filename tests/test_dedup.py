@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+import json
+import os.path as op
+
+from subreddit_recommender.src.data.corpus_store import CorpusReader, CorpusWriter
+from subreddit_recommender.src.data.dedup import (DOWNWEIGHT, REPORT_FILENAME,
+                                                  NearDuplicateIndex,
+                                                  deduplicate_corpus)
+
+BOT = 'i am a bot and this action was performed automatically please contact the moderators'
+
+
+def test_near_duplicate_index():
+    index = NearDuplicateIndex(threshold=0.7)
+    assert not index.add(BOT)
+    assert index.add(BOT + ' today')
+    assert not index.add('cats are the best pets anyone could ever ask for in this world')
+    assert not index.add('ok')
+    assert index.add('ok')
+    assert not index.add(BOT, scope='A/B/dogs')
+
+
+def test_deduplicate_corpus(tmpdir):
+    source, out = str(tmpdir.join('raw')), str(tmpdir.join('deduped'))
+    with CorpusWriter(source) as writer:
+        cats = ['Cats purr when they are happy and warm\n' + BOT, 'Black cats are lucky in some countries\n' + BOT]
+        writer.add_subreddit(('A', 'B', 'cats'), BOT, cats)
+        writer.add_subreddit(('A', 'B', 'dogs'), BOT, ['Dogs bark at the mail carrier every day\n' + BOT.upper()])
+
+    report = deduplicate_corpus(source, out, verbose=0)
+    assert 2 == report['n_lines_dropped']
+    with CorpusReader(out) as reader:
+        assert BOT == reader.text('A/B/cats', 'description')
+        assert BOT in reader.text('A/B/cats', 'sub_0')
+        assert BOT not in reader.text('A/B/cats', 'sub_1')
+        assert 'dogs bark at the mail carrier every day' == reader.text('A/B/dogs', 'sub_0')
+    with open(op.join(out, REPORT_FILENAME), 'r') as file:
+        assert [['A/B/cats', 1], ['A/B/dogs', 1]] == sorted(json.load(file)['most_dropped'])
+
+    report = deduplicate_corpus(source, str(tmpdir.join('downweighted')), mode=DOWNWEIGHT, verbose=0)
+    assert 1 == report['n_lines_dropped']
+
+
+def test_deduplicate_corpus_interleaved_documents(tmpdir):
+    source, out = str(tmpdir.join('raw')), str(tmpdir.join('deduped'))
+    with CorpusWriter(source) as writer:
+        writer.add(('A', 'B', 'cats'), 'sub_0', 'cats purr when they are happy')
+        writer.add(('A', 'B', 'dogs'), 'sub_0', 'dogs bark at the mail carrier')
+        writer.add(('A', 'B', 'cats'), 'sub_1', 'black cats are lucky in some countries')
+
+    deduplicate_corpus(source, out, verbose=0)
+    with CorpusReader(out) as reader:
+        assert ['sub_0', 'sub_1'] == reader.documents('A/B/cats')
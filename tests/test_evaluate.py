@@ -0,0 +1,57 @@
+import json
+
+import numpy as np
+
+from subreddit_recommender.src.models.evaluate import (EXACT, Labels,
+                                                       compare_runs, evaluate,
+                                                       lsh_variant,
+                                                       ranking_metrics)
+
+
+def clustered_vectors(keys, noise, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = {}
+    vectors = []
+    for key in keys:
+        subcategory = tuple(key.split('/')[:2])
+        center = centers.setdefault(subcategory, rng.randn(16))
+        vectors.append(center + noise * rng.randn(16))
+    return np.array(vectors)
+
+
+def test_labels_and_ranking_metrics():
+    keys = ['A/x/cats', 'A/x/dogs', 'A/x/fish', 'A/y/cats', 'A/y/birds', 'B/z/lonely']
+    labels = Labels(keys)
+    assert [2, 2, 2, 1, 1, 0] == labels.n_relevant.tolist()
+    assert [0, 1, 2, 3, 4] == labels.query_rows().tolist()
+    assert ['A/x/cats', 'A/y/cats'] == labels.excluded(3)
+
+    assert (1.0, 1.0) == ranking_metrics(0, [1, 2, 4], labels, k=3)
+    assert (0.5, 0.5) == ranking_metrics(0, [4, 1, 5], labels, k=3)
+    assert (0.0, 0.0) == ranking_metrics(3, [0, 1, 2], labels, k=3)
+
+    listed = Labels(keys, subreddit_tuples=[('A', 'x', '/r/cats'), ('A', 'x', 'dogs')])
+    assert [1, 1, 0, 0, 0, 0] == listed.n_relevant.tolist()
+    assert [3, 4, 4, 3, 4, 0] == Labels(keys, level='category').n_relevant.tolist()
+
+
+def test_evaluate_prefers_clustered_vectors():
+    keys = ['Cat{c}/Sub{s}/sub{i}'.format(c=i % 2, s=i % 6, i=i) for i in range(120)]
+    sources = {'clustered': (keys, clustered_vectors(keys, noise=0.3)),
+               'random': (keys, np.random.RandomState(1).randn(120, 16))}
+    run = evaluate(sources, variants=[EXACT, lsh_variant(4, 6, 2)], k=5, max_queries=50, batch_size=16, verbose=0)
+
+    results = {(r['model'], r['variant']): r for r in run['results']}
+    assert 4 == len(results)
+    clustered, random = results[('clustered', 'exact')], results[('random', 'exact')]
+    assert clustered['recall_at_k'] > 0.95 and clustered['mrr'] > 0.95
+    assert clustered['recall_at_k'] > random['recall_at_k'] + 0.3
+    assert 50 == clustered['n_queries']
+    lsh = results[('clustered', 'lsh-t4-b6-p2')]
+    assert lsh['index_bytes'] > clustered['index_bytes']
+    assert lsh['single_p50_s'] <= lsh['single_p99_s']
+
+    baseline = json.loads(json.dumps(run))
+    lines = compare_runs(run, baseline)
+    assert 4 == len(lines)
+    assert 'recall +0.000' in lines[0]
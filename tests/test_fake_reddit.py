@@ -0,0 +1,42 @@
+import praw
+
+from subreddit_recommender.src.data.benchmark_download import run_benchmark
+from subreddit_recommender.src.data.download_reddit_data import submission_text
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+
+
+def test_fake_reddit_serves_praw():
+    with FakeRedditServer(['/r/cats'], n_submissions=3, top_level_comments=4, initial_top_level=2) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        subreddit = reddit.subreddit('cats')
+        assert subreddit.description
+
+        submissions = list(subreddit.top(limit=10))
+        assert ['1000', '1001', '1002'] == [s.id for s in submissions]
+
+        # title + 4 top level comments with 2 replies each. 2 of the comments are behind a "more" object
+        text = submission_text(submissions[0], comment_depth=2)
+        assert 1 + 4 * 3 == len(text.split('\n'))
+        assert 1 <= server.requests['/api/morechildren']
+        assert [200] == list(server.status_codes)
+
+
+def test_fake_reddit_errors():
+    with FakeRedditServer(['cats'], error_rate=1.0) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        try:
+            reddit.subreddit('cats').description
+        except Exception:
+            pass
+        assert 0 < server.status_codes[429]
+
+
+def test_run_benchmark():
+    configs = [('thread-2', 'thread', {'n_threads': 2}), ('async-c2', 'async', {'concurrency': 2})]
+    results = run_benchmark(configs, n_subreddits=3, top_n_submissions=2, verbose=0, top_level_comments=3)
+    for result in results.values():
+        assert 3 == result['n_complete']
+        assert result['requests_per_subreddit'] > 0
+        assert result['latency_p50_s'] <= result['latency_p99_s']
+        assert result['replace_more_expansions'] > 0
+        assert result['write_s'] > 0
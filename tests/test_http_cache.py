@@ -0,0 +1,128 @@
+import os
+import os.path as op
+
+import pytest
+import requests
+
+from subreddit_recommender.src.data.download_reddit_data import open_reddit_instance
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+from subreddit_recommender.src.data.http_cache import (LOW_WATER_MARK, READ_THROUGH, RECORD,
+                                                       REPLAY, CacheMissError,
+                                                       CachingRequestor,
+                                                       ResponseCache,
+                                                       request_key)
+
+
+class FakeSession(object):
+    """Stands in for requests.Session, counting the requests that reach the network."""
+
+    def __init__(self):
+        self.headers = {}
+        self.n_requests = 0
+        self.status_code = 200
+
+    def request(self, method, url, **kwargs):
+        self.n_requests += 1
+        response = requests.Response()
+        response.status_code = self.status_code
+        response.url = url
+        response.headers['x-ratelimit-remaining'] = '10'
+        response._content = '{{"url": "{url}", "n": {n}}}'.format(url=url, n=self.n_requests).encode('utf-8')
+        return response
+
+
+def make_requestor(tmpdir, mode, **kwargs):
+    return CachingRequestor(user_agent='subreddit_recommender tests', session=FakeSession(),
+                            cache_dir=op.join(str(tmpdir), 'cache'), mode=mode, **kwargs)
+
+
+def test_request_key_ignores_param_order():
+    key = request_key('get', '/r/cats', params={'a': 1, 'b': 2})
+    assert key == request_key('GET', '/r/cats', params=[('b', 2), ('a', 1)])
+    assert request_key('get', '/r/cats') != request_key('get', '/r/dogs')
+
+
+def test_read_through(tmpdir):
+    requestor = make_requestor(tmpdir, READ_THROUGH)
+    first = requestor.request('get', 'https://oauth.reddit.com/r/cats/about', params={'raw_json': 1})
+    second = requestor.request('get', 'https://oauth.reddit.com/r/cats/about', params={'raw_json': 1})
+
+    assert 1 == requestor._http.n_requests
+    assert first.json() == second.json()
+    assert 'x-ratelimit-remaining' not in second.headers
+    assert (1, 1) == (requestor.hits, requestor.misses)
+
+
+def test_record_then_replay(tmpdir):
+    recorder = make_requestor(tmpdir, RECORD)
+    recorder.request('get', 'https://oauth.reddit.com/r/cats/top')
+    recorder.request('get', 'https://oauth.reddit.com/r/cats/top')
+    assert 2 == recorder._http.n_requests
+
+    replayer = make_requestor(tmpdir, REPLAY)
+    assert 2 == replayer.request('get', 'https://oauth.reddit.com/r/cats/top').json()['n']
+    assert 0 == replayer._http.n_requests
+    with pytest.raises(CacheMissError):
+        replayer.request('get', 'https://oauth.reddit.com/r/dogs/top')
+
+
+def test_tokens_and_errors_are_not_cached(tmpdir):
+    requestor = make_requestor(tmpdir, READ_THROUGH)
+    token_url = 'https://www.reddit.com/api/v1/access_token'
+    for _ in range(2):
+        requestor.request('post', token_url, data={'grant_type': 'client_credentials'})
+        requestor.request('post', 'https://oauth.reddit.com/api/comment', data={'text': 'hi'})
+    assert 4 == requestor._http.n_requests
+    assert 0 == requestor.cache.size
+
+    requestor._http.status_code = 403
+    requestor.request('get', 'https://oauth.reddit.com/r/private/about')
+    assert 0 == requestor.cache.size
+
+    replayer = make_requestor(tmpdir, REPLAY)
+    assert 'replay' == replayer.request('post', token_url, data={'grant_type': 'client_credentials'}).json()[
+        'access_token']
+    assert 0 == replayer._http.n_requests
+    with pytest.raises(CacheMissError):
+        replayer.request('post', 'https://oauth.reddit.com/api/comment', data={'text': 'hi'})
+
+
+def test_invalid_mode(tmpdir):
+    with pytest.raises(ValueError):
+        make_requestor(tmpdir, 'sometimes')
+
+
+def test_eviction(tmpdir):
+    cache = ResponseCache(op.join(str(tmpdir), 'cache'), max_bytes=1000)
+    session = FakeSession()
+    for i in range(20):
+        size = cache.size
+        cache.put('{i:064d}'.format(i=i), session.request('get', 'https://oauth.reddit.com/{i}'.format(i=i)))
+        if cache.size < size:
+            # evicted down to the low water mark, not just below max_bytes
+            assert cache.size <= LOW_WATER_MARK * 1000
+        if i > 0:
+            assert cache.get('{i:064d}'.format(i=1)) is not None  # keeps 1 recently used
+
+    assert cache.size <= 1000
+    assert cache.get('{i:064d}'.format(i=19)) is not None
+    assert cache.get('{i:064d}'.format(i=1)) is not None
+    assert cache.get('{i:064d}'.format(i=0)) is None
+    assert cache.size == ResponseCache(cache.cache_dir, max_bytes=1000).size
+
+
+def test_replay_crawl_offline(tmpdir):
+    cache_dir = op.join(str(tmpdir), 'cache')
+    with FakeRedditServer(['cats'], n_submissions=3) as server:
+        config = server.praw_config()
+        credentials = config.pop('client_id'), config.pop('client_secret')
+        config.pop('user_agent')
+        reddit = open_reddit_instance(credentials, http_cache=RECORD, http_cache_dir=cache_dir, **config)
+        recorded = [s.id for s in reddit.subreddit('cats').top(limit=3)]
+
+    reddit = open_reddit_instance(credentials, http_cache=REPLAY, http_cache_dir=cache_dir, **config)
+    assert recorded == [s.id for s in reddit.subreddit('cats').top(limit=3)]
+    for dirpath, _, filenames in os.walk(cache_dir):
+        for filename in filenames:
+            with open(op.join(dirpath, filename), 'r') as file:
+                assert 'token-fake_client' not in file.read()
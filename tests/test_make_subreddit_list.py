@@ -0,0 +1,124 @@
+import os.path as op
+
+import pytest
+
+from subreddit_recommender.src.data import make_subreddit_list
+from subreddit_recommender.src.data.make_subreddit_list import (TooManyRequestsError,
+                                                                diff_subreddit_lists,
+                                                                get_categorized_subreddit_list,
+                                                                parse_subreddit_list)
+
+PAGE = b'''<html><head><title>listofsubreddits</title></head><body>
+<h1>Intro</h1><a href="/r/ignored">/r/ignored</a>
+<h1>General Content</h1>
+<h2>Animals</h2><p>Some text <a href="/r/cats">/r/cats</a></p><a href="/r/dogs">/r/dogs</a>
+<h1>Discussion</h1><a href="/r/askreddit">/r/askreddit</a><a href="https://example.com">example.com</a>
+</body></html>'''
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(self.status_code)
+
+
+class FakeSession(object):
+    """Serves PAGE with an ETag, answering 304 to a matching If-None-Match."""
+
+    def __init__(self, page=PAGE, etag='"v1"', n_rate_limited=0):
+        self.page = page
+        self.etag = etag
+        self.n_rate_limited = n_rate_limited
+        self.requests = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests.append(headers)
+        if self.n_rate_limited > 0:
+            self.n_rate_limited -= 1
+            return FakeResponse(429)
+        if headers.get('If-None-Match') == self.etag:
+            return FakeResponse(304)
+        return FakeResponse(200, self.page, {'ETag': self.etag})
+
+
+@pytest.fixture
+def raw_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(make_subreddit_list, 'data_dir_file', lambda name, subdir: str(tmpdir.join(name)))
+    monkeypatch.setattr(make_subreddit_list, 'env_var', lambda var: 'test-agent')
+    monkeypatch.setattr(make_subreddit_list.time, 'sleep', lambda seconds: None)
+    return tmpdir
+
+
+def test_parse_subreddit_list():
+    expected = {'General Content': {'Animals': ['/r/cats', '/r/dogs']},
+                'Discussion': {'Discussion': ['/r/askreddit']}}
+    assert expected == parse_subreddit_list(PAGE)
+
+
+def test_diff_subreddit_lists():
+    old = {'A': {'B': ['/r/cats', '/r/dogs']}}
+    new = {'A': {'B': ['/r/cats'], 'C': ['/r/dogs', '/r/fish']}}
+    diff = diff_subreddit_lists(old, new)
+    assert [['A', 'C', '/r/dogs'], ['A', 'C', '/r/fish']] == diff['added']
+    assert [['A', 'B', '/r/dogs']] == diff['removed']
+
+
+def test_conditional_refresh(raw_dir):
+    session = FakeSession()
+    diff = get_categorized_subreddit_list(session=session)
+    assert 3 == len(diff['added'])
+    assert op.exists(str(raw_dir.join('subreddit_list.html')))
+    assert 'If-None-Match' not in session.requests[0]
+
+    diff = get_categorized_subreddit_list(session=session)
+    assert '"v1"' == session.requests[1]['If-None-Match']
+    assert [] == diff['added'] == diff['removed']
+    # the additions of the first refresh are still pending
+    assert 3 == len(make_subreddit_list.added_subreddits())
+
+    session.page = PAGE.replace(b'/r/askreddit', b'/r/aww')
+    session.etag = '"v2"'
+    diff = get_categorized_subreddit_list(session=session)
+    assert [['Discussion', 'Discussion', '/r/aww']] == diff['added']
+    assert [['Discussion', 'Discussion', '/r/askreddit']] == diff['removed']
+    assert {('Discussion', 'Discussion', '/r/aww')} == make_subreddit_list.added_subreddits()
+
+
+def test_unchanged_list_keeps_pending_additions(raw_dir):
+    session = FakeSession()
+    get_categorized_subreddit_list(session=session)
+    session.page = PAGE.replace(b'/r/askreddit', b'/r/aww')
+    session.etag = '"v2"'
+    get_categorized_subreddit_list(session=session)
+
+    diff = get_categorized_subreddit_list(session=session)
+    assert '"v2"' == session.requests[-1]['If-None-Match']
+    assert [] == diff['added']
+    assert {('Discussion', 'Discussion', '/r/aww')} == make_subreddit_list.added_subreddits()
+
+
+def test_failed_parse_keeps_old_etag(raw_dir, monkeypatch):
+    session = FakeSession()
+    get_categorized_subreddit_list(session=session)
+
+    session.page = PAGE.replace(b'/r/askreddit', b'/r/aww')
+    session.etag = '"v2"'
+    monkeypatch.setattr(make_subreddit_list, 'parse_subreddit_list', lambda content: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        get_categorized_subreddit_list(session=session)
+
+    monkeypatch.setattr(make_subreddit_list, 'parse_subreddit_list', parse_subreddit_list)
+    diff = get_categorized_subreddit_list(session=session)
+    assert '"v1"' == session.requests[-1]['If-None-Match']
+    assert [['Discussion', 'Discussion', '/r/aww']] == diff['added']
+
+
+def test_retry_gives_up(raw_dir):
+    assert get_categorized_subreddit_list(session=FakeSession(n_rate_limited=2), max_retries=2)
+    with pytest.raises(TooManyRequestsError):
+        get_categorized_subreddit_list(session=FakeSession(n_rate_limited=3), max_retries=2)
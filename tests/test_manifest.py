@@ -0,0 +1,73 @@
+import os.path as op
+
+import pytest
+
+from subreddit_recommender.src.data.manifest import (COMPLETE, FAILED,
+                                                     Manifest, parse_duration,
+                                                     subreddit_key)
+
+CATS = ('Animals', 'Cats', '/r/cats')
+DOGS = ('Animals', 'Dogs', '/r/dogs')
+
+
+@pytest.fixture
+def manifest_path(tmpdir):
+    return op.join(str(tmpdir), 'manifest.jsonl')
+
+
+def test_parse_duration():
+    assert 90 == parse_duration('90')
+    assert 30 * 60 == parse_duration('30m')
+    assert 12 * 60 * 60 == parse_duration('12h')
+    assert 7 * 24 * 60 * 60 == parse_duration('7d')
+    with pytest.raises(ValueError):
+        parse_duration('soon')
+
+
+def test_subreddit_key():
+    assert 'Animals/Cats/cats' == subreddit_key(CATS)
+
+
+def test_manifest_persists_latest_record(manifest_path):
+    manifest = Manifest(manifest_path)
+    manifest.record(CATS, FAILED)
+    manifest.record(CATS, COMPLETE, submission_ids=['a', 'b'])
+
+    reloaded = Manifest(manifest_path)
+    assert CATS in reloaded
+    assert DOGS not in reloaded
+    assert ['a', 'b'] == reloaded.get(CATS)['submission_ids']
+    assert reloaded.is_complete(CATS)
+
+
+def test_manifest_ignores_partial_line(manifest_path):
+    Manifest(manifest_path).record(CATS, COMPLETE)
+    with open(manifest_path, 'a') as file:
+        file.write('{"key": "Animals/Dogs/do')
+    manifest = Manifest(manifest_path)
+    assert 1 == len(manifest)
+
+    manifest.record(DOGS, COMPLETE)
+    reloaded = Manifest(manifest_path)
+    assert 2 == len(reloaded)
+    assert COMPLETE == reloaded.get(DOGS)['status']
+
+
+def test_manifest_pending(manifest_path):
+    manifest = Manifest(manifest_path)
+    manifest.record(CATS, COMPLETE, timestamp=1000)
+    manifest.record(DOGS, FAILED, timestamp=1000)
+
+    assert [DOGS] == manifest.pending([CATS, DOGS])
+    assert [DOGS] == manifest.pending([CATS, DOGS], max_age=100, now=1050)
+    assert [CATS, DOGS] == manifest.pending([CATS, DOGS], max_age=10, now=1050)
+
+
+def test_manifest_compact(manifest_path):
+    manifest = Manifest(manifest_path)
+    for _ in range(3):
+        manifest.record(CATS, COMPLETE)
+    manifest.compact()
+    with open(manifest_path) as file:
+        assert 1 == len(file.readlines())
+    assert Manifest(manifest_path).is_complete(CATS)
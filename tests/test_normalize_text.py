@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from subreddit_recommender.src.data.corpus_store import CorpusReader, CorpusWriter
+from subreddit_recommender.src.data.download_reddit_data import _decode_utf
+from subreddit_recommender.src.data.normalize_text import (fold_unicode, normalize_corpus,
+                                                           normalize_text)
+
+
+def test_fold_unicode():
+    assert 'fine strasse' == fold_unicode('ﬁne STRASSE')
+    assert 'café' == fold_unicode('Café')
+    assert 'cafe' == fold_unicode('Café', strip_accents=True)
+    assert 'кошки' == fold_unicode('Кошки')
+
+
+def test_normalize_text():
+    text = '**Bold** [a link](https://example.com) &amp; www.reddit.com/r/cats\n\n  >quoted   text\t\n'
+    assert 'bold a link &\nquoted text' == normalize_text(text)
+
+
+def test_decode_utf_keeps_non_ascii():
+    assert 'Ñandú 猫' == _decode_utf('Ñandú 猫')
+    assert 'Ñandú' == _decode_utf('Ñandú'.encode('utf-8'))
+
+
+def test_normalize_corpus_caches_documents(tmpdir):
+    source, out = str(tmpdir.join('raw')), str(tmpdir.join('normalized'))
+    with CorpusWriter(source) as writer:
+        writer.add_subreddit(('A', 'B', 'cats'), 'Les CHATS', ['Chat  *noir*', 'Кошка'])
+        writer.add_subreddit(('A', 'B', 'dogs'), 'Dogs', ['Woof'])
+
+    assert 5 == normalize_corpus(source, out, processes=2, verbose=0)
+    assert 0 == normalize_corpus(source, out, processes=2, verbose=0)
+
+    with CorpusWriter(source) as writer:
+        writer.add(('A', 'B', 'dogs'), 'sub_0', 'WOOF woof')
+    assert 1 == normalize_corpus(source, out, processes=2, verbose=0)
+
+    with CorpusReader(out) as reader:
+        assert 'chat noir' == reader.text('A/B/cats', 'sub_0')
+        assert 'кошка' == reader.text('A/B/cats', 'sub_1')
+        assert 'woof woof' == reader.text('A/B/dogs', 'sub_0')
+
+
+def test_normalize_raw_tree(tmpdir):
+    tmpdir.join('raw', 'A', 'B', 'cats', 'description').write_text('Über  Katzen', encoding='utf-8', ensure=True)
+    out = str(tmpdir.join('normalized'))
+    assert 1 == normalize_corpus(str(tmpdir.join('raw')), out, processes=1, verbose=0)
+    with CorpusReader(out) as reader:
+        assert 'über katzen' == reader.text('A/B/cats', 'description')
+
+
+def test_normalize_corpus_drops_removed_documents(tmpdir):
+    source, out = str(tmpdir.join('raw')), str(tmpdir.join('normalized'))
+    tmpdir.join('raw', 'A', 'B', 'dogs', 'description').write_text('Dogs', encoding='utf-8', ensure=True)
+    for i, text in enumerate(['one', 'two', 'three']):
+        tmpdir.join('raw', 'A', 'B', 'cats', 'sub_{i}'.format(i=i)).write_text(text, encoding='utf-8', ensure=True)
+    assert 4 == normalize_corpus(source, out, processes=1, verbose=0)
+
+    tmpdir.join('raw', 'A', 'B', 'cats', 'sub_1').remove()
+    tmpdir.join('raw', 'A', 'B', 'cats', 'sub_2').remove()
+    tmpdir.join('raw', 'A', 'B', 'dogs').remove()
+    assert 1 == normalize_corpus(source, out, processes=1, verbose=0)
+    assert 0 == normalize_corpus(source, out, processes=1, verbose=0)
+
+    with CorpusReader(out) as reader:
+        assert ['A/B/cats'] == reader.subreddits()
+        assert ['sub_0'] == reader.documents('A/B/cats')
+        assert 'one' == reader.text('A/B/cats', 'sub_0')
@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pytest
+
+from subreddit_recommender.src.models.ann_index import AnnIndex
+from subreddit_recommender.src.models.recommend import recommend_batch, recommend_file
+
+
+@pytest.fixture(scope='module')
+def index():
+    rng = np.random.RandomState(1)
+    keys = ['Cat/Sub{s}/sub{i}'.format(s=i % 4, i=i) for i in range(60)] + ['Other/Sub0/sub0']
+    return AnnIndex.build(keys, rng.randn(61, 16), n_tables=2, n_bits=4)
+
+
+def naive_recommendations(index, rows, k):
+    user = np.mean([index.vectors[r] for r in rows], axis=0)
+    scores = index.vectors.dot(user / np.linalg.norm(user))
+    names = set(index.keys[r].split('/')[-1] for r in rows)
+    recommended = []
+    for r in np.argsort(-scores, kind='mergesort'):
+        name = index.keys[r].split('/')[-1]
+        if name not in names:
+            names.add(name)
+            recommended.append(tuple(index.keys[r].split('/')))
+    return recommended[:k]
+
+
+def test_recommend_batch_matches_naive_loop(index):
+    rng = np.random.RandomState(2)
+    users = [['Cat/Sub{s}/sub{i}'.format(s=i % 4, i=i) for i in rng.choice(60, size=rng.randint(1, 6), replace=False)]
+             for _ in range(25)]
+    results = list(recommend_batch(index, users, k=5, chunk_size=7))
+    assert 25 == len(results)
+    for subreddits, recommended in zip(users, results):
+        rows = [index.row(s) for s in subreddits]
+        assert naive_recommendations(index, rows, 5) == [key for key, _ in recommended]
+
+
+def test_names_and_unknown_subreddits(index):
+    by_name, unknown = recommend_batch(index, [['/r/sub0'], ['/r/nope']], k=3)
+    assert 3 == len(by_name)
+    # a bare name follows the subreddit in every category it is listed in
+    assert not {('Cat', 'Sub0', 'sub0'), ('Other', 'Sub0', 'sub0')} & set(key for key, _ in by_name)
+    assert [] == unknown
+
+
+def test_other_listings_are_masked_and_deduplicated():
+    keys = ['A/X/cats', 'B/Y/cats', 'A/X/dogs', 'B/Y/dogs', 'A/X/fish']
+    vectors = np.array([[1, 0], [1, 0.01], [0.9, 0.1], [0.9, 0.11], [0, 1]])
+    index = AnnIndex.build(keys, vectors, n_tables=1, n_bits=2)
+    recommended, = recommend_batch(index, [['A/X/cats']], k=2)
+    assert [('A', 'X', 'dogs'), ('A', 'X', 'fish')] == [key for key, _ in recommended]
+
+
+def test_recommend_file(index, tmpdir):
+    users = tmpdir.join('users.jsonl')
+    users.write('\n'.join(json.dumps({'user': u, 'subreddits': [('Cat', 'Sub1', '/r/sub1')]}) for u in 'abc'))
+    assert 3 == recommend_file(str(users), str(tmpdir.join('out.jsonl')), index, k=2, chunk_size=2)
+    lines = [json.loads(line) for line in tmpdir.join('out.jsonl').readlines()]
+    assert ['a', 'b', 'c'] == [line['user'] for line in lines]
+    assert 4 == len(lines[0]['recommendations'][0])
@@ -0,0 +1,84 @@
+import threading
+import time
+
+from subreddit_recommender.src.data.scheduler import (DEFAULT_BUDGET,
+                                                      CredentialPool,
+                                                      WorkStealingQueue,
+                                                      rate_limit_budget)
+
+
+class FakeRateLimiter(object):
+    def __init__(self, remaining, reset_timestamp):
+        self.remaining = remaining
+        self.reset_timestamp = reset_timestamp
+
+
+class FakeCore(object):
+    def __init__(self, remaining=None, reset_timestamp=None):
+        self._rate_limiter = FakeRateLimiter(remaining, reset_timestamp)
+
+
+class FakeReddit(object):
+    def __init__(self, remaining=None, reset_timestamp=None):
+        self._core = FakeCore(remaining, reset_timestamp)
+
+
+def test_work_stealing_queue_own_work_first():
+    queue = WorkStealingQueue(list(range(6)), n_workers=2)
+    assert 0 == queue.get(0)
+    assert 1 == queue.get(1)
+    assert 4 == len(queue)
+
+
+def test_work_stealing_queue_steals_from_busiest_peer():
+    queue = WorkStealingQueue(list(range(5)), n_workers=3)  # [0, 3], [1, 4], [2]
+    assert 0 == queue.get(0)
+    assert 2 == queue.get(2)
+    assert 4 == queue.get(2)  # stolen from the back of worker 1
+    assert 1 == queue.steals
+    assert [3, 1] == [queue.get(0), queue.get(1)]
+    assert queue.get(1) is None
+
+
+def test_work_stealing_queue_threads_drain_everything():
+    items = list(range(1000))
+    queue = WorkStealingQueue(items, n_workers=4)
+    results = [[] for _ in range(4)]
+
+    def drain(worker_id):
+        while True:
+            item = queue.get(worker_id)
+            if item is None:
+                return
+            results[worker_id].append(item)
+
+    threads = [threading.Thread(target=drain, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert items == sorted(sum(results, []))
+
+
+def test_rate_limit_budget():
+    now = time.time()
+    assert DEFAULT_BUDGET == rate_limit_budget(FakeReddit())
+    assert 10 == rate_limit_budget(FakeReddit(remaining=10, reset_timestamp=now + 60))
+    assert DEFAULT_BUDGET == rate_limit_budget(FakeReddit(remaining=10, reset_timestamp=now - 1))
+
+
+def test_credential_pool_prefers_most_budget():
+    now = time.time()
+    low, high = FakeReddit(5, now + 60), FakeReddit(8, now + 60)
+    pool = CredentialPool([low, high])
+
+    with pool.lease() as first:
+        assert high is first
+        with pool.lease() as second:
+            assert high is second
+            with pool.lease() as third:
+                # high has 8 - 2 outstanding leases, low has 5
+                assert high is third
+                with pool.lease() as fourth:
+                    assert low is fourth
+    assert [8, 5] == [pool.budget(1), pool.budget(0)]
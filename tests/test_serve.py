@@ -0,0 +1,116 @@
+import asyncio
+import socket
+
+import numpy as np
+import pytest
+import requests
+
+from subreddit_recommender.src.models.ann_index import AnnIndex
+from subreddit_recommender.src.models import serve
+from subreddit_recommender.src.models.recommend import SubredditResolver
+from subreddit_recommender.src.models.serve import (RecommendationServer, TTLCache, parse_query,
+                                                    recommend_one)
+
+
+@pytest.fixture(scope='module')
+def index_path(tmpdir_factory):
+    path = str(tmpdir_factory.mktemp('index'))
+    keys = ['Cat{c}/Sub/sub{i}'.format(c=i % 2, i=i) for i in range(40)]
+    AnnIndex.build(keys, np.random.RandomState(0).randn(40, 8), n_tables=4, n_bits=3).save(path)
+    return path
+
+
+def test_ttl_cache():
+    now = [0.0]
+    cache = TTLCache(max_size=2, ttl=10, clock=lambda: now[0])
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert 1 == cache.get('a')
+    cache.put('c', 3)  # evicts b, the least recently used
+    assert cache.get('b') is None
+    now[0] = 11
+    assert cache.get('a') is None
+
+
+def test_parse_query():
+    assert (('cats', 'dogs'), 5, None) == parse_query('subreddits=Dogs,cats&subreddits=dogs&k=5')
+    assert (('/r/cats', 'Animals/Cats/cats'), 10, None) == parse_query('subreddits=Animals/Cats/cats,/r/Cats')
+    with pytest.raises(ValueError):
+        parse_query('k=5')
+
+
+def test_recommend_one_skips_other_listings():
+    keys = ['A/X/cats', 'B/Y/cats', 'A/X/dogs', 'B/Y/dogs', 'A/X/fish']
+    vectors = np.array([[1, 0], [1, 0.01], [0.9, 0.1], [0.9, 0.11], [0, 1]])
+    index = AnnIndex.build(keys, vectors, n_tables=1, n_bits=2)
+    recommended = recommend_one(index, SubredditResolver(keys), ['A/X/cats'], k=2)
+    assert [['A', 'X', 'dogs'], ['A', 'X', 'fish']] == [r[:3] for r in recommended]
+
+
+def test_server(index_path):
+    with RecommendationServer(index_path, port=0) as server:
+        session = requests.Session()
+        url = server.url + '/recommend'
+        response = session.get(url, params={'subreddits': 'sub1,sub3', 'k': 5, 'category': 'Cat1'})
+        assert 200 == response.status_code
+        recommendations = response.json()['recommendations']
+        assert 5 == len(recommendations)
+        assert all(r[0] == 'Cat1' and r[2] not in ('sub1', 'sub3') for r in recommendations)
+
+        assert recommendations == session.get(url, params={'subreddits': 'sub3,sub1', 'k': 5,
+                                                           'category': 'Cat1'}).json()['recommendations']
+        assert 400 == session.get(url).status_code
+        assert 404 == session.get(server.url + '/nope').status_code
+        response = session.post(url, data=b'GET /nope HTTP/1.1\r\n\r\n')
+        assert 405 == response.status_code
+        assert 'GET' == response.headers['Allow']
+        # the body was skipped, the connection is still in sync
+        assert 200 == session.get(server.url + '/health').status_code
+        assert 5 == len(session.get(url, params={'subreddits': 'Cat1/Sub/sub1', 'k': 5}).json()['recommendations'])
+
+        metrics = session.get(server.url + '/metrics').json()
+        assert 1 == metrics['cache_hits']
+        assert 2 == metrics['computed']
+        assert metrics['latency_p50_ms'] <= metrics['latency_p99_ms']
+
+
+def test_malformed_request_line(index_path):
+    with RecommendationServer(index_path, port=0) as server:
+        with socket.create_connection((server.host, server.port), timeout=5) as connection:
+            connection.sendall(b'garbage\r\n\r\n')
+            response = connection.makefile('rb').read()
+    assert response.startswith(b'HTTP/1.1 400 Bad Request\r\n')
+    assert b'Connection: close' in response
+
+
+def test_identical_requests_are_coalesced(index_path):
+    server = RecommendationServer(index_path)
+    server._loop = asyncio.new_event_loop()
+    query = (('sub1',), 3, None)
+
+    async def identical_requests():
+        return await asyncio.gather(*[server.recommend(query) for _ in range(5)])
+
+    try:
+        results = server._loop.run_until_complete(identical_requests())
+    finally:
+        server._loop.close()
+    assert all(r == results[0] for r in results)
+    assert 1 == server.stats['computed']
+    assert 4 == server.stats['coalesced']
+
+
+def test_results_of_a_replaced_version_are_not_cached(index_path, monkeypatch):
+    server = RecommendationServer(index_path)
+    server._loop = asyncio.new_event_loop()
+
+    def recommend_during_swap(*args):
+        server.version = 'next'
+        return []
+
+    monkeypatch.setattr(serve, 'recommend_one', recommend_during_swap)
+    try:
+        server._loop.run_until_complete(server.recommend((('sub1',), 3, None)))
+    finally:
+        server._loop.close()
+    assert 0 == len(server.cache)
@@ -0,0 +1,102 @@
+import os
+import os.path as op
+
+import praw
+import pytest
+
+from subreddit_recommender.src.data.corpus_store import CorpusWriter
+from subreddit_recommender.src.data.download_reddit_data import (TreeWriter,
+                                                                 download_reddit_data_threaded,
+                                                                 open_reddit_instance)
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+from subreddit_recommender.src.data.manifest import COMPLETE, FAILED, Manifest
+from subreddit_recommender.src.data.sharding import (PACKED_DIRNAME,
+                                                     TREE_DIRNAME,
+                                                     merge_shards, parse_shard,
+                                                     select_shard, shard_of,
+                                                     shard_partition_dir,
+                                                     write_shard_info)
+from subreddit_recommender.src.data.wiki_harvest import WIKI_DIRNAME, harvest_wikis
+
+
+def test_parse_shard():
+    assert (0, 4) == parse_shard('0/4')
+    assert (3, 4) == parse_shard(' 3 / 4 ')
+    for invalid in ['4/4', '1', 'a/b', '-1/4']:
+        with pytest.raises(ValueError):
+            parse_shard(invalid)
+
+
+def test_shard_assignment_is_stable():
+    tuples = [('Animals', 'Pets', 'r{i}'.format(i=i)) for i in range(12)]
+    assert [1, 3, 0, 3, 2, 1, 0, 2, 3, 3, 0, 0] == [shard_of(t, 4) for t in tuples]
+    shards = [select_shard(tuples, i, 4) for i in range(4)]
+    assert sorted(tuples) == sorted(t for shard in shards for t in shard)
+    assert 0 == shard_of(('Animals', 'Pets', '/r/r2'), 4)
+
+
+def _crawl_shard(server, root, shard, n_shards, subreddit_tuples, packed):
+    partition_dir = shard_partition_dir(shard, n_shards, root=root)
+    assigned = select_shard(subreddit_tuples, shard, n_shards)
+    write_shard_info(partition_dir, shard, n_shards, assigned)
+    config = server.praw_config()
+    credentials = config.pop('client_id'), config.pop('client_secret')
+    config.pop('user_agent')
+    reddit = open_reddit_instance(credentials, **config)
+    if packed:
+        writer = CorpusWriter(op.join(partition_dir, PACKED_DIRNAME))
+    else:
+        writer = TreeWriter(op.join(partition_dir, TREE_DIRNAME))
+    manifest = Manifest.in_directory(partition_dir)
+    download_reddit_data_threaded(assigned, [reddit], top_n_submissions=2, comment_depth=1, n_threads=2,
+                                  manifest=manifest, corpus_writer=writer, verbose=0)
+    writer.close()
+    return manifest, assigned
+
+
+def test_merge_shards(tmpdir):
+    names = ['s{i}'.format(i=i) for i in range(6)]
+    subreddit_tuples = [('Cat', 'Sub', name) for name in names]
+    root, out_dir = str(tmpdir.join('shards')), str(tmpdir.join('reddit_raw'))
+    with FakeRedditServer(names, n_submissions=2, top_level_comments=2) as server:
+        manifests = [_crawl_shard(server, root, i, 2, subreddit_tuples, packed=i == 1) for i in range(2)]
+
+    report = merge_shards(2, root=root, out_dir=out_dir, verbose=0)
+    assert report['complete']
+    assert 6 == report['n_merged']
+    for name in names:
+        assert ['description', 'sub_0', 'sub_1'] == sorted(os.listdir(op.join(out_dir, 'Cat', 'Sub', name)))
+    assert 6 == len(Manifest.in_directory(out_dir))
+
+    manifest, assigned = manifests[0]
+    manifest.record(assigned[0], FAILED)
+    extra = ('Cat', 'Sub', 'not_in_any_shard')
+    report = merge_shards(2, root=root, out_dir=str(tmpdir.join('again')), verbose=0,
+                          subreddit_tuples=subreddit_tuples + [extra])
+    assert not report['complete']
+    assert sorted(['Cat/Sub/' + assigned[0][2], 'Cat/Sub/not_in_any_shard']) == report['missing']
+    assert ['Cat/Sub/' + assigned[0][2]] == report['failed']
+    assert ['Cat/Sub/not_in_any_shard'] == report['unassigned']
+
+    report = merge_shards(3, root=root, out_dir=str(tmpdir.join('three')), verbose=0)
+    assert [0, 1, 2] == report['missing_shards']
+
+
+def test_merge_shards_merges_wikis(tmpdir):
+    subreddit_tuples = [('Cat', 'Sub', 's{i}'.format(i=i)) for i in range(4)]
+    root, wiki_out_dir = str(tmpdir.join('shards')), str(tmpdir.join('reddit_wiki'))
+    with FakeRedditServer([t[2] for t in subreddit_tuples], wiki_pages=2, wiki_page_words=5) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        for shard in range(2):
+            partition_dir = shard_partition_dir(shard, 2, root=root)
+            assigned = select_shard(subreddit_tuples, shard, 2)
+            write_shard_info(partition_dir, shard, 2, assigned)
+            harvest_wikis(assigned, [reddit], out_dir=op.join(partition_dir, WIKI_DIRNAME), n_threads=1, verbose=0)
+
+    report = merge_shards(2, root=root, out_dir=str(tmpdir.join('reddit_raw')), wiki_out_dir=wiki_out_dir, verbose=0)
+    assert 4 == report['n_wikis_merged']
+    for t in subreddit_tuples:
+        assert ['wiki_index', 'wiki_page1'] == sorted(os.listdir(op.join(wiki_out_dir, *t)))
+        record = Manifest.in_directory(wiki_out_dir).get(t)
+        assert COMPLETE == record['status']
+        assert '{sub}-page1-r1'.format(sub=t[2]) == record['pages']['page1']['revision']
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('sklearn')
+
+from subreddit_recommender.src.data.corpus_store import CorpusWriter  # noqa: E402
+from subreddit_recommender.src.features.tfidf import build_tfidf, load_tfidf  # noqa: E402
+
+
+def write_tree(root, docs):
+    for key, texts in docs.items():
+        for doc_name, text in texts.items():
+            root.join(*key.split('/')).join(doc_name).write_text(text, encoding='utf-8', ensure=True)
+
+
+def test_build_tfidf_incremental(tmpdir):
+    corpus, out = tmpdir.join('raw'), str(tmpdir.join('tfidf'))
+    write_tree(corpus, {'A/B/cats': {'description': 'Cats!', 'sub_0': 'cats meow purr'},
+                        'A/B/dogs': {'description': 'Dogs', 'sub_0': 'dogs woof bark'},
+                        'A/C/kittens': {'sub_0': 'cats purr kittens'}})
+
+    assert 3 == build_tfidf(str(corpus), out, processes=2, chunk_size=2, n_features=2 ** 10, verbose=0)
+    tfidf, keys = load_tfidf(out)
+    assert ['A/B/cats', 'A/B/dogs', 'A/C/kittens'] == keys
+    assert (3, 2 ** 10) == tfidf.shape
+    np.testing.assert_allclose(1.0, np.sqrt(tfidf.multiply(tfidf).sum(axis=1)).A.ravel(), rtol=1e-5)
+    similarity = (tfidf * tfidf.T).toarray()
+    assert similarity[0, 2] > similarity[0, 1]
+
+    assert 0 == build_tfidf(str(corpus), out, incremental=True, processes=1, n_features=2 ** 10, verbose=0)
+
+    write_tree(corpus, {'A/B/dogs': {'sub_0': 'cats meow purr purr'}, 'A/B/fish': {'sub_0': 'blub'}})
+    assert 2 == build_tfidf(str(corpus), out, incremental=True, processes=1, n_features=2 ** 10, verbose=0)
+
+    incremental, keys = load_tfidf(out)
+    build_tfidf(str(corpus), out, processes=1, n_features=2 ** 10, verbose=0)
+    full, full_keys = load_tfidf(out)
+    assert full_keys == keys == ['A/B/cats', 'A/B/dogs', 'A/B/fish', 'A/C/kittens']
+    np.testing.assert_allclose(full.toarray(), incremental.toarray(), rtol=1e-6)
+
+
+def test_build_tfidf_from_packed_store(tmpdir):
+    with CorpusWriter(str(tmpdir.join('packed'))) as writer:
+        writer.add_subreddit(('A', 'B', 'cats'), 'Cats', ['meow'])
+        writer.add_subreddit(('A', 'B', 'dogs'), 'Dogs', ['woof'])
+    out = str(tmpdir.join('tfidf'))
+    assert 2 == build_tfidf(str(tmpdir.join('packed')), out, processes=1, n_features=2 ** 8, verbose=0)
+
+    with CorpusWriter(str(tmpdir.join('packed'))) as writer:
+        writer.add_subreddit(('A', 'B', 'dogs'), 'Dogs', ['woof', 'bark'])
+    assert 1 == build_tfidf(str(tmpdir.join('packed')), out, incremental=True, processes=1, n_features=2 ** 8,
+                            verbose=0)
@@ -0,0 +1,62 @@
+import pickle
+from multiprocessing import Pool
+
+import numpy as np
+
+from subreddit_recommender.src.data.corpus_store import CorpusWriter
+from subreddit_recommender.src.features.corpus import SubredditCorpus
+from subreddit_recommender.src.features.token_corpus import (TokenCorpus,
+                                                             build_token_corpus)
+
+
+def _sum_partition(args):
+    corpus, documents = args
+    assert isinstance(corpus.tokens, np.memmap)
+    return sum(int(corpus.document(i).astype(np.int64).sum()) for i in documents)
+
+
+def _write_store(path):
+    with CorpusWriter(path) as writer:
+        writer.add_subreddit(('A', 'B', 'cats'), 'Cats!', ['cats meow purr', 'purr purr'])
+        writer.add_subreddit(('A', 'B', 'dogs'), 'Dogs', ['dogs woof bark', 'Woof'])
+        writer.add_subreddit(('A', 'C', 'kittens'), '', ['cats purr kittens'])
+
+
+def test_build_token_corpus(tmpdir):
+    _write_store(str(tmpdir.join('packed')))
+    out = str(tmpdir.join('tokens'))
+    corpus = build_token_corpus(str(tmpdir.join('packed')), out, processes=2, chunk_size=1, verbose=0)
+
+    assert ['A/B/cats', 'A/B/dogs', 'A/C/kittens'] == corpus.keys
+    assert 8 == len(corpus)
+    assert 'purr' == corpus.words[0]
+    assert ['cats', 'meow', 'purr'] == corpus.decode(corpus.document(1))
+    assert ['dogs', 'dogs', 'woof', 'bark', 'woof'] == corpus.decode(corpus.subreddit_tokens('A/B/dogs'))
+    assert corpus.document(1).base is not None
+    assert not corpus.tokens.flags.writeable
+    assert corpus.word_id('woof') == corpus.document(5)[0]
+
+    expected = [(d.words, d.tags) for d in SubredditCorpus(str(tmpdir.join('packed')))]
+    assert expected == [(d.words, d.tags) for d in corpus.tagged_documents()]
+
+    rare = build_token_corpus(str(tmpdir.join('packed')), out, min_count=2, processes=1, verbose=0)
+    assert ['purr', 'cats', 'dogs', 'woof'] == rare.words.tolist()
+    assert ['cats', 'purr'] == rare.decode(rare.document(1))
+    assert ['dogs', 'woof'] == rare.decode(rare.document(4))
+
+
+def test_token_corpus_is_shared_with_workers(tmpdir):
+    _write_store(str(tmpdir.join('packed')))
+    corpus = build_token_corpus(str(tmpdir.join('packed')), str(tmpdir.join('tokens')), processes=1, verbose=0)
+    assert len(pickle.dumps(corpus)) < 500
+
+    partitions = corpus.partitions(3)
+    assert list(range(len(corpus))) == [i for documents in partitions for i in documents]
+    pool = Pool(2)
+    try:
+        sums = pool.map(_sum_partition, [(corpus, documents) for documents in partitions])
+    finally:
+        pool.close()
+        pool.join()
+    assert int(corpus.tokens.astype(np.int64).sum()) == sum(sums)
+    assert isinstance(pickle.loads(pickle.dumps(corpus)), TokenCorpus)
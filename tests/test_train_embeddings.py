@@ -0,0 +1,30 @@
+import pytest
+
+gensim = pytest.importorskip('gensim')
+
+from subreddit_recommender.src.features.corpus import SubredditCorpus  # noqa: E402
+from subreddit_recommender.src.models import train_embeddings  # noqa: E402
+from subreddit_recommender.src.models.train_embeddings import load_model, train  # noqa: E402
+
+
+@pytest.fixture
+def corpus(tmpdir):
+    for i, subreddit in enumerate(['cats', 'dogs', 'fish']):
+        for j in range(3):
+            text = ' '.join(['pets', 'animals', subreddit, 'food', 'water'] * (i + j + 1))
+            path = tmpdir.join('raw', 'Animals', 'Pets', subreddit, 'sub_{j}'.format(j=j))
+            path.write_text(text, encoding='utf-8', ensure=True)
+    return SubredditCorpus(str(tmpdir.join('raw')))
+
+
+@pytest.mark.parametrize('kind', ['doc2vec', 'word2vec'])
+def test_train_and_mmap_load(kind, corpus, tmpdir, monkeypatch):
+    monkeypatch.setattr(train_embeddings, 'models_dir', lambda subdir='': str(tmpdir.join('models', subdir)))
+    path = train(kind, corpus=corpus, epochs=2, vector_size=8, min_count=1, workers=2, verbose=0)
+    model = load_model(path, kind)
+    assert 'cats' in model.wv.vocab
+    if kind == 'doc2vec':
+        assert 8 == len(model.docvecs['Animals/Pets/cats'])
+
+    # resuming after the last epoch only saves the model again
+    assert path == train(kind, corpus=corpus, epochs=2, resume=True, vector_size=8, min_count=1, verbose=0)
@@ -0,0 +1,85 @@
+import time
+
+import numpy as np
+import requests
+
+from subreddit_recommender.src.data.manifest import COMPLETE, Manifest
+from subreddit_recommender.src.models.ann_index import (AnnIndex, current_version,
+                                                        save_version, version_meta)
+from subreddit_recommender.src.models.serve import RecommendationServer
+from subreddit_recommender.src.models.update_index import update_index
+
+
+class BagOfWordsModel(object):
+    """Stands in for a frozen Doc2Vec model: infers a vector by hashing words into 8 dimensions."""
+
+    def infer_vector(self, words, steps=5):
+        vector = np.zeros(8, dtype=np.float32)
+        for word in words:
+            vector[sum(map(ord, word)) % 8] += 1
+        return vector
+
+
+def build_index(n=30):
+    keys = ['A/B/sub{i}'.format(i=i) for i in range(n)]
+    return AnnIndex.build(keys, np.random.RandomState(0).randn(n, 8), n_tables=4, n_bits=3)
+
+
+def test_patched_matches_full_rebuild():
+    index = build_index()
+    updates = {'A/B/sub3': np.ones(8), ('A', 'C', '/r/new'): np.arange(8)}
+    patched = index.patched(updates)
+    assert 31 == len(patched) and 30 == len(index)
+
+    vectors = np.vstack([np.asarray(index.vectors), np.zeros((1, 8))])
+    vectors[3], vectors[30] = np.ones(8), np.arange(8)
+    rebuilt = AnnIndex.build(index.keys + ['A/C/new'], vectors, n_tables=4, n_bits=3)
+    np.testing.assert_array_equal(rebuilt.sorted_codes, patched.sorted_codes)
+    np.testing.assert_array_equal(rebuilt.codes(), patched.codes())
+    expected, actual = rebuilt.similar('A/C/new', k=5), patched.similar('A/C/new', k=5)
+    assert [key for key, _ in expected] == [key for key, _ in actual]
+
+
+def test_save_version(tmpdir):
+    root = str(tmpdir)
+    for i in range(4):
+        assert 'v{i:06d}'.format(i=i + 1) == save_version(build_index(), root, keep=2)
+    assert 'v000004' == current_version(root)
+    assert 'v000003' == version_meta(root)['parent']
+    assert ['CURRENT', 'v000003', 'v000004'] == sorted(p.basename for p in tmpdir.listdir())
+    assert 30 == len(AnnIndex.load(root))
+
+
+def test_update_index_from_manifest(tmpdir):
+    root, corpus = str(tmpdir.join('index')), tmpdir.join('raw')
+    save_version(build_index(), root)
+    manifest = Manifest(str(tmpdir.join('manifest.jsonl')))
+    assert update_index(BagOfWordsModel(), root, manifest=manifest, corpus_dir=str(corpus), verbose=0) is None
+
+    corpus.join('A', 'B', 'sub1', 'sub_0').write_text('cats cats dogs', encoding='utf-8', ensure=True)
+    corpus.join('A', 'C', 'fresh', 'sub_0').write_text('fish', encoding='utf-8', ensure=True)
+    manifest.record(('A', 'B', 'sub1'), COMPLETE)
+    manifest.record(('A', 'C', 'fresh'), COMPLETE)
+    manifest.record(('A', 'B', 'sub2'), COMPLETE, timestamp=time.time() - 3600)
+
+    assert 'v000002' == update_index(BagOfWordsModel(), root, manifest=manifest, corpus_dir=str(corpus), verbose=0)
+    assert ['A/B/sub1', 'A/C/fresh'] == version_meta(root)['updated']
+    index = AnnIndex.load(root)
+    assert 31 == len(index)
+    expected = BagOfWordsModel().infer_vector(['cats', 'cats', 'dogs'])
+    np.testing.assert_allclose(expected / np.linalg.norm(expected), index.vector('A/B/sub1'), rtol=1e-6)
+
+
+def test_server_swaps_to_new_version(tmpdir):
+    root = str(tmpdir)
+    save_version(build_index(), root)
+    with RecommendationServer(root, port=0, reload_interval=0.05) as server:
+        url = server.url + '/recommend'
+        assert [] == requests.get(url, params={'subreddits': 'new'}).json()['recommendations']
+
+        save_version(build_index().patched({'A/C/new': np.ones(8)}), root)
+        deadline = time.time() + 5
+        while server.version != 'v000002' and time.time() < deadline:
+            time.sleep(0.05)
+        assert 'v000002' == requests.get(server.url + '/metrics').json()['version']
+        assert 3 == len(requests.get(url, params={'subreddits': 'new', 'k': 3}).json()['recommendations'])
@@ -4,7 +4,8 @@ import os.path as op
 import pytest
 
 import subreddit_recommender
-from subreddit_recommender.src.util import (base_dir, data_dir,
+from subreddit_recommender.src.util import (Credentials, Settings, base_dir,
+                                            create_directories, data_dir,
                                             data_dir_subreddit, env_var,
                                             load_env, parse_client_ids,
                                             parse_env, strip_unwanted_chars,
@@ -72,6 +73,28 @@ def test_parse_client_ids(create_temp_env):
     client_ids = parse_client_ids()
     assert 2 == len(client_ids)
     assert ('test_client_id', 'test_client_secret') in client_ids
+    assert 'test_client_secret' == client_ids[0].client_secret
+
+
+def test_settings_reload_env(tmpdir):
+    env_path = tmpdir.join('.env')
+    env_path.write('CLIENT_0=id:secret:with:colons\n')
+    settings = Settings(base_dir=str(tmpdir))
+    assert [Credentials('id', 'secret:with:colons')] == settings.credentials()
+    assert settings.env() is settings.env()
+
+    env_path.write('CLIENT_0=id:secret\nCLIENT_1=other:key\n')
+    os.utime(str(env_path), (1, 1))
+    assert 2 == len(settings.credentials())
+
+    env_path.write('CLIENT_0=no_secret\n')
+    os.utime(str(env_path), (2, 2))
+    with pytest.raises(ValueError):
+        settings.credentials()
+
+    env_path.remove()
+    assert settings.env() is None
+    assert [] == settings.credentials()
 
 
 def test_base_dir():
@@ -94,6 +117,13 @@ def test_data_dir_subreddit():
     assert path == data_dir_subreddit((category, subcategory, subreddit))
 
 
+def test_create_directories(tmpdir):
+    paths = [str(tmpdir.join('a', 'b', name)) for name in ('c', 'd', 'c')] + [str(tmpdir.join('a'))]
+    assert 4 == create_directories(paths)
+    assert op.isdir(str(tmpdir.join('a', 'b', 'd')))
+    assert 0 == create_directories(paths)
+
+
 def test_valid_subreddit_dirname():
     assert 'AskReddit' == valid_subreddit_dirname('/r/AskReddit')
     assert '5050' == valid_subreddit_dirname('/r/50/50')
@@ -0,0 +1,53 @@
+import os
+import os.path as op
+
+import praw
+
+from subreddit_recommender.src.data.fake_reddit import FakeRedditServer
+from subreddit_recommender.src.data.manifest import COMPLETE, Manifest
+from subreddit_recommender.src.data.wiki_harvest import (harvest_subreddit_wiki,
+                                                         harvest_wikis,
+                                                         page_filename,
+                                                         page_order,
+                                                         truncate_utf8)
+
+PAGES = '/r/{subreddit}/wiki/{page}'
+
+
+def test_page_order_and_truncation():
+    assert ['index', 'a', 'faq/rules'] == page_order(['faq/rules', 'config/sidebar', 'index', 'a', 'a'])
+    assert 'wiki_faq%2Frules' == page_filename('faq/rules')
+    assert 'ab' == truncate_utf8('abé', 3)
+    assert 'abé' == truncate_utf8('abé', 4)
+
+
+def test_harvest_wikis_skips_unchanged_pages(tmpdir):
+    out = str(tmpdir)
+    tuples = [('A', 'B', 'cats'), ('A', 'B', 'dogs'), ('A', 'B', 'ghost')]
+    with FakeRedditServer(['cats', 'dogs'], wiki_pages=5, wiki_page_words=20) as server:
+        reddit = praw.Reddit(**server.praw_config())
+        stats = harvest_wikis(tuples, [reddit], out_dir=out, max_pages=3, n_threads=2, verbose=0)
+        assert (3, 6, 4) == (stats['subreddits'], stats['fetched'], stats['over_budget'])
+        assert 6 == server.requests[PAGES]
+        assert ['wiki_index', 'wiki_page1', 'wiki_page2'] == sorted(os.listdir(op.join(out, 'A', 'B', 'cats')))
+        record = Manifest.in_directory(out).get(('A', 'B', 'cats'))
+        assert COMPLETE == record['status']
+        assert 'cats-page1-r1' == record['pages']['page1']['revision']
+        assert {} == Manifest.in_directory(out).get(('A', 'B', 'ghost'))['pages']
+
+        server.edit_wiki_page('cats', 'page1')
+        server.reset_stats()
+        stats = harvest_wikis(tuples, [reddit], out_dir=out, max_pages=3, n_threads=2, verbose=0)
+        assert (1, 5) == (stats['fetched'], stats['unchanged'])
+        assert 1 == server.requests[PAGES]
+        record = Manifest.in_directory(out).get(('A', 'B', 'cats'))
+        assert 'cats-page1-r2' == record['pages']['page1']['revision']
+        with open(op.join(out, 'A', 'B', 'cats', 'wiki_page1'), 'r', encoding='utf-8') as file:
+            assert server.wiki_page_content('cats', 'page1') == file.read()
+
+        subreddit_dir = op.join(out, 'A', 'B', 'cats')
+        pages, stats = harvest_subreddit_wiki(reddit.subreddit('cats'), subreddit_dir, previous=record,
+                                              max_bytes=150)
+        assert stats['bytes'] <= 150
+        assert any(page['truncated'] for page in pages.values())
+        assert sorted(page_filename(name) for name in pages) == sorted(os.listdir(subreddit_dir))